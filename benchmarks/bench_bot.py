@@ -0,0 +1,268 @@
+'''
+    Drives a real `Bot` against a fake IRC server on the loopback interface 
+    and reports throughput, command-to-reply latency and CPU time.
+    
+    Each scenario runs the bot in a child process of its own, connected to a 
+    server stand-in in this process, so the CPU time reported is the bot's 
+    alone. The bot answers `.done` with its CPU time, which lets the server 
+    know when all of the lines sent before it have been handled.
+    
+    Scenarios:
+    
+        flood     PRIVMSG lines that match no command
+        names     a JOIN followed by a large NAMES reply
+        hooks     a PRIVMSG flood with many commands and events registered
+        latency   `.echo` commands sent one at a time, awaiting each reply
+    
+    Usage: python benchmarks/bench_bot.py [--lines N] [--hooks N] [--async]
+                                          [--log] [scenario ...]
+'''
+
+import os
+import sys
+import time
+import socket
+import signal
+import optparse
+import threading
+import Queue
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from irctk.bot import Bot
+
+
+NICK = 'Kaa'
+CHANNEL = '#bench'
+SERVER = 'bench.example.net'
+
+
+class FakeServer(object):
+    '''A stand-in for an IRC server that accepts a single client, welcomes 
+    it, confirms its JOINs and hands every PRIVMSG it sends to `replies`, 
+    along with the time it arrived.
+    '''
+    
+    def __init__(self):
+        self.listener = socket.socket()
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(1)
+        self.port = self.listener.getsockname()[1]
+        self.replies = Queue.Queue()
+        self.joined = threading.Event()
+        self.client = None
+    
+    def accept(self, timeout=30.0):
+        self.listener.settimeout(timeout)
+        self.client, _ = self.listener.accept()
+        self.client.settimeout(None)
+        self.client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        
+        reader = threading.Thread(target=self._read)
+        reader.daemon = True
+        reader.start()
+    
+    def _read(self):
+        buffer = ''
+        while True:
+            data = self.client.recv(65536)
+            if not data:
+                return
+            now = time.time()
+            buffer += data
+            lines = buffer.split('\r\n')
+            buffer = lines.pop()
+            for line in lines:
+                self._handle(line, now)
+    
+    def _handle(self, line, now):
+        command, _, rest = line.partition(' ')
+        if command == 'USER':
+            self.send(':{0} 001 {1} :Welcome'.format(SERVER, NICK))
+            self.send(':{0} 422 {1} :MOTD File is missing'.format(SERVER, NICK))
+        elif command == 'JOIN':
+            for channel in rest.split(','):
+                self.send(':{0}!kaa@bench JOIN {1}'.format(NICK, channel))
+            self.joined.set()
+        elif command == 'PING':
+            self.send(':{0} PONG {0} {1}'.format(SERVER, rest))
+        elif command == 'PRIVMSG':
+            self.replies.put((now, rest.partition(' :')[2]))
+    
+    def send(self, *lines):
+        self.client.sendall(''.join(line + '\r\n' for line in lines))
+    
+    def reply(self, timeout=60.0):
+        return self.replies.get(timeout=timeout)
+    
+    def sync(self):
+        '''Sends `.done` and returns the bot's CPU time from its reply, once 
+        every line sent before it has been dispatched.
+        '''
+        
+        self.send(':bench!b@bench PRIVMSG {0} :.done'.format(CHANNEL))
+        while True:
+            _, message = self.reply()
+            if message.startswith('done '):
+                return float(message.split()[1])
+    
+    def close(self):
+        if self.client is not None:
+            self.client.close()
+        self.listener.close()
+
+
+def run_bot(port, options):
+    '''Configures and runs a bot, in the child process, with rate limits and 
+    admission control turned off so only the bot's own overhead is measured.
+    '''
+    
+    bot = Bot()
+    bot.config.update(
+            SERVER='127.0.0.1',
+            PORT=port,
+            SSL=False,
+            ASYNC=options.async,
+            NICK=NICK,
+            CHANNELS=[CHANNEL],
+            SEND_LINES=0,
+            SEND_BYTES=0,
+            USER_COMMANDS=0,
+            CHANNEL_COMMANDS=0,
+            MAX_QUEUE=0,
+            )
+    if options.log:
+        bot.config['RAW_LOG_LINES'] = 0 # every line
+    else:
+        bot.config['LOG_LEVEL'] = 'WARNING'
+        bot.config['RAW_LOG_LEVEL'] = 'WARNING'
+    
+    @bot.command
+    def done():
+        user, system = os.times()[:2]
+        return 'done {0:.6f}'.format(user + system)
+    
+    @bot.command
+    def echo(context):
+        return context.args
+    
+    for i in range(options.hooks if options.scenario == 'hooks' else 0):
+        bot.add_command('noop{0}'.format(i), lambda: None)
+        bot.add_event('NOTICE' if i % 2 else 'PRIVMSG', lambda: None)
+    
+    bot.run()
+
+
+def flood(server, options):
+    lines = [':user{0}!u@host{0} PRIVMSG {1} :hello there, number {2}'
+             .format(i % 50, CHANNEL, i) for i in xrange(options.lines)]
+    
+    cpu = server.sync()
+    start = time.time()
+    for i in xrange(0, len(lines), 100):
+        server.send(*lines[i:i + 100])
+    cpu = server.sync() - cpu
+    return len(lines), time.time() - start, cpu
+
+
+def names(server, options):
+    channel = '#big'
+    nicks = ['{0}nick{1}'.format('@' if i % 20 == 0 else '', i)
+             for i in xrange(options.lines)]
+    lines = [':{0}!kaa@bench JOIN {1}'.format(NICK, channel)]
+    for i in xrange(0, len(nicks), 40):
+        lines.append(':{0} 353 {1} = {2} :{3}'.format(
+                SERVER, NICK, channel, ' '.join(nicks[i:i + 40])))
+    lines.append(':{0} 366 {1} {2} :End of /NAMES list.'
+                 .format(SERVER, NICK, channel))
+    
+    cpu = server.sync()
+    start = time.time()
+    server.send(*lines)
+    cpu = server.sync() - cpu
+    return len(lines), time.time() - start, cpu
+
+
+def latency(server, options):
+    count = min(options.lines, 2000)
+    samples = []
+    
+    cpu = server.sync()
+    start = time.time()
+    for i in xrange(count):
+        sent = time.time()
+        server.send(':user!u@host PRIVMSG {0} :.echo {1}'.format(CHANNEL, i))
+        while True:
+            received, message = server.reply()
+            if message == str(i):
+                break
+        samples.append(received - sent)
+    cpu = server.sync() - cpu
+    return count, time.time() - start, cpu, samples
+
+
+SCENARIOS = {
+    'flood': flood,
+    'names': names,
+    'hooks': flood,
+    'latency': latency,
+    }
+
+
+def percentile(samples, q):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+def run(scenario, options):
+    options.scenario = scenario
+    server = FakeServer()
+    
+    pid = os.fork()
+    if pid == 0:
+        try:
+            server.listener.close()
+            run_bot(server.port, options)
+        finally:
+            os._exit(0)
+    
+    try:
+        server.accept()
+        if not server.joined.wait(30.0):
+            raise RuntimeError('the bot never joined ' + CHANNEL)
+        result = SCENARIOS[scenario](server, options)
+    finally:
+        server.close()
+        os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
+    
+    count, elapsed, cpu = result[:3]
+    row = [scenario, count, count / elapsed, cpu / count * 1e6]
+    if len(result) > 3:
+        samples = result[3]
+        row += ['{0:.3f}'.format(percentile(samples, q) * 1e3)
+                for q in (0.5, 0.9, 0.99)]
+    else:
+        row += ['-'] * 3
+    return row
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser(usage='%prog [options] [scenario ...]')
+    parser.add_option('--lines', type='int', default=20000,
+                      help='lines or nicks to send per scenario')
+    parser.add_option('--hooks', type='int', default=200,
+                      help='hooks to register for the hooks scenario')
+    parser.add_option('--async', action='store_true', default=False,
+                      help='use the event loop based client')
+    parser.add_option('--log', action='store_true', default=False,
+                      help='log every line sent and received')
+    options, scenarios = parser.parse_args()
+    
+    print '{0:<10} {1:>8} {2:>12} {3:>10} {4:>8} {5:>8} {6:>8}'.format(
+            'scenario', 'lines', 'lines/sec', 'cpu us/ln',
+            'p50 ms', 'p90 ms', 'p99 ms')
+    for scenario in scenarios or ('flood', 'names', 'hooks', 'latency'):
+        print ('{0:<10} {1:>8} {2:>12.0f} {3:>10.1f} '
+               '{4:>8} {5:>8} {6:>8}').format(*run(scenario, options))
@@ -0,0 +1,80 @@
+'''
+    Compares `irctk.parser.parse` with the parser it replaced.
+    
+    Usage: python benchmarks/bench_parser.py [iterations]
+'''
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from irctk.parser import parse
+
+
+LINES = [
+    ':nick!user@host.example.net PRIVMSG #channel :.weather Amsterdam, NL',
+    ':irc.example.net 353 Kaa = #channel :@op +voice nick1 nick2 nick3 nick4',
+    'PING :irc.example.net',
+    ':nick!user@host.example.net JOIN #channel',
+    ':irc.example.net 005 Kaa CHANTYPES=# PREFIX=(ov)@+ NETWORK=Example :are supported',
+    '@time=2012-06-30T23:59:60.419Z :nick!user@host PRIVMSG #channel :hello',
+]
+
+
+def legacy_parse_line(line):
+    '''The parser previously used by `IrcWrapper._parse_line`.'''
+    
+    prefix = ''
+    trailing = []
+    if not line:
+        raise Exception('Received an empty line from the server.')
+    
+    if line[0] == ':':
+        prefix, line = line[1:].split(' ', 1)
+    
+    if line.find(' :') != -1:
+        line, trailing = line.split(' :', 1)
+        args = line.split()
+        args.append(trailing)
+    else:
+        args = line.split()
+    
+    command = args.pop(0)
+    
+    return prefix, command, args
+
+
+def legacy_context(line):
+    '''The parser and context previously built by `IrcWrapper._recv` for 
+    every line.'''
+    
+    prefix, command, args = legacy_parse_line(line)
+    return {
+        'prefix' : prefix, 
+        'command' : command, 
+        'args' : args,
+        'sender': args[0] if args else '',
+        'user': prefix.rsplit('!', 1)[0],
+        'hostmask': prefix.rsplit('!', 1)[-1],
+        'message': args[-1] if args else '',
+        }
+
+
+def bench(func, iterations):
+    def run():
+        for line in LINES:
+            func(line)
+    seconds = min(timeit.repeat(run, repeat=3, number=iterations))
+    return seconds / (iterations * len(LINES)) * 1e6
+
+
+if __name__ == '__main__':
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    
+    print '{0:<12} {1:>10}'.format('parser', 'us/line')
+    for name, func in (('legacy', legacy_parse_line), 
+                       ('legacy+ctx', legacy_context), 
+                       ('parse', parse)):
+        print '{0:<12} {1:>10.3f}'.format(name, bench(func, iterations))
@@ -127,7 +127,7 @@ def raw(context):
     if context.args:
         command = context.args.split(' ', 1)[0]
         args = list(context.args.split(' ', 1)[-1])
-        bot.irc.send_command(command, args)
+        bot.networks[context.line['network']].send_command(command, args)
     else:
         return raw.__doc__
 
@@ -0,0 +1,195 @@
+'''
+    irctk.admission
+    ---------------
+    
+    Provides `AdmissionControl`, which decides whether a plugin call is let 
+    into the thread pool at all.
+'''
+
+import collections
+import threading
+import time
+
+from .ratelimit import TokenBucket
+from .isupport import ServerSupport
+
+
+class AdmissionControl(object):
+    '''This class applies the admission policies from the configuration 
+    dict, `config`, to plugin calls before they are enqueued. Each policy is 
+    disabled when its setting is 0.
+    
+    `USER_COMMANDS` commands are allowed from each user, identified by their 
+    host, every `USER_WINDOW` seconds, and `CHANNEL_COMMANDS` commands from 
+    each channel every `CHANNEL_WINDOW` seconds. Events are not limited per 
+    user or channel, as they are sent by the server.
+    
+    Channels are told apart from nicks, and folded, as the server they are 
+    on does: `support(network)` returns that network's `ServerSupport`, or 
+    None, in which case the defaults are assumed.
+    
+    `HOOK_CONCURRENCY` caps how many calls of a single hook may be queued or 
+    running at once; a plugin may set its own cap with the `concurrency` 
+    decorator kwarg.
+    
+    At most `MAX_QUEUE` calls may be waiting for a worker. When the queue is 
+    full `QUEUE_OVERFLOW` decides what happens: 'drop' refuses the new call, 
+    'shed' cancels the oldest waiting call to make room for it.
+    
+    Typical usage:
+    
+        if admission.admit(plugin, context, command=True):
+            future = thread_pool.enqueue_task(...)
+            admission.track(plugin, future)
+    '''
+    
+    max_buckets = 1024
+    
+    def __init__(self, config, logger=None, support=None):
+        self.config = config
+        self.logger = logger
+        self.support = support or (lambda network: None)
+        self.defaults = ServerSupport()
+        self.lock = threading.Lock()
+        self.user_buckets = {}
+        self.channel_buckets = {}
+        self.running = collections.defaultdict(int)
+        self.pending = collections.deque()
+    
+    def _setting(self, key, default=0):
+        return self.config.get(key) or default
+    
+    def _log(self, message):
+        if self.logger:
+            self.logger.info(message)
+    
+    def _bucket_allows(self, buckets, key, rate, per, now):
+        '''This internal method takes a token from the bucket for `key` in 
+        `buckets`, creating it if needed, and returns whether one was 
+        available.
+        '''
+        
+        bucket = buckets.get(key)
+        if bucket is None:
+            if len(buckets) >= self.max_buckets:
+                self._prune(buckets, now)
+            bucket = buckets[key] = TokenBucket(rate, per)
+        
+        if bucket.delay(1, now) > 0:
+            return False
+        bucket.consume(1, now)
+        return True
+    
+    def _prune(self, buckets, now):
+        '''This internal method forgets the buckets that have refilled, as 
+        they behave the same as new ones.
+        '''
+        
+        for key, bucket in buckets.items():
+            bucket.delay(0, now)
+            if bucket.tokens >= bucket.capacity:
+                del buckets[key]
+    
+    def _channel(self, context):
+        '''This internal method returns the channel `context` was sent to, 
+        folded, or None if it was sent to us alone.
+        '''
+        
+        support = self.support(context.network) or self.defaults
+        if support.is_channel(context.sender):
+            return support.fold(context.sender)
+        return None
+    
+    def _queue_depth(self):
+        '''This internal method returns the number of admitted calls still 
+        waiting for a worker. Must be called with `self.lock` held.
+        '''
+        
+        return sum(1 for future in self.pending
+                   if future.state == future.PENDING)
+    
+    def _shed(self):
+        '''This internal method cancels the oldest waiting call and returns 
+        whether there was one.
+        '''
+        
+        while True:
+            with self.lock:
+                if not self.pending:
+                    return False
+                future = self.pending.popleft()
+            # cancelling runs the call's callbacks, which take the lock
+            if future.cancel():
+                return True
+    
+    def admit(self, plugin, context, command=True):
+        '''This method returns whether a call of `plugin` for the line 
+        `context` may be enqueued. `command` is False for events. An admitted 
+        call must be passed to `track` once it is enqueued.
+        '''
+        
+        hook = plugin['hook']
+        now = time.time()
+        shed = False
+        
+        with self.lock:
+            user_commands = self._setting('USER_COMMANDS')
+            if command and user_commands:
+                key = (context.network, context.host or context.prefix)
+                per = self._setting('USER_WINDOW', 10.0)
+                if not self._bucket_allows(self.user_buckets, key,
+                                           user_commands, per, now):
+                    self._log(u'Refused {0} from {1}: user limit '
+                              'reached'.format(hook, context.prefix))
+                    return False
+            
+            channel_commands = self._setting('CHANNEL_COMMANDS')
+            channel = command and channel_commands and self._channel(context)
+            if channel:
+                key = (context.network, channel)
+                per = self._setting('CHANNEL_WINDOW', 10.0)
+                if not self._bucket_allows(self.channel_buckets, key,
+                                           channel_commands, per, now):
+                    self._log(u'Refused {0} in {1}: channel limit '
+                              'reached'.format(hook, context.sender))
+                    return False
+            
+            concurrency = plugin.get('concurrency',
+                                     self._setting('HOOK_CONCURRENCY'))
+            if concurrency and self.running[hook] >= concurrency:
+                self._log('Refused {0}: {1} calls already in '
+                          'progress'.format(hook, concurrency))
+                return False
+            
+            max_queue = self._setting('MAX_QUEUE')
+            if max_queue and self._queue_depth() >= max_queue:
+                if self._setting('QUEUE_OVERFLOW', 'drop') != 'shed':
+                    self._log('Refused {0}: queue is full'.format(hook))
+                    return False
+                shed = True
+            
+            self.running[hook] += 1
+        
+        if shed and self._shed():
+            self._log('Shed the oldest queued call to admit {0}'.format(hook))
+        return True
+    
+    def track(self, plugin, future):
+        '''This method takes an admitted call's `future` and releases its 
+        place once it is done.
+        '''
+        
+        hook = plugin['hook']
+        
+        def release(future):
+            with self.lock:
+                self.running[hook] -= 1
+                if not self.running[hook]:
+                    del self.running[hook]
+        
+        with self.lock:
+            pending = self.pending
+            while pending and pending[0].state != pending[0].PENDING:
+                pending.popleft()
+            pending.append(future)
+        future.add_done_callback(release)
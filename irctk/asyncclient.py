@@ -0,0 +1,465 @@
+'''
+    irctk.asyncclient
+    -----------------
+    
+    Provides an event loop, `EventLoop`, and two classes, `AsyncTcpClient` 
+    and `AsyncIrcWrapper`, which are drop-in alternatives to `TcpClient` and 
+    `IrcWrapper`.
+    
+    Rather than starting a pair of threads per object, every connection 
+    registered with an `EventLoop` is serviced by a single `asyncore` poll 
+    loop, SSL handshakes included. This allows many connections to share one 
+    thread and removes the queue handoffs between the client and the wrapper.
+'''
+
+
+import asyncore
+import fcntl
+import heapq
+import itertools
+import os
+import socket
+import ssl
+import threading
+import time
+
+from .framing import LineBuffer, join_lines
+from .ircclient import IrcWrapper
+from .metrics import metrics
+from .logging import raw_logger
+from .reconnect import ReconnectManager
+
+
+class Waker(asyncore.file_dispatcher):
+    '''This class wraps the read end of a pipe so that other threads may 
+    interrupt a sleeping event loop, e.g. when a plugin queues a reply. 
+    Calling `wake` writes a byte to the pipe, which the loop then discards.
+    '''
+    
+    def __init__(self, map):
+        read_fd, self.write_fd = os.pipe()
+        flags = fcntl.fcntl(self.write_fd, fcntl.F_GETFL)
+        fcntl.fcntl(self.write_fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        asyncore.file_dispatcher.__init__(self, read_fd, map=map)
+        os.close(read_fd) # file_dispatcher keeps its own duplicate
+    
+    def wake(self):
+        try:
+            os.write(self.write_fd, 'x')
+        except OSError:
+            pass # the pipe is full, so the loop is already awake
+    
+    def writable(self):
+        return False
+    
+    def handle_read(self):
+        try:
+            self.recv(4096)
+        except OSError:
+            pass
+
+
+class EventLoop(object):
+    '''This class drives any number of `AsyncTcpClient` objects from a 
+    single thread. Timed callbacks may be scheduled with `call_later`; the 
+    loop sleeps in `poll` until either a socket is ready, a timer is due, or 
+    another thread calls `wake`.
+    
+    An instance of this class might look like this:
+    
+        loop = EventLoop(logger)
+        client = AsyncTcpClient('irc.voxinfinitus.net', 6697, True, loop=loop)
+        client.connect()
+        
+        # blocks until `loop.stop()` is called
+        loop.run()
+    '''
+    
+    def __init__(self, logger=None):
+        self.map = {}
+        self.timers = []
+        self.logger = logger
+        self.running = True
+        self.lock = threading.Lock()
+        self.waker = Waker(self.map)
+        self._sequence = itertools.count()
+    
+    def call_later(self, delay, func, *args):
+        '''This method schedules `func` to be called with `args` on the loop 
+        thread in `delay`-number of seconds. It is safe to call from any 
+        thread.
+        '''
+        
+        timer = (time.time() + delay, next(self._sequence), func, args)
+        with self.lock:
+            heapq.heappush(self.timers, timer)
+        self.wake()
+    
+    def wake(self):
+        self.waker.wake()
+    
+    def stop(self):
+        self.running = False
+        self.wake()
+    
+    def _run_timers(self, max_wait):
+        '''This internal method calls every timer that is due and returns the 
+        time in seconds until the next one, at most `max_wait`.
+        '''
+        
+        now = time.time()
+        due = []
+        with self.lock:
+            while self.timers and self.timers[0][0] <= now:
+                due.append(heapq.heappop(self.timers))
+        
+        for _, _, func, args in due:
+            try:
+                func(*args)
+            except Exception, e:
+                if self.logger:
+                    self.logger.error('Event loop error: {0}'.format(e))
+        
+        with self.lock:
+            if self.timers:
+                return max(0.0, min(max_wait, self.timers[0][0] - time.time()))
+        return max_wait
+    
+    def run(self, max_wait=30.0):
+        '''This method runs the loop until `stop` is called.'''
+        
+        while self.running:
+            timeout = self._run_timers(max_wait)
+            asyncore.loop(timeout, True, self.map, 1)
+
+
+class AsyncTcpClient(asyncore.dispatcher):
+    '''This is a non-blocking counterpart to `TcpClient`. It exposes the same 
+    attributes, `host`, `port`, `ssl`, `timeout` and `shutdown`, as well as 
+    the `connect`, `close` and `reconnect` methods, but performs all of its 
+    I/O from an `EventLoop`.
+    
+    Complete lines are handed to `self.line_handler` as they arrive, rather 
+    than being placed on an input queue. Outgoing lines are added with 
+    `write`, which may be called from any thread.
+    
+    If `self.ssl` is True the socket is wrapped once connected and the 
+    handshake is driven by the loop, so it never blocks other connections.
+    
+    Reconnecting is left to `self.reconnector`, a `ReconnectManager` that 
+    schedules its attempts on the loop, as for `TcpClient`.
+    '''
+    
+    def __init__(self, host, port, ssl=False, timeout=300.0, logger=None, loop=None, 
+                 servers=None, backoff=None):
+        self.loop = loop or EventLoop(logger)
+        asyncore.dispatcher.__init__(self, map=self.loop.map)
+        self.host = host
+        self.port = port
+        self.ssl = ssl
+        self.inp_buffer = LineBuffer()
+        self.out_buffer = ''
+        self.out_lock = threading.Lock()
+        self.shutdown = False
+        self.timeout = timeout
+        self.reconnect_on_error = True
+        self.line_handler = None
+        self.logger = logger
+        self.unsent = ''
+        self.reconnector = ReconnectManager(
+                self._attempt, 
+                [(host, port, ssl)] + list(servers or []), 
+                self.loop.call_later, 
+                backoff, 
+                logger
+                )
+        
+        self.last_recv = 0
+        self._mid_line = False # whether the last write ended within a line
+        self._handshaking = False
+        self._want_write = False
+        self._reconnecting = False
+        self._watching = False
+    
+    def connect(self, reconnect=False):
+        '''This method begins a non-blocking connection to `self.host` and 
+        `self.port`. The connection completes on the loop, at which point 
+        `handle_connect` is called.
+        
+        Should the first connection fail at once, e.g. because the host can 
+        not be resolved, it is retried by `self.reconnector`, as with 
+        `TcpClient.connect`.
+        '''
+        
+        self.shutdown = False
+        self._reconnecting = reconnect
+        if not reconnect:
+            self.reconnector.open()
+        
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            asyncore.dispatcher.connect(self, (self.host, self.port))
+        except socket.error, e:
+            asyncore.dispatcher.close(self)
+            if reconnect:
+                raise
+            self._deliver('ERROR :Closing Link: connection lost')
+            self.reconnector.failed(e)
+    
+    def close(self, wait=None):
+        '''This method closes the socket and marks the connection as shut 
+        down. Unlike `TcpClient.close` it never sleeps, as that would stall 
+        every other connection on the loop.
+        '''
+        
+        self.shutdown = True
+        self.reconnector.close()
+        asyncore.dispatcher.close(self)
+    
+    def reconnect(self, wait=None):
+        '''This method drops the current socket and has `self.reconnector` 
+        schedule a new connection attempt on the loop, in `wait`-number of 
+        seconds if given.
+        '''
+        
+        asyncore.dispatcher.close(self)
+        self.inp_buffer.clear()
+        self._handshaking = False
+        self.reconnector.lost(wait)
+    
+    def _attempt(self, host, port, ssl):
+        '''This internal method is called by `self.reconnector` to connect 
+        to `host` and `port`, setting aside what was left unsent, as 
+        `TcpClient._attempt` does. A partly written line can not be sent 
+        again, so it is dropped.
+        '''
+        
+        with self.out_lock:
+            data, self.out_buffer = self.out_buffer, ''
+            if self._mid_line:
+                data = data.partition('\r\n')[2]
+                self._mid_line = False
+            self.unsent += data
+        
+        self.host, self.port, self.ssl = host, port, ssl
+        self.connect(reconnect=True)
+    
+    def take_unsent(self):
+        with self.out_lock:
+            data, self.unsent = self.unsent, ''
+        return [line for line in data.split('\r\n') if line]
+    
+    def _check_timeout(self):
+        '''This internal method treats a connection that has been silent for 
+        longer than `self.timeout` as lost, mirroring the socket timeout used 
+        by `TcpClient`.
+        
+        The check is only made while we are connected; `handle_connect` 
+        starts it again once a new connection is up.
+        '''
+        
+        idle = time.time() - self.last_recv
+        if self.shutdown or not self.connected or idle > self.timeout:
+            self._watching = False
+            if not self.shutdown and self.connected:
+                self.handle_close()
+            return
+        self.loop.call_later(self.timeout - idle, self._check_timeout)
+    
+    def write(self, line):
+        '''This method queues a single line to be sent to the server.'''
+        
+        self.write_lines([line])
+    
+    def write_lines(self, lines):
+        '''This method queues `lines` to be sent to the server. They are 
+        appended to the output buffer, and logged, together. Any embedded 
+        line breaks are dropped, as in `TcpClient._send`.
+        '''
+        
+        data, lines = join_lines(lines)
+        if not lines:
+            return
+        
+        with self.out_lock:
+            self.out_buffer += data
+        raw_logger(self.logger).info('\n'.join(lines))
+        metrics.incr('irc.lines_out', len(lines))
+        self.loop.wake()
+    
+    def _ready(self):
+        '''This internal method is called once the connection, including any 
+        SSL handshake, has been established.
+        '''
+        
+        self.reconnector.connected()
+        if self._reconnecting:
+            self._reconnecting = False
+            self._deliver('RECONNECT :server')
+    
+    def _deliver(self, line):
+        if self.line_handler is not None:
+            self.line_handler(line)
+    
+    def _do_handshake(self):
+        try:
+            self.socket.do_handshake()
+        except ssl.SSLError, e:
+            if e.args[0] == ssl.SSL_ERROR_WANT_READ:
+                self._want_write = False
+                return
+            elif e.args[0] == ssl.SSL_ERROR_WANT_WRITE:
+                self._want_write = True
+                return
+            raise
+        
+        self._handshaking = False
+        self._want_write = False
+        self._ready()
+    
+    def handle_connect(self):
+        self.last_recv = time.time()
+        if not self._watching:
+            self._watching = True
+            self.loop.call_later(self.timeout, self._check_timeout)
+        
+        if self.ssl:
+            self.del_channel()
+            sock = ssl.wrap_socket(self.socket, do_handshake_on_connect=False)
+            self.set_socket(sock)
+            self._handshaking = True
+            self._do_handshake()
+        else:
+            self._ready()
+    
+    def readable(self):
+        return not self.shutdown
+    
+    def writable(self):
+        if self.connecting:
+            return True
+        if self._handshaking:
+            return self._want_write
+        with self.out_lock:
+            return bool(self.out_buffer)
+    
+    def handle_read(self, byte_size=4096):
+        if self._handshaking:
+            self._do_handshake()
+            return
+        
+        try:
+            data = self.recv(byte_size)
+            while self.ssl and self.socket.pending():
+                data += self.socket.recv(self.socket.pending())
+        except ssl.SSLError, e:
+            if e.args[0] == ssl.SSL_ERROR_WANT_READ:
+                return
+            raise
+        
+        if not data:
+            return
+        
+        self.last_recv = time.time()
+        lines = self.inp_buffer.feed(data)
+        metrics.incr('irc.bytes_in', len(data))
+        metrics.incr('irc.lines_in', len(lines))
+        if lines:
+            raw_logger(self.logger).info('\n'.join(lines))
+        for line in lines:
+            self._deliver(line)
+    
+    def handle_write(self):
+        if self._handshaking:
+            self._do_handshake()
+            return
+        
+        with self.out_lock:
+            data = self.out_buffer
+        if not data:
+            return
+        
+        try:
+            sent = self.send(data)
+        except ssl.SSLError, e:
+            if e.args[0] in (ssl.SSL_ERROR_WANT_READ, ssl.SSL_ERROR_WANT_WRITE):
+                return
+            raise
+        
+        with self.out_lock:
+            self.out_buffer = self.out_buffer[sent:]
+            if sent:
+                self._mid_line = data[sent - 1] != '\n'
+        metrics.incr('irc.bytes_out', sent)
+    
+    def handle_close(self):
+        if self.shutdown:
+            self.close()
+        elif self.reconnect_on_error:
+            if self.reconnector.state == self.reconnector.CONNECTED:
+                self._deliver('ERROR :Closing Link: connection lost')
+            self.reconnect()
+        else:
+            self.close()
+    
+    def handle_error(self):
+        self.logger.error('Connection error: {0}'.format(asyncore.compact_traceback()[2]))
+        self.handle_close()
+
+
+class AsyncIrcWrapper(IrcWrapper):
+    '''This class is a counterpart to `IrcWrapper` for use with 
+    `AsyncTcpClient`. Lines are handled as the loop receives them and 
+    outgoing lines are released from the scheduler by loop timers, so no 
+    threads are started by `run`.
+    '''
+    
+    def __init__(self, connection, nick, realname, channels, logger, 
+                 network=None, messages=None, scheduler=None, decoder=None):
+        IrcWrapper.__init__(self, connection, nick, realname, channels, logger, 
+                            network, messages, scheduler, decoder)
+        connection.line_handler = self._receive
+        self._flush_pending = False
+    
+    def _flush(self):
+        '''This internal method runs on the loop, writing every line the 
+        scheduler will release to the connection. If lines are left waiting 
+        on the rate limits it calls itself again once they may be sent.
+        '''
+        
+        self._flush_pending = False
+        lines = []
+        while True:
+            line = self.scheduler.get(block=False)
+            if line is None:
+                break
+            lines.append(line)
+        self.connection.write_lines(lines)
+        
+        delay = self.scheduler.delay()
+        if delay is not None:
+            self._schedule_flush(delay)
+    
+    def _schedule_flush(self, delay=0):
+        if not self._flush_pending:
+            self._flush_pending = True
+            self.connection.loop.call_later(delay, self._flush)
+    
+    def _send_line(self, line, priority=None):
+        IrcWrapper._send_line(self, line, priority)
+        self._schedule_flush()
+    
+    def _send_lines(self, lines, priority=None):
+        IrcWrapper._send_lines(self, lines, priority)
+        self._schedule_flush()
+    
+    def _release(self):
+        IrcWrapper._release(self)
+        self._schedule_flush()
+    
+    def run(self):
+        '''This method registers with the server. The connection object's 
+        event loop is responsible for all further I/O.
+        '''
+        
+        self._register()
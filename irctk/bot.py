@@ -7,14 +7,21 @@
 
 import os
 import time
+import signal
 import inspect
-import thread
+import threading
+import Queue
 
-from .logging import create_logger
+from .logging import create_logger, configure_logger
 from .config import Config
 from .reloader import ReloadHandler
 from .plugins import PluginHandler
 from .ircclient import TcpClient, IrcWrapper
+from .asyncclient import EventLoop, AsyncTcpClient, AsyncIrcWrapper
+from .ratelimit import SendScheduler
+from .metrics import metrics, MetricsServer
+from .decoding import Decoder
+from .reconnect import Backoff
 
 
 class Bot(object):
@@ -23,22 +30,56 @@ class Bot(object):
     logger = create_logger()
     
     default_config = dict({
-        'SERVER'      : 'irc.voxinfinitus.net',
-        'PORT'        : 6697,
-        'SSL'         : True,
-        'TIMEOUT'     : 300,
-        'NICK'        : 'Kaa',
-        'REALNAME'    : 'Kaa the rock python',
-        'CHANNELS'    : ['#voxinfinitus'],
-        'PLUGINS'     : [],
-        'EVENTS'      : [],
-        'MAX_WORKERS' : 7,
-        'MIN_WORKERS' : 3,
+        'SERVER'             : 'irc.voxinfinitus.net',
+        'PORT'               : 6697,
+        'SSL'                : True,
+        'ASYNC'              : False,
+        'TIMEOUT'            : 300,
+        'NICK'               : 'Kaa',
+        'REALNAME'           : 'Kaa the rock python',
+        'CHANNELS'           : ['#voxinfinitus'],
+        'NETWORKS'           : {},
+        'SEND_LINES'         : 10,
+        'SEND_BYTES'         : 2560,
+        'SEND_WINDOW'        : 10.0,
+        'PLUGINS'            : [],
+        'EVENTS'             : [],
+        'MAX_WORKERS'        : 7,
+        'MIN_WORKERS'        : 3,
+        'PLUGIN_TIMEOUT'     : None,
+        'USER_COMMANDS'      : 5,
+        'USER_WINDOW'        : 10.0,
+        'CHANNEL_COMMANDS'   : 0,
+        'CHANNEL_WINDOW'     : 10.0,
+        'HOOK_CONCURRENCY'   : 0,
+        'MAX_QUEUE'          : 100,
+        'QUEUE_OVERFLOW'     : 'drop',
+        'CACHE_SIZE'         : 128,
+        'PLUGIN_PATHS'       : [],
+        'REPLY_LINES'        : 5,
+        'REPLY_CONTINUATION' : ' ...',
+        'METRICS_HOST'       : '127.0.0.1',
+        'METRICS_PORT'       : 0,
+        'LOG_LEVEL'          : 'DEBUG',
+        'RAW_LOG_LEVEL'      : 'INFO',
+        'RAW_LOG_LINES'      : 100,
+        'RAW_LOG_WINDOW'     : 1.0,
+        'RAW_LOG_SAMPLE'     : 100,
+        'ENCODING_FALLBACK'  : 'cp1252',
+        'SERVERS'            : [],
+        'RECONNECT_MIN'      : 2.0,
+        'RECONNECT_MAX'      : 300.0,
         })
     
     def __init__(self):
+        if 'config' in self.__dict__:
+            return # reloading a plugin module calls `Bot()` again
+        
         self.config = Config(self.root_path, self.default_config)
-        self.plugin = PluginHandler(self.config, self.logger, self.reply)
+        self.plugin = PluginHandler(self.config, self.logger, self.reply, 
+                                    self._support)
+        self.networks = {}
+        self.messages = Queue.Queue()
     
     def __new__(cls, *args, **kwargs):
         '''Here we override the `__new__` method in order to achieve a 
@@ -49,69 +90,154 @@ class Bot(object):
             cls._instance = super(Bot, cls).__new__(cls, *args, **kwargs)
         return cls._instance
     
+    network_keys = ('SERVER', 'PORT', 'SSL', 'TIMEOUT', 'NICK', 'REALNAME', 
+                    'CHANNELS', 'SEND_LINES', 'SEND_BYTES', 'SEND_WINDOW', 
+                    'ENCODING_FALLBACK', 'SERVERS', 'RECONNECT_MIN', 
+                    'RECONNECT_MAX')
+    
+    def _network_configs(self):
+        '''This internal method returns a dictionary of network names to the 
+        connection settings for each network.
+        
+        Networks are defined in the `NETWORKS` dict of the config, mapping a 
+        name to a dict of any of the keys in `network_keys`. Keys that are 
+        left out fall back to the top-level config. If `NETWORKS` is empty a 
+        single network, named `default`, is built from the top-level config.
+        '''
+        
+        defaults = dict((key, self.config[key]) for key in self.network_keys)
+        
+        networks = self.config.get('NETWORKS') or {'default': {}}
+        
+        configs = {}
+        for name, overrides in networks.items():
+            configs[name] = dict(defaults, **overrides)
+        return configs
+    
     def _create_connection(self):
-        self.connection = TcpClient(
-                self.config['SERVER'], 
-                self.config['PORT'],
-                self.config['SSL'],
-                self.config['TIMEOUT'],
-                logger=self.logger,
-                )
-        
-        self.irc = IrcWrapper(
-                self.connection, 
-                self.config['NICK'], 
-                self.config['REALNAME'], 
-                self.config['CHANNELS'],
-                self.logger
-                )
-    
-    def _parse_input(self, prefix='.', wait=0.01):
+        '''This internal method creates a connection and IRC wrapper for each 
+        network in the current config, storing the wrappers in 
+        `self.networks` by name. If `ASYNC` is set, the event loop based 
+        `AsyncTcpClient` and `AsyncIrcWrapper` are used in place of the 
+        threaded `TcpClient` and `IrcWrapper`, with every network sharing 
+        one loop. Each network's outgoing lines are rate-limited to 
+        `SEND_LINES` lines and `SEND_BYTES` bytes every `SEND_WINDOW` 
+        seconds. Lines received that are not UTF-8 are decoded with 
+        `ENCODING_FALLBACK`.
+        
+        All wrappers place their contexts on the shared `self.messages` 
+        queue, tagged with the network name. For convenience `self.irc` and 
+        `self.connection` refer to the first network, sorted by name.
+        
+        The depths of the shared queue, and of each network's incoming queue 
+        and send scheduler, are registered as gauges with `metrics`.
+        '''
+        
+        client_cls, wrapper_cls = TcpClient, IrcWrapper
+        client_kwargs = {'logger': self.logger}
+        if self.config['ASYNC']:
+            self.loop = EventLoop(self.logger)
+            client_cls, wrapper_cls = AsyncTcpClient, AsyncIrcWrapper
+            client_kwargs['loop'] = self.loop
+        
+        self.networks = {}
+        for name, config in sorted(self._network_configs().items()):
+            connection = client_cls(
+                    config['SERVER'], 
+                    config['PORT'],
+                    config['SSL'],
+                    config['TIMEOUT'],
+                    servers=self._servers(config),
+                    backoff=Backoff(config['RECONNECT_MIN'], 
+                                    config['RECONNECT_MAX']),
+                    **client_kwargs
+                    )
+            
+            scheduler = SendScheduler(
+                    config['SEND_LINES'], 
+                    config['SEND_BYTES'], 
+                    config['SEND_WINDOW']
+                    )
+            
+            self.networks[name] = wrapper_cls(
+                    connection, 
+                    config['NICK'], 
+                    config['REALNAME'], 
+                    config['CHANNELS'],
+                    self.logger,
+                    network=name,
+                    messages=self.messages,
+                    scheduler=scheduler,
+                    decoder=Decoder(config['ENCODING_FALLBACK'])
+                    )
+        
+        self.irc = self.networks[min(self.networks)]
+        self.connection = self.irc.connection
+        
+        metrics.gauge('bot.messages', self.messages.qsize)
+        for name, irc in self.networks.items():
+            metrics.gauge('send.{0}.queued'.format(name),
+                          lambda scheduler=irc.scheduler: len(scheduler))
+            if hasattr(irc.connection, 'inp'):
+                metrics.gauge('irc.{0}.inp'.format(name),
+                              irc.connection.inp.qsize)
+            if hasattr(irc.connection, 'out'):
+                metrics.gauge('irc.{0}.out'.format(name),
+                              irc.connection.out.qsize)
+    
+    def _support(self, network):
+        '''This internal method returns the `ServerSupport` of `network`, or 
+        None if there is no such network.
+        '''
+        
+        irc = self.networks.get(network)
+        return irc.support if irc is not None else None
+    
+    def _servers(self, config):
+        '''This internal method returns the servers to fall back to, from 
+        the `SERVERS` list of a network's `config`, as `(host, port, ssl)` 
+        tuples. Each may be given as a host, a 'host:port' string, or a 
+        `(host, port)` or `(host, port, ssl)` tuple; the port and SSL 
+        setting default to the network's own.
+        '''
+        
+        servers = []
+        for server in config.get('SERVERS') or []:
+            if isinstance(server, basestring):
+                host, _, port = server.partition(':')
+                server = (host, int(port) if port else config['PORT'])
+            defaults = (None, config['PORT'], config['SSL'])
+            servers.append(tuple(server) + defaults[len(server):])
+        return servers
+    
+    def _parse_input(self, prefix='.'):
         '''This internal method handles the parsing of commands and events.
         Hooks for commands are prefixed with a character, by default `.`. This 
         may be overriden by specifying `prefix`.
         
-        A context is maintained by our IRC wrapper, `IrcWrapper`; referenced 
-        as `self.irc`. In order to prevent a single line from being parsed 
-        repeatedly a variable `stale` is set to either True or False. 
-        
-        If the context is fresh, i.e. not `stale`, we loop over the line 
-        looking for matches to plugins.
+        Our IRC wrappers, `IrcWrapper`, kept in `self.networks`, place a 
+        context for every line they receive on the shared `self.messages` 
+        queue. Here we block on that queue, so each context is consumed 
+        exactly once and no time is spent waiting while the connections are 
+        idle.
         
-        Once the context is consumed, we set the context variable `stale` to 
-        True.
+        Each context is handed to the plugin handler, which looks up the 
+        matching command and event hooks in its dispatch index. The time 
+        since the line was received is recorded in the `dispatch.wait` 
+        metric.
         '''
         
         while True:
-            time.sleep(wait)
+            context = self.messages.get()
+            if context.received is not None:
+                metrics.observe('dispatch.wait', time.time() - context.received)
+            if not context.params:
+                continue
             
-            with self.irc.lock:
-                context_stale = lambda : self.irc.context.get('stale')
-                args = self.irc.context.get('args')
-                command = self.irc.context.get('command')
-                message = self.irc.context.get('message')
-                while not context_stale() and args:
-                    if message.startswith(prefix):
-                        for plugin in self.config['PLUGINS']:
-                            plugin['context'] = dict(self.irc.context)
-                            hook = prefix + plugin['hook']
-                            try:
-                                self.plugin.enqueue_plugin(plugin, hook, message)
-                            except Exception, e:
-                                self.logger.error(str(e))
-                                continue
-                    if command and command.isupper():
-                        for event in self.config['EVENTS']:
-                            event['context'] = dict(self.irc.context)
-                            hook = event['hook']
-                            try:
-                                self.plugin.enqueue_plugin(event, hook, command)
-                            except Exception, e:
-                                self.logger.error(str(e))
-                                continue
-                    
-                    # we're done here, context is stale, give us fresh fruit!
-                    self.irc.context['stale'] = True    
+            try:
+                self.plugin.dispatch(context, prefix)
+            except Exception, e:
+                self.logger.error(str(e))
     
     def command(self, hook=None, **kwargs):
         '''This method provides a decorator that can be used to load a 
@@ -184,39 +310,70 @@ class Bot(object):
         
         self.plugin.remove_plugin(hook, func, event=True)
     
-    def reply(self, message, context, action=False, notice=False, line_limit=400):
-        '''TODO'''
+    def reply(self, message, context, action=False, notice=False, line_limit=None):
+        '''This method sends `message` back to where `context` came from, 
+        i.e. the channel or user, on the network the line was received on.
+        
+        Long messages are split between words into lines that fit the 
+        server's 512 byte limit, or `line_limit` bytes if that is smaller. 
+        At most `REPLY_LINES` lines are sent, the last ending with 
+        `REPLY_CONTINUATION` if the message had to be cut short.
+        '''
         
-        if context['sender'].startswith('#'):
+        irc = self.networks.get(context.get('network'), self.irc)
+        
+        if irc.support.is_channel(context['sender']):
             recipient = context['sender']
         else:
             recipient = context['user']
         
-        messages = []
-        
-        def handle_long_message(message):
-            #truncate_at = message.rfind(' ', 1, line_limit) + 1
-            message, extra = message[:line_limit], message[line_limit:]
-            messages.append(message)
-            if extra:
-                handle_long_message(extra)
-        
-        handle_long_message(message)
+        messages = irc.split_message(recipient, message, action, notice, 
+                                     self.config.get('REPLY_LINES'), 
+                                     self.config.get('REPLY_CONTINUATION', ''), 
+                                     line_limit)
         
         for message in messages:
-            self.irc.send_message(recipient, message, action, notice)
+            irc.send_message(recipient, message, action, notice)
     
-    def run(self, wait=0.01):
+    def run(self):
+        configure_logger(self.logger, self.config)
         self._create_connection() # updates to the latest config
         
-        self.connection.connect()
-        self.irc.run() 
+        for irc in self.networks.values():
+            irc.connection.connect()
+            irc.run()
         
-        thread.start_new_thread(self._parse_input, ())
+        self.dispatcher = threading.Thread(target=self._parse_input)
+        self.dispatcher.daemon = True
+        self.dispatcher.start()
         
-        plugin_lists = [self.config['PLUGINS'], self.config['EVENTS']]
-        self.reloader = ReloadHandler(plugin_lists, self.plugin, self.logger)
+        self.reloader = ReloadHandler(self.plugin, self.logger,
+                                      self.config['PLUGIN_PATHS'])
         
-        while True:
-            time.sleep(wait)
-
+        self.metrics_server = None
+        if self.config['METRICS_PORT']:
+            self.metrics_server = MetricsServer(self.config['METRICS_HOST'],
+                                                self.config['METRICS_PORT'])
+            self.metrics_server.start()
+        
+        if self.config['ASYNC']:
+            self.loop.run() # all connection I/O happens on this thread
+        else:
+            self._block()
+    
+    def _block(self):
+        '''This internal method blocks the main thread, which has nothing 
+        left to do in threaded mode, for as long as the dispatcher runs.
+        
+        Under Python 2 neither joining a thread nor waiting on an `Event` 
+        without a timeout can be interrupted with Ctrl-C, and waiting with 
+        one polls, so we wait for a signal instead where the platform allows 
+        and otherwise sleep in long stretches.
+        '''
+        
+        pause = getattr(signal, 'pause', None)
+        while self.dispatcher.is_alive():
+            if pause is not None:
+                pause()
+            else:
+                time.sleep(60.0)
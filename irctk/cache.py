@@ -0,0 +1,58 @@
+'''
+    irctk.cache
+    -----------
+    
+    Provides `ResultCache`, used to remember the replies of plugins whose 
+    output depends only on their arguments.
+'''
+
+import collections
+import threading
+import time
+
+
+class ResultCache(object):
+    '''This class is a least recently used cache whose entries expire. It 
+    holds at most `size` entries, each for `ttl` seconds.
+    
+    An instance of this class might look like this:
+    
+        cache = ResultCache(size=128, ttl=300)
+        cache.set(('weather', 'london'), ['Rain, 12C'])
+        cache.get(('weather', 'london'))  # (True, ['Rain, 12C'])
+    '''
+    
+    def __init__(self, size=128, ttl=300):
+        self.size = size
+        self.ttl = ttl
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+    
+    def __len__(self):
+        return len(self.entries)
+    
+    def get(self, key):
+        '''This method returns a tuple of whether `key` was found and its 
+        value.
+        '''
+        
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                return False, None
+            expires, value = entry
+            if expires <= time.time():
+                return False, None
+            self.entries[key] = entry # now the most recently used
+            return True, value
+    
+    def set(self, key, value):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (time.time() + self.ttl, value)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+    
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
@@ -0,0 +1,85 @@
+'''
+    irctk.decoding
+    --------------
+    
+    Provides `Decoder`, which turns each line received from the server into 
+    text once, between framing and parsing, and `to_text`, used on the way 
+    out.
+'''
+
+from .cache import ResultCache
+
+
+class Decoder(object):
+    '''This class decodes received lines, which IRC leaves as bytes in 
+    whatever charset each client sends, to `unicode`.
+    
+    Lines are decoded as UTF-8, falling back to `fallback`, by default 
+    cp1252, a superset of latin-1 used by many older clients. Bytes that 
+    `fallback` has no character for are decoded as latin-1, so decoding 
+    never fails.
+    
+    Once a sender has sent a line that is not UTF-8 that decision is 
+    remembered, for up to `cache_size` senders for `ttl` seconds each, and 
+    their other lines are decoded with `fallback` too, even those that 
+    happen to be valid UTF-8. Lines of plain ASCII read the same in every 
+    charset, so they skip the lookup.
+    
+    An instance of this class might be used like this:
+    
+        decoder = Decoder('cp1252')
+        decoder.decode(':kaa!kaa@host PRIVMSG #ops :caf\\xe9')  # u'...caf\\xe9'
+    '''
+    
+    def __init__(self, fallback='cp1252', cache_size=1024, ttl=3600):
+        self.fallback = fallback
+        self.senders = ResultCache(cache_size, ttl)
+    
+    def decode(self, line):
+        try:
+            text = unicode(line, 'utf-8') # quicker than line.decode
+        except UnicodeDecodeError:
+            text = None
+        except TypeError:
+            return line # already decoded
+        else:
+            if len(text) == len(line):
+                return text # plain ASCII
+        
+        sender = _sender(line)
+        if text is not None:
+            if not self.fallback or not self.senders.get(sender)[0]:
+                return text
+        elif self.fallback:
+            self.senders.set(sender, True)
+        return self._decode_fallback(line)
+    
+    def _decode_fallback(self, line):
+        if not self.fallback:
+            return line.decode('utf-8', 'replace')
+        try:
+            return line.decode(self.fallback)
+        except UnicodeDecodeError:
+            return line.decode('latin-1')
+
+
+def _sender(line):
+    '''This function returns the prefix of the raw line `line`, skipping any 
+    IRCv3 tags, or an empty string if it has none.
+    '''
+    
+    if line[:1] == '@':
+        line = line.partition(' ')[2].lstrip(' ')
+    if line[:1] != ':':
+        return ''
+    return line[1:].partition(' ')[0]
+
+
+def to_text(text):
+    '''This function returns `text` as `unicode`. Byte strings, such as 
+    those returned by plugins, are taken to be UTF-8.
+    '''
+    
+    if isinstance(text, unicode):
+        return text
+    return text.decode('utf-8', 'replace')
@@ -0,0 +1,223 @@
+'''
+    irctk.framing
+    -------------
+    
+    Provides `LineBuffer`, which splits the stream of data received from the 
+    server into lines, and `join_lines`, which does the reverse for data sent 
+    to the server. `split_message` breaks long messages into lines that fit 
+    the protocol's line length, and `pack_targets` packs many targets into 
+    as few lines as possible.
+'''
+
+
+MAX_LINE = 512 # bytes, including the trailing \r\n
+
+
+def _split_point(data, start, budget):
+    '''This internal function returns where to end a line of at most 
+    `budget` bytes starting at `start` in `data`: after the last space that 
+    fits, or else at the last character boundary that fits.
+    '''
+    
+    limit = start + budget
+    space = data.rfind(' ', start + 1, limit + 1)
+    if space != -1:
+        return space
+    
+    # back off over UTF-8 continuation bytes, 10xxxxxx
+    while limit > start + 1 and ord(data[limit]) & 0xC0 == 0x80:
+        limit -= 1
+    return limit
+
+
+def split_message(message, budget, max_lines=None, continuation=''):
+    '''This function splits `message` into a list of lines of at most 
+    `budget` bytes once encoded as UTF-8. Lines are broken between words 
+    where possible and never inside a multibyte character; line breaks 
+    within the message are kept.
+    
+    If `max_lines` is given, at most that many lines are returned and the 
+    last of them ends with `continuation` when some of the message had to be 
+    left out.
+    
+    The lines are unicode if `message` is, otherwise they are byte strings.
+    '''
+    
+    is_unicode = isinstance(message, unicode)
+    data = message.encode('utf-8') if is_unicode else message
+    if isinstance(continuation, unicode):
+        continuation = continuation.encode('utf-8')
+    budget = max(budget, len(continuation) + 1)
+    
+    lines = []
+    for part in data.splitlines():
+        start, end = 0, len(part)
+        while start < end:
+            if max_lines and len(lines) == max_lines:
+                return _continued(lines, budget, continuation, is_unicode)
+            
+            if end - start <= budget:
+                split = end
+            else:
+                split = _split_point(part, start, budget)
+            lines.append(part[start:split].rstrip(' '))
+            
+            start = split
+            while start < end and part[start] == ' ':
+                start += 1
+    
+    if is_unicode:
+        lines = [line.decode('utf-8') for line in lines]
+    return lines
+
+
+def _continued(lines, budget, continuation, is_unicode):
+    '''This internal function ends the last of `lines` with `continuation`, 
+    shortening it first if need be, for a message that was cut short.
+    '''
+    
+    last = lines[-1]
+    if len(last) + len(continuation) > budget:
+        last = last[:_split_point(last, 0, budget - len(continuation))]
+    lines[-1] = last.rstrip(' ') + continuation
+    
+    if is_unicode:
+        lines = [line.decode('utf-8') for line in lines]
+    return lines
+
+
+def join_lines(lines):
+    '''This function takes a list of outgoing lines, `lines`, and returns a 
+    tuple of the data to write to the socket and the lines it contains.
+    
+    Only the first line of each element is kept, so embedded line breaks can 
+    not be used to inject extra commands. Lines may be `unicode`, which is 
+    encoded as UTF-8, or byte strings, which are sent as they are.
+    '''
+    
+    data = []
+    sent = []
+    for line in lines:
+        if not line:
+            continue
+        line = line.split('\n', 1)[0].split('\r', 1)[0]
+        sent.append(line)
+        if isinstance(line, unicode):
+            line = line.encode('utf-8', 'replace')
+        data.append(line)
+    data.append('')
+    return '\r\n'.join(data) if sent else '', sent
+
+
+def pack_targets(command, targets, budget=MAX_LINE - 2, limit=None, 
+                 suffix=''):
+    '''This function returns the lines of `command` needed for `targets`, 
+    e.g. channels to JOIN, with as many of them, separated by commas, in 
+    each line as fit in `budget` bytes, and at most `limit` if given. Each 
+    line ends with `suffix`, e.g. ' :reason' for PART.
+    
+    A target may carry a key, as in '#channel key'. The keys of a line 
+    follow its targets, separated by commas too, and so keyed targets are 
+    packed ahead of the rest.
+    
+    For example:
+    
+        pack_targets('JOIN', ['#a', '#b secret', '#c'])  # ['JOIN #b,#a,#c secret']
+    '''
+    
+    def size(text):
+        return len(text.encode('utf-8') if isinstance(text, unicode) else text)
+    
+    keyed = []
+    plain = []
+    for target in targets:
+        target, _, key = target.partition(' ')
+        if target:
+            (keyed if key else plain).append((target, key))
+    
+    fixed = size(command) + 1 + size(suffix)
+    lines = []
+    names, keys = [], []
+    used = fixed
+    for target, key in keyed + plain:
+        length = size(target) + (size(key) + 1 if key else 0)
+        if names:
+            length += 1 # the comma
+        full = limit and len(names) == limit
+        if names and (full or used + length > budget):
+            lines.append(_target_line(command, names, keys, suffix))
+            names, keys = [], []
+            used = fixed
+            length -= 1
+        names.append(target)
+        if key:
+            keys.append(key)
+        used += length
+    if names:
+        lines.append(_target_line(command, names, keys, suffix))
+    return lines
+
+
+def _target_line(command, names, keys, suffix):
+    line = command + ' ' + ','.join(names)
+    if keys:
+        line += ' ' + ','.join(keys)
+    return line + suffix
+
+
+class LineBuffer(object):
+    '''This class collects data as it is received and returns each complete 
+    line exactly once. Lines may be terminated by either `\\r\\n` or a bare 
+    `\\n`; the terminator is not included and empty lines are dropped.
+    
+    Data is kept in a `bytearray` along with the offset up to which it has 
+    already been scanned, so a burst that arrives over many reads is only 
+    scanned and copied once rather than re-split on every read.
+    
+    An instance of this class might look like this:
+    
+        buf = LineBuffer()
+        buf.feed('PING :server\\r\\nPRIVMSG #test :hel')  # ['PING :server']
+        buf.feed('lo\\n')                                 # ['PRIVMSG #test :hello']
+    '''
+    
+    def __init__(self):
+        self.buffer = bytearray()
+        self.offset = 0
+    
+    def __len__(self):
+        return len(self.buffer)
+    
+    def feed(self, data):
+        '''This method appends `data` to the buffer and returns a list of the 
+        complete lines now available.
+        '''
+        
+        buf = self.buffer
+        buf.extend(data)
+        
+        lines = []
+        start = 0
+        end = buf.find('\n', self.offset)
+        if end == -1:
+            self.offset = len(buf)
+            return lines
+        
+        view = memoryview(buf)
+        while end != -1:
+            line_end = end
+            if line_end > start and buf[line_end - 1] == 13: # \r
+                line_end -= 1
+            if line_end > start:
+                lines.append(view[start:line_end].tobytes())
+            start = end + 1
+            end = buf.find('\n', start)
+        del view
+        
+        del buf[:start]
+        self.offset = len(buf)
+        return lines
+    
+    def clear(self):
+        del self.buffer[:]
+        self.offset = 0
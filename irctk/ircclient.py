@@ -15,11 +15,32 @@
 
 import socket
 import thread
+import threading
 import Queue
 import time
 
 from ssl import wrap_socket, SSLError
 
+from .framing import LineBuffer, join_lines, split_message, pack_targets, \
+        MAX_LINE
+from .parser import parse
+from .ratelimit import SendScheduler
+from .state import StateTracker
+from .metrics import metrics
+from .logging import raw_logger
+from .decoding import Decoder, to_text
+from .reconnect import ReconnectManager, call_later
+from .isupport import ServerSupport
+
+
+# the targets per line assumed for commands until the server says otherwise; 
+# most servers take one channel per MODE and one mask per WHO
+TARGMAX = {'JOIN': None, 'PART': None, 'WHO': 1, 'MODE': 1}
+
+# lines that belong to a session and so are not sent again on a new one
+SESSION_COMMANDS = frozenset(['NICK', 'USER', 'PASS', 'CAP', 'PONG', 'PING', 
+                              'QUIT', 'JOIN'])
+
 
 class TcpClient(object):
     '''This is a TCP client that has been adapted for IRC connections. The 
@@ -35,8 +56,13 @@ class TcpClient(object):
     switch `self.shutdown` is used. Initially this is set to False but when 
     `close()` is called this attribute is set to True.
     
-    TODO: In order to prevent the server from disconnecting us for flooding, 
-    some kind of timed, rate-limiter should be implemented in the send loop.
+    Lines placed on `self.out` are sent as soon as possible. In order to 
+    prevent the server from disconnecting us for flooding, `IrcWrapper` 
+    releases lines to this queue through its `SendScheduler`.
+    
+    Should the connection be lost, `self.reconnector`, a `ReconnectManager`, 
+    reconnects, backing off with `backoff` and trying each of `servers`, a 
+    list of further `(host, port, ssl)` tuples, in turn.
     
     Also a logger should be implemented that would replace any print 
     statements that are currently being used for debug functionality. However 
@@ -54,19 +80,31 @@ class TcpClient(object):
         client.close()
     '''
     
-    def __init__(self, host, port, ssl=False, timeout=300.0, logger=None):
+    def __init__(self, host, port, ssl=False, timeout=300.0, logger=None, 
+                 servers=None, backoff=None):
         self.host = host
         self.port = port
         self.ssl = ssl
         self.inp = Queue.Queue()
         self.out = Queue.Queue()
-        self.inp_buffer = ''
-        self.out_buffer = ''
+        self.inp_buffer = LineBuffer()
+        self.out_lock = threading.Lock()
+        self.unsent = ''
         self.shutdown = False
         self.timeout = timeout
         self.reconnect_on_error = True
         socket.setdefaulttimeout(self.timeout)
         self.logger = logger
+        
+        self.ready = threading.Event() # set while a socket is connected
+        self.lock = threading.Lock()
+        self.reconnector = ReconnectManager(
+                self._attempt, 
+                [(host, port, ssl)] + list(servers or []), 
+                call_later, 
+                backoff, 
+                logger
+                )
     
     def connect(self, reconnect=False):
         '''This method initiates the socket connection by passing a tuple, 
@@ -81,96 +119,187 @@ class TcpClient(object):
         
         Finally the two primary loops, `_send()` and `_recv()` are invoked as 
         threads.
+        
+        Should the first connection fail, it is retried by `self.reconnector` 
+        as a lost connection would be, so one unreachable server does not 
+        stop the rest of the bot from starting.
         '''
         
         self.shutdown = False
+        if not reconnect:
+            self.reconnector.open()
         
-        self.socket = socket.socket()
+        sock = socket.socket()
         if self.ssl:
-            self.socket = wrap_socket(self.socket)
+            sock = wrap_socket(sock)
         
         server = (self.host, self.port)
-        self.socket.connect(server)
+        try:
+            sock.connect(server)
+        except (socket.error, IOError), e:
+            if reconnect:
+                raise
+            sock.close()
+            with self.lock:
+                self.socket = sock
+            self.inp.put('ERROR :Closing Link: connection lost')
+            self.reconnector.failed(e)
+        else:
+            with self.lock:
+                self.socket = sock
+                self.ready.set()
         if not reconnect:
             thread.start_new_thread(self._recv, ())
             thread.start_new_thread(self._send, ())
     
-    def close(self, wait=1.0):
+    def close(self, wait=0):
         '''This method closes an open socket. As per the original UNIX spec, 
         the socket is first alerted of an imminent shutdown by calling 
-        `shutdown()`. We then wait for `wait`-number of seconds. Finally we 
-        call `close()` on the socket.
+        `shutdown()`, after which the server closes its end, and `_recv()` 
+        ours, so nothing is left unsent. If given, we then wait for 
+        `wait`-number of seconds.
+        
+        No attempt is made to reconnect once a connection has been closed.
         '''
         
         self.shutdown = True
+        self.reconnector.close()
         
-        self.socket.shutdown(1)
-        time.sleep(wait)
         try:
-            self.socket.close() #seems to cause a problem, errno 9
+            self.socket.shutdown(socket.SHUT_WR)
         except Exception:
             pass
+        if wait:
+            time.sleep(wait)
     
-    def reconnect(self, wait=1.0):
-        '''This method will attempt to reconnect to a server. It should be 
-        called contextually after some failure perhaps. If the reconnection 
-        fails the error will be reported and execution will carry on.
-        
-        The `wait` parameter indicates the time in seconds to wait before 
-        trying to reconnect. Default is 30.
+    def reconnect(self, wait=None):
+        '''This method drops the current connection and reconnects. The 
+        `wait` parameter indicates the time in seconds to wait before trying 
+        to reconnect; by default the reconnect manager\'s backoff decides.
+        '''
         
-        Before attempting to connect this method will try to terminate an 
-        existing socket connection if one exists.
+        self._lost(self.socket, wait)
+    
+    def _lost(self, sock, wait=None):
+        '''This internal method handles the loss of the connection on 
+        `sock`, once, closing it and, unless we are shutting down, feeding 
+        an ERROR line to the IRC wrapper and asking `self.reconnector` for 
+        another attempt.
         '''
         
+        with self.lock:
+            if sock is not self.socket or not self.ready.is_set():
+                return # already handled
+            self.ready.clear()
+        
         try:
-            self.close()
-        except Exception, e:
-            self.logger.debug('exception while closing old socket: ' + str(e))
-        time.sleep(wait)
+            sock.close()
+        except Exception:
+            pass
+        self.inp_buffer.clear() # drop any partial line from the old socket
+        
+        if self.shutdown or not self.reconnect_on_error:
+            return
+        self.inp.put('ERROR :Closing Link: connection lost')
+        self.reconnector.lost(wait)
+    
+    def _attempt(self, host, port, ssl):
+        '''This internal method is called by `self.reconnector` to connect 
+        to `host` and `port`. A RECONNECT line lets the IRC wrapper know to 
+        register, after which it collects the lines `_send` set aside with 
+        `take_unsent` and sends them again.
+        '''
+        
+        self.host, self.port, self.ssl = host, port, ssl
         self.connect(reconnect=True)
+        self.reconnector.connected()
+        self.inp.put('RECONNECT :server')
+    
+    def take_unsent(self):
+        '''This method returns the lines that were left unsent when the 
+        connection was last lost, forgetting them.
+        '''
+        
+        with self.out_lock:
+            data, self.unsent = self.unsent, ''
+        return [line for line in data.split('\r\n') if line]
     
-    def _recv(self, reconnect_wait=5.0, byte_size=4096):
-        '''Internal method that processes incoming data.'''
+    def _recv(self, byte_size=4096):
+        '''Internal method that processes incoming data. Data is framed into 
+        lines by `self.inp_buffer` and each complete line, without its line 
+        ending, is placed on `self.inp`. The lines of each read are logged as 
+        a single record.
+        
+        An error, timeout or the end of the stream mean the connection was 
+        lost; we then wait for it to be back up.
+        '''
         
         while True:
-            
+            self.ready.wait()
+            sock = self.socket
             try:
-                if not self.shutdown:
-                    data = self.socket.recv(byte_size)
+                data = sock.recv(byte_size)
             except (SSLError, socket.error, socket.timeout):
-                if self.reconnect_on_error:
-                    self.logger.error('Connection lost, reconnecting.')
-                    self.reconnect(reconnect_wait)
-                    self.inp.put('Error :Closing Link:\r\n')
-                    reconnect_wait *= reconnect_wait
-                    continue
-                else:
-                    self.close()
+                data = ''
             
-            self.inp_buffer += data
+            if not data:
+                self._lost(sock)
+                continue
             
-            while '\r\n' in self.inp_buffer and not self.shutdown:
-                
-                line, self.inp_buffer = self.inp_buffer.split('\r\n', 1)
-                self.inp.put(line + '\r\n')
-                self.logger.info(line)
+            lines = self.inp_buffer.feed(data)
+            for line in lines:
+                self.inp.put(line)
+            if lines:
+                raw_logger(self.logger).info('\n'.join(lines))
+            metrics.incr('irc.bytes_in', len(data))
+            metrics.incr('irc.lines_in', len(lines))
     
-    def _send(self):
-        '''Internal method that processes outgoing data.'''
+    def _send(self, batch_size=8192):
+        '''Internal method that processes outgoing data.
         
+        Once a line is available, every other line already waiting on 
+        `self.out` is taken with it, up to `batch_size` bytes, and the batch 
+        is written with a single `sendall` and logged as a single record. 
+        
+        Batches that could not be sent, because the connection is down or 
+        the send failed, are added to `self.unsent`, for the IRC wrapper to 
+        send again once we are back. A failed send is logged once for each 
+        connection, rather than for every batch until it is back up.
+        '''
+        
+        failed = None # the socket a send last failed on
         while True:
+            lines = [self.out.get(True)]
+            size = len(lines[0])
+            while size < batch_size:
+                try:
+                    line = self.out.get_nowait()
+                except Queue.Empty:
+                    break
+                lines.append(line)
+                size += len(line)
             
-            line = self.out.get(True).splitlines()
-            if line:
-                line = line[0]
-                self.out_buffer += line.encode('utf-8', 'replace') + '\r\n'
-                self.logger.info(line)
+            data, lines = join_lines(lines)
+            if lines:
+                raw_logger(self.logger).info('\n'.join(lines))
+                metrics.incr('irc.lines_out', len(lines))
+            if not data or self.shutdown:
+                continue
             
-            while self.out_buffer and not self.shutdown:
-                
-                sent = self.socket.send(self.out_buffer)
-                self.out_buffer = self.out_buffer[sent:]
+            sock = self.socket
+            if self.ready.is_set():
+                try:
+                    sock.sendall(data)
+                    metrics.incr('irc.bytes_out', len(data))
+                    continue
+                except (SSLError, socket.error, socket.timeout), e:
+                    metrics.incr('irc.send_errors')
+                    if sock is not failed and self.logger:
+                        self.logger.error('Send failed: {0}'.format(e))
+                    failed = sock
+            
+            with self.out_lock:
+                self.unsent += data
 
 
 class IrcWrapper(object):
@@ -194,161 +323,279 @@ class IrcWrapper(object):
         channels = ['#voxinfinitus', '#testing']
         
         irc = IrcWrapper(client, 'Kaa', 'Kaa the Python', channels)
+    
+    Several wrappers may share one `messages` queue, in which case `network` 
+    names the connection each context came from.
+    
+    Outgoing lines are rate-limited by `scheduler`, a `SendScheduler`. One 
+    with the default limits is created if none is given.
+    
+    Received lines are decoded by `decoder`, a `Decoder`, before they are 
+    parsed, so contexts hold `unicode`; the bytes received are kept as the 
+    context's `raw`. One falling back to cp1252 is created if none is given.
     '''
     
-    def __init__(self, connection, nick, realname, channels, logger):
+    def __init__(self, connection, nick, realname, channels, logger, 
+                 network=None, messages=None, scheduler=None, decoder=None):
         self.connection = connection
+        self.logger = logger
+        self.network = network
         self.nick = nick
         self.realname = realname
         self.user = 'USER ' + nick + ' 3 * ' + realname
         self.channels = channels
-        self.inp_buffer = ''
-        self.out_buffer = ''
-        self.lock = thread.allocate_lock()
+        self.scheduler = scheduler if scheduler is not None else SendScheduler()
+        self.messages = messages if messages is not None else Queue.Queue()
+        self.decoder = decoder if decoder is not None else Decoder()
+        self.rejoin = [] # the channels we were in when the connection dropped
+        self.welcomed = False # whether 001 came, and our session is to restore
         
-        self.context = {}
+        # what the server supports, from ISUPPORT and CAP
+        self.support = ServerSupport()
+        self.targmax = dict(TARGMAX) # None for no limit
+        self.line_length = MAX_LINE
+        
+        self.hostmask = None # our own nick!user@host, once the server says
+        self.state = StateTracker(nick, self.support.fold)
+        self.context = None
         
     def _register(self):
         '''This internal method attempts to register the connection with the 
         server by sending the NICK and then USER commands as soon as the 
-        connection object is received.
+        connection object is received. They are preceded by CAP LS, which 
+        servers that negotiate capabilities answer before registering us, 
+        and others ignore.
         '''
         
-        lines = ['NICK ' + self.nick, self.user]
-        self._send_lines(lines)
+        self.support.reset()
+        self._apply_support()
+        lines = ['CAP LS 302', 'NICK ' + self.nick, self.user]
+        self._send_lines(lines, priority=True)
     
-    def _send(self, wait=0.1, wait_time=1.0, wait_base=1.0, byte_size=8192):
-        '''This internal method reads off of `self.out_buffer`, sending the 
-        contents to the connection object's output queue.
+    def _apply_support(self):
+        '''This internal method passes what `self.support` knows of the 
+        server on to the state tracker, the scheduler and the limits used to 
+        pack and split lines.
+        '''
         
-        Here we use `time.sleep` to sleep `wait`-number of seconds. This 
-        prevents the threads from running all the time and consequently 
-        maxing out the CPU.
+        support = self.support
+        self.state.fold = support.fold
+        self.state.prefix_modes = support.prefix_modes
+        self.state.prefix_symbols = support.prefix_symbols
+        self.state.chanmodes = support.chanmodes
+        self.scheduler.fold = support.fold
         
-        TODO: rate limiter does not yet work. Perhaps a proper implementation 
-        of the leaky bucket?
+        self.targmax = dict(TARGMAX)
+        self.targmax.update(support.targmax)
+        self.line_length = support.line_length
+    
+    def _send(self):
+        '''This internal method takes lines from `self.scheduler`, sending 
+        them to the connection object's output queue. The scheduler blocks 
+        until a line may be sent without exceeding the rate limits.
         '''
         
         while True:
-            time.sleep(wait)
-            while '\r\n' in self.out_buffer and not self.connection.shutdown:
-                line, self.out_buffer = self.out_buffer.split('\r\n', 1)
-                if len(self.out_buffer) >= byte_size:
-                    wait_time *= wait_time
-                    time.sleep(wait_time)
-                elif wait_time > wait_base:
-                    wait_time /= wait_time
-                elif wait_time < wait_base:
-                    wait_time = wait_base
-                self.connection.out.put(line)
-    
-    def _recv(self, reconnect_wait=5.0):
-        '''This internal method pulls data from the connection's input queue.
-        It then places this information in a local input buffer and loops over 
-        this buffer, line by line, parsing it via `_parse_line()`.
-        
-        Parsed lines are stored in `self.prefix`, 'self.command', and 
-        'self.args'.
-        
-        In this loop we check to see if the connection has been properly 
-        registered with the server and if so loop through the channels defined 
-        in `self.channels`, sending a JOIN command for each respectively.
-        
-        Here we use `time.sleep` to sleep `wait`-number of seconds. This 
-        prevents the threads from running all the time and consequently 
-        maxing out the CPU.
+            line = self.scheduler.get()
+            self.connection.out.put(line)
+    
+    def _recv(self):
+        '''This internal method pulls lines from the connection's input queue, 
+        handing each to `_receive()`.
         '''
         
         while True:
-            self.inp_buffer += self.connection.inp.get()
-            while '\r\n' in self.inp_buffer and not self.connection.shutdown:
-                with self.lock:
-                    self.line, self.inp_buffer = self.inp_buffer.split('\r\n', 1)
-                    self.prefix, self.command, self.args = self._parse_line(self.line)
-                    
-                    self.sender = self.args[0]
-                    self.message = self.args[-1]
-                    
-                    self.context = {
-                        'prefix' : self.prefix, 
-                        'command' : self.command, 
-                        'args' : self.args,
-                        'sender': self.sender if self.args else '',
-                        'user': self.prefix.rsplit('!', 1)[0],
-                        'hostmask': self.prefix.rsplit('!', 1)[-1],
-                        'message': self.message if self.args else '',
-                        'stale': False,
-                        }
-                    
-                    if 'ERROR :Closing link:' in self.line:
-                        self.connection.logger.error('Connection lost, reconnecting.')
-                        self.connection.reconnect(reconnect_wait)
-                        self.connection.inp.put('RECONNECT :server\r\n')
-                        reconnect_wait *= reconnect_wait
-                    
-                    if self.command == 'PING':
-                        self._send_line('PONG ' + ''.join(self.args))
-                    elif self.command == '001' and self.channels:
-                        for channel in self.channels:
-                            self._send_line('JOIN ' + channel)
-                    elif self.command == '433':
-                        self.nick = self.nick + '_'
-                        self._send_line('NICK ' + self.nick)
-                    elif self.command == 'RECONNECT':
-                        self._register()
+            line = self.connection.inp.get()
+            if not self.connection.shutdown:
+                self._receive(line)
     
-    def _parse_line(self, line):
-        '''This internal method takes a line as recieved from the IRC server 
-        and parses it appropriately.
+    def _receive(self, line):
+        '''This internal method hands `line` to `_handle_line()`, logging 
+        rather than raising any error, so that one malformed line from the 
+        server does not stop us receiving the rest.
+        '''
         
-        Returns `prefix`, `command`, `args`.
+        try:
+            self._handle_line(line)
+        except Exception, e:
+            metrics.incr('irc.line_errors')
+            if self.logger:
+                self.logger.error('Failed handling line {0!r}: {1}'.format(line, e))
+    
+    def _handle_line(self, line):
+        '''This internal method parses a single line, `line`, as received 
+        from the server via `parse()`.
+        
+        Each line is parsed into a `Message`, which serves as the line's 
+        immutable context. It updates `self.state`, the channels and users we 
+        know of, before it is placed on `self.messages`, to be consumed by 
+        the dispatcher, and kept as `self.context`.
+        
+        Here we check to see if the connection has been properly registered 
+        with the server and if so restore our session with `_restore()`, 
+        joining the channels defined in `self.channels` and those we were in 
+        before the connection was lost. This waits for the end of the MOTD, 
+        by which time the server has sent its ISUPPORT tokens, so the JOINs 
+        are packed to its limits.
         '''
         
-        prefix = ''
-        trailing = []
-        if not line:
-            raise Exception('Received an empty line from the server.')
+        start = time.time()
+        context = parse(self.decoder.decode(line), self.network, line, start)
+        metrics.observe('irc.parse_time', time.time() - start)
+        self.context = context
+        self.state.feed(context)
+        self.messages.put(context)
+        
+        command = context.command
+        if command == 'PING':
+            self._send_line('PONG ' + ''.join(context.params))
+        elif command == '001':
+            self.welcomed = True
+        elif command in ('376', '422') and self.welcomed:
+            self.welcomed = False
+            self._restore()
+        elif command == '005':
+            self.support.feed_isupport(context.params[1:-1])
+            self._apply_support()
+        elif command == 'CAP':
+            reply = self.support.feed_cap(context.params[1:])
+            if reply:
+                self._send_line(reply, priority=True)
+        elif command == '433':
+            self.nick = self.nick + '_'
+            self._send_line('NICK ' + self.nick, priority=True)
+        elif command == 'ERROR':
+            self._hold()
+        elif command == 'RECONNECT':
+            self._hold()
+            self._register()
+        
+        if command in ('001', 'JOIN', 'NICK', '396'):
+            self._update_hostmask(context)
+    
+    def _update_hostmask(self, context):
+        '''This internal method keeps `self.hostmask`, our own 
+        nick!user@host as seen by others, up to date from the welcome 
+        message, our own JOINs and NICK changes, and hidden host notices.
+        '''
         
-        if line[0] == ':':
-            prefix, line = line[1:].split(' ', 1)
+        command = context.command
+        if command == '001':
+            mask = context.message.rsplit(' ', 1)[-1]
+            if '!' in mask and '@' in mask:
+                self.hostmask = mask
+        elif command == 'JOIN' and context.nick == self.nick:
+            self.hostmask = context.prefix
+        elif command == 'NICK' and context.nick == self.nick:
+            self.nick = context.message
+            if self.hostmask:
+                self.hostmask = self.nick + '!' + self.hostmask.split('!', 1)[-1]
+        elif command == '396' and self.hostmask and len(context.params) > 1:
+            self.hostmask = self.hostmask.split('@', 1)[0] + '@' + context.params[1]
+    
+    def message_budget(self, recipient, command='PRIVMSG'):
+        '''This method returns the number of bytes of text that fit in one 
+        `command` line to `recipient`, once the server has relayed it with 
+        our nick!user@host prefixed. Until that is known the longest prefix 
+        servers commonly allow for our nick is assumed.
+        '''
         
-        if line.find(' :') != -1:
-            line, trailing = line.split(' :', 1)
-            args = line.split()
-            args.append(trailing)
-        else:
-            args = line.split()
+        hostmask = self.hostmask or self.nick + '!' + 'x' * 10 + '@' + 'x' * 63
+        line = ':' + hostmask + ' ' + command + ' ' + recipient + ' :\r\n'
+        if isinstance(line, unicode):
+            line = line.encode('utf-8')
+        return self.line_length - len(line)
+    
+    def split_message(self, recipient, message, action=False, notice=False, 
+                      max_lines=None, continuation='', line_limit=None):
+        '''This method splits `message` into as many lines to `recipient` as 
+        it takes, of at most `max_lines`, using `split_message`. See that 
+        function for the meaning of `continuation`. Lines may be limited to 
+        fewer bytes than fit with `line_limit`.
+        '''
         
-        command = args.pop(0)
+        budget = self.message_budget(recipient, 'NOTICE' if notice else 'PRIVMSG')
+        if line_limit:
+            budget = min(budget, line_limit)
+        if action:
+            budget -= len(chr(1) + 'ACTION ' + chr(1))
+        return split_message(message, budget, max_lines, continuation)
+    
+    def _hold(self):
+        '''This internal method holds back everything but registration and 
+        PONG lines while the connection is down, remembering the channels we 
+        were in. The connection reports the loss with an ERROR line, and a 
+        new connection with a RECONNECT line.
+        '''
         
-        return prefix, command, args
+        if not self.scheduler.held:
+            self.rejoin = self.state.channels()
+        self.scheduler.hold()
     
-    def _send_line(self, line):
-        '''This internal method takes one parameter, `lines`, loops over it 
-        and sends each element directly to the `_send()` loop. This is used 
-        for sending raw messages to the server. Not for use outside of the 
-        scope of this class!
+    def _restore(self):
+        '''This internal method restores our session once the server has 
+        welcomed us and finished its MOTD: it joins `self.channels` and any 
+        others we were in, packing as many into each JOIN as the server 
+        allows, sends again the lines left unsent when the connection 
+        dropped, and then lets the lines queued meanwhile go.
+        '''
         
-        This method is not rate-limited. Use with caution.
+        channels = []
+        folded = set()
+        for channel in list(self.channels) + self.rejoin:
+            key = self.state.fold(channel.split(' ', 1)[0])
+            if key not in folded:
+                folded.add(key)
+                channels.append(channel)
+        self.rejoin = []
+        self.send_join(channels, priority=True)
+        
+        take_unsent = getattr(self.connection, 'take_unsent', None)
+        if take_unsent is not None:
+            replay = [line for line in take_unsent() 
+                      if line.split(' ', 1)[0].upper() not in SESSION_COMMANDS]
+            self.scheduler.requeue(replay)
+        
+        self._release()
+        reconnector = getattr(self.connection, 'reconnector', None)
+        if reconnector is not None:
+            reconnector.registered()
+    
+    def _release(self):
+        self.scheduler.release()
+    
+    def _parse_line(self, line):
+        '''This internal method takes a line as recieved from the IRC server 
+        and parses it appropriately.
+        
+        Returns `prefix`, `command`, `args`.
         '''
         
-        self.out_buffer += line + '\r\n'
+        message = parse(line)
+        return message.prefix, message.command, list(message.params)
     
-    def _send_lines(self, lines):
-        '''This internal method takes one parameter, `lines`, loops over it 
-        and sends each element directly to the `_send()` loop. This is used 
+    def _send_line(self, line, priority=None):
+        '''This internal method takes one parameter, `line`, and places it on 
+        `self.scheduler` to be picked up by the `_send()` loop. This is used 
         for sending raw messages to the server. Not for use outside of the 
         scope of this class!
         
-        The a `rate` of lines to send may be specified, defaults to 5.0. This 
-        corresponds to the `per` parameter, which detauls to 20.0. So a rate 
-        of 5 lines per 20 seconds is the default, i.e. no more than 5 lines 
-        in 20 seconds.
+        PONG and QUIT lines, and others if `priority` is True, bypass the 
+        queue; all others are rate-limited.
         '''
         
-        for line in lines:
-            self.out_buffer += line + '\r\n'
+        self.scheduler.put(line, priority=priority)
+    
+    def _send_lines(self, lines, priority=None):
+        '''This internal method takes one parameter, `lines`, loops over it 
+        and places each element on `self.scheduler` to be picked up by the 
+        `_send()` loop. This is used for sending raw messages to the server. 
+        Not for use outside of the scope of this class!
+        '''
         
+        for line in lines:
+            self.scheduler.put(line, priority=priority)
+    
     def run(self):
         '''This method sets up the connection by sending the USER command to 
         the server we are connecting to. Once our client is acknowledged and 
@@ -366,18 +613,22 @@ class IrcWrapper(object):
         equivalents.
         
         The arguments are concatenated to the command and then sent along to 
-        the connection queue.
+        the connection queue. Byte strings among them are taken to be UTF-8, 
+        so they may be mixed with the `unicode` received from the server.
         '''
         
-        command = command + ' ' + ''.join(args)
+        if isinstance(args, basestring):
+            args = [args]
+        command = to_text(command) + ' ' + ''.join(map(to_text, args))
         if prefix:
-            command = prefix + command
+            command = to_text(prefix) + command
         
         self._send_lines([command])
     
     def send_message(self, recipient, message, action=False, notice=False):
         '''TODO'''
         
+        recipient, message = to_text(recipient), to_text(message)
         if action:
             self.send_action(recipient, message)
         elif notice:
@@ -385,40 +636,72 @@ class IrcWrapper(object):
         else:
             self.send_command('PRIVMSG', [recipient + ' :' + message])
     
-    def send_reply(self, message, action=False, line_limit=400):
+    def send_reply(self, message, action=False, line_limit=None):
         '''Warning: Deprecated. Use the reply method in bot.py instead.'''
         
-        if self.context['sender'].startswith('#'):
+        if self.support.is_channel(self.context['sender']):
             recipient = self.context['sender']
         else:
             recipient = self.context['user']
         
-        messages = []
-        def handle_long_message(message):
-            message, extra = message[:line_limit], message[line_limit:]
-            messages.append(message)
-            if extra:
-                handle_long_message(extra)
-        handle_long_message(message)
-        
+        messages = self.split_message(recipient, message, action, 
+                                      line_limit=line_limit)
         for message in messages:
             self.send_message(recipient, message, action)
     
     def send_notice(self, recipient, message):
         '''TODO'''
         
+        recipient, message = to_text(recipient), to_text(message)
         self.send_command('NOTICE', [recipient + ' :' + message])
     
     def send_action(self, recipient, message):
         '''TODO'''
         
-        message = chr(1) + 'ACTION ' + message + chr(1)
+        message = chr(1) + 'ACTION ' + to_text(message) + chr(1)
         self.send_message(recipient, message)
     
+    def send_targets(self, command, targets, suffix='', priority=None):
+        '''This method sends `command` for each of `targets`, packing as 
+        many into each line as `self.line_length` and the command's entry in 
+        `self.targmax` allow, with `pack_targets`. Each line ends with 
+        `suffix`.
+        '''
+        
+        targets = [to_text(target) for target in targets]
+        lines = pack_targets(to_text(command), targets, self.line_length - 2, 
+                             self.targmax.get(command.upper(), 1), 
+                             to_text(suffix))
+        self._send_lines(lines, priority=priority)
+    
+    def send_join(self, channels, priority=None):
+        '''This method joins `channels`, each of which may be followed by its 
+        key, as in '#channel key'.
+        '''
+        
+        self.send_targets('JOIN', channels, priority=priority)
+    
+    def send_part(self, channels, message=None):
+        '''This method leaves `channels`, giving `message` as the reason if 
+        set.
+        '''
+        
+        self.send_targets('PART', channels, ' :' + message if message else '')
+    
+    def send_who(self, masks):
+        '''This method asks who matches each of `masks`.'''
+        
+        self.send_targets('WHO', masks)
+    
+    def send_mode(self, targets):
+        '''This method asks for the modes of each of `targets`.'''
+        
+        self.send_targets('MODE', targets)
+    
     def quit(self, message='kaa', wait=1.0):
         '''TODO'''
         
         self.send_command('QUIT', ':' + message)
+        time.sleep(wait) # give the QUIT a chance to be sent
         self.connection.close()
-        time.sleep(wait)
 
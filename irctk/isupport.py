@@ -0,0 +1,230 @@
+'''
+    irctk.isupport
+    --------------
+    
+    Provides `ServerSupport`, what we know of the server we are connected to 
+    from its ISUPPORT (005) tokens and the capabilities negotiated with CAP, 
+    and `casemapping`, which returns the function that folds nicks and 
+    channel names the way the server compares them.
+'''
+
+import string
+
+
+# the capabilities we ask for, if the server offers them
+CAPABILITIES = frozenset(['multi-prefix', 'userhost-in-names'])
+
+# what is assumed until the server says otherwise
+DEFAULTS = {
+    'CASEMAPPING': 'rfc1459',
+    'CHANTYPES': '#&',
+    'PREFIX': '(ov)@+',
+    'CHANMODES': 'beI,k,l,imnpst',
+    'TARGMAX': '',
+    'LINELEN': '512',
+    }
+
+
+def _fold_table(upper, lower):
+    '''This function returns a pair of tables for `str.translate` and 
+    `unicode.translate` mapping each character of `upper` to the same one 
+    of `lower`.
+    '''
+    
+    table = string.maketrans(upper, lower)
+    utable = dict((ord(u), ord(l)) for u, l in zip(upper, lower))
+    return table, utable
+
+
+def _folder(table, utable, cache_size=4096):
+    '''This function returns a function that folds names with `table`, or 
+    `utable` for `unicode` beyond ASCII. The same few nicks and channels 
+    come up again and again, so up to `cache_size` names are remembered 
+    folded; the cache simply starts over once it is full.
+    '''
+    
+    cache = {}
+    
+    def fold(name):
+        folded = cache.get(name)
+        if folded is None:
+            folded = name
+            if isinstance(folded, unicode):
+                try:
+                    folded = folded.encode('ascii')
+                except UnicodeError:
+                    folded = folded.translate(utable)
+            if not isinstance(folded, unicode):
+                folded = folded.translate(table)
+            if len(cache) >= cache_size:
+                cache.clear()
+            cache[name] = folded
+        return folded
+    return fold
+
+
+CASEMAPPINGS = {
+    'ascii': _folder(*_fold_table(string.ascii_uppercase,
+                                  string.ascii_lowercase)),
+    'strict-rfc1459': _folder(*_fold_table(string.ascii_uppercase + '[]\\',
+                                           string.ascii_lowercase + '{}|')),
+    'rfc1459': _folder(*_fold_table(string.ascii_uppercase + '[]\\~',
+                                    string.ascii_lowercase + '{}|^')),
+    }
+
+
+def casemapping(name):
+    '''This function returns the function that folds nicks and channel 
+    names under the casemapping `name`, e.g. 'rfc1459'. The tables these 
+    use are built once, when this module is imported, and names already 
+    folded are looked up rather than translated again. Mappings we do not 
+    know, such as 'rfc7613', fold as rfc1459.
+    
+    Folded names are byte strings where they are plain ASCII, which compare 
+    and hash the same as the `unicode` they were folded from.
+    '''
+    
+    return CASEMAPPINGS.get(name.lower(), CASEMAPPINGS['rfc1459'])
+
+
+def _unescape(value):
+    '''This function reverses the \\xHH escapes used in ISUPPORT values.'''
+    
+    if '\\x' not in value:
+        return value
+    parts = value.split('\\x')
+    chars = [parts[0]]
+    for part in parts[1:]:
+        try:
+            chars.append(chr(int(part[:2], 16)) + part[2:])
+        except ValueError:
+            chars.append('\\x' + part)
+    return ''.join(chars)
+
+
+class ServerSupport(object):
+    '''This class holds what the server has told us it supports. Tokens 
+    from each 005 line are added with `feed_isupport`; the raw tokens are 
+    kept in `tokens`, and those we act on are worked out into attributes:
+    
+        `fold`             folds nicks and channel names, see `casemapping`
+        `chantypes`        the characters channel names begin with
+        `prefix_modes`     the member modes, e.g. 'ov', and
+        `prefix_symbols`   their symbols, e.g. '@+'
+        `chanmodes`        the channel modes by type, see `StateTracker`
+        `targmax`          the most targets each command takes per line,
+                           None for no limit
+        `line_length`      the longest line the server accepts, in bytes
+    
+    The capabilities the server offers are kept in `available`, and those 
+    it acknowledged in `caps`.
+    
+    An instance of this class might look like this:
+    
+        support = ServerSupport()
+        support.feed_isupport(['CHANTYPES=#', 'TARGMAX=JOIN:,PRIVMSG:4'])
+        support.is_channel('#ops')   # True
+        support.targmax['PRIVMSG']   # 4
+    '''
+    
+    def __init__(self):
+        self.reset()
+    
+    def reset(self):
+        '''This method forgets what the server told us, e.g. once we have 
+        reconnected, possibly to a different server.
+        '''
+        
+        self.tokens = dict(DEFAULTS)
+        self.available = {}
+        self.caps = set()
+        self._update()
+    
+    def feed_isupport(self, params):
+        '''This method adds the tokens in `params`, the parameters of a 005 
+        line between our nick and its closing text. A token of the form 
+        '-NAME' withdraws an earlier one.
+        '''
+        
+        for param in params:
+            if param.startswith('-'):
+                name = param[1:].upper()
+                if name in DEFAULTS:
+                    self.tokens[name] = DEFAULTS[name]
+                else:
+                    self.tokens.pop(name, None)
+            elif param:
+                name, _, value = param.partition('=')
+                self.tokens[name.upper()] = _unescape(value)
+        self._update()
+    
+    def _update(self):
+        tokens = self.tokens
+        self.casemapping = tokens['CASEMAPPING'] or DEFAULTS['CASEMAPPING']
+        self.fold = casemapping(self.casemapping)
+        self.chantypes = tokens['CHANTYPES']
+        
+        prefix = tokens['PREFIX']
+        modes, _, symbols = prefix[1:].partition(')')
+        if prefix.startswith('(') and len(modes) == len(symbols):
+            self.prefix_modes, self.prefix_symbols = modes, symbols
+        else:
+            self.prefix_modes, self.prefix_symbols = '', ''
+        
+        chanmodes = (tokens['CHANMODES'].split(',') + [''] * 4)[:4]
+        self.chanmodes = tuple(chanmodes)
+        
+        self.targmax = {}
+        for entry in tokens['TARGMAX'].split(','):
+            command, _, limit = entry.partition(':')
+            if not command:
+                continue
+            try:
+                self.targmax[command.upper()] = int(limit) if limit else None
+            except ValueError:
+                pass # a malformed limit leaves the command's default
+        
+        try:
+            self.line_length = int(tokens['LINELEN']) or 512
+        except ValueError:
+            self.line_length = 512
+    
+    def is_channel(self, name):
+        '''This method returns True if `name` is a channel rather than a 
+        nick.
+        '''
+        
+        return bool(name) and name[0] in self.chantypes
+    
+    def feed_cap(self, params):
+        '''This method takes the parameters of a CAP line following our 
+        nick, and returns the reply to send, if any: a request for those of 
+        `CAPABILITIES` on offer, and CAP END once the server has answered.
+        '''
+        
+        if not params:
+            return None
+        subcommand = params[0].upper()
+        more = len(params) > 2 and params[1] == '*'
+        names = params[-1].split() if len(params) > 1 else []
+        
+        if subcommand == 'LS':
+            for name in names:
+                name, _, value = name.partition('=')
+                self.available[name] = value
+            if more:
+                return None
+            wanted = sorted(CAPABILITIES.intersection(self.available))
+            if wanted:
+                return 'CAP REQ :' + ' '.join(wanted)
+            return 'CAP END'
+        elif subcommand == 'ACK':
+            for name in names:
+                if name.startswith('-'):
+                    self.caps.discard(name[1:])
+                else:
+                    self.caps.add(name)
+            return 'CAP END'
+        elif subcommand == 'NAK':
+            return 'CAP END'
+        return None
@@ -3,14 +3,158 @@
     ------------
     
     Creates the logging object `logger`.
+    
+    Records are written by a background thread, through `QueueHandler`, so 
+    the threads doing socket I/O never wait on a slow terminal or log pipe. 
+    Raw protocol lines are logged to a child logger of their own, see 
+    `raw_logger`, whose volume is kept in check by `LineRateFilter`.
 '''
 
 from __future__ import absolute_import
 
 import logging
+import threading
+import Queue
+
+from .ratelimit import TokenBucket
 
 FORMAT = '%(asctime)s %(name)s - %(filename)s:%(lineno)d - %(levelname)s - %(message)s'
 
+RAW = 'raw'
+
+
+class QueueHandler(logging.Handler):
+    '''This class hands records to `handler` from a background thread. 
+    Logging a record only puts it on a queue, which holds at most `capacity` 
+    records; should the writer fall that far behind, further records are 
+    dropped, rather than blocking the caller, and a count of them is logged 
+    once there is room again.
+    
+    Records are formatted by `handler`, in the writer thread. Their message 
+    is rendered before they are queued, so arguments changed afterwards do 
+    not change what is logged.
+    '''
+    
+    def __init__(self, handler, capacity=10000):
+        logging.Handler.__init__(self)
+        self.handler = handler
+        self.queue = Queue.Queue(capacity)
+        self.dropped = 0
+        self.writer = None
+        self.writer_lock = threading.Lock()
+    
+    def _start(self):
+        with self.writer_lock:
+            if self.writer is None:
+                self.writer = threading.Thread(target=self._write)
+                self.writer.daemon = True
+                self.writer.start()
+    
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging._defaultFormatter.formatException(
+                    record.exc_info)
+            record.exc_info = None
+        return record
+    
+    def emit(self, record):
+        if self.writer is None:
+            self._start()
+        try:
+            if self.dropped:
+                self.queue.put_nowait(self._dropped_record(record))
+                self.dropped = 0
+            self.queue.put_nowait(self.prepare(record))
+        except Queue.Full:
+            self.dropped += 1 # never block the caller
+        except Exception:
+            self.handleError(record)
+    
+    def _dropped_record(self, record):
+        return logging.makeLogRecord({
+            'name': record.name,
+            'levelno': logging.WARNING,
+            'levelname': 'WARNING',
+            'msg': '{0} log records dropped'.format(self.dropped),
+            })
+    
+    def _write(self):
+        while True:
+            record = self.queue.get()
+            try:
+                if record is None:
+                    return
+                self.handler.handle(record)
+            except Exception:
+                self.handleError(record)
+            finally:
+                self.queue.task_done()
+    
+    def flush(self):
+        '''This method waits for the records queued so far to be written.'''
+        
+        if self.writer is not None and self.writer.is_alive():
+            self.queue.join()
+        self.handler.flush()
+    
+    def close(self):
+        if self.writer is not None and self.writer.is_alive():
+            self.queue.put(None)
+            self.writer.join(1.0)
+        self.handler.close()
+        logging.Handler.close(self)
+
+
+class LineRateFilter(logging.Filter):
+    '''This class limits the raw lines logged to `lines` every `per` 
+    seconds. A record may hold several lines, one per line of its message, 
+    each of which is counted. Past the limit only one record in every 
+    `sample` is let through, noting the number of lines left out since the 
+    last; a `sample` of 0 lets none through.
+    
+    A `lines` of 0 turns the limit off.
+    '''
+    
+    def __init__(self, lines=100, per=1.0, sample=100):
+        logging.Filter.__init__(self)
+        self.bucket = TokenBucket(lines, per) if lines else None
+        self.sample = sample
+        self.skipped_records = 0
+        self.skipped_lines = 0
+        self.lock = threading.Lock()
+    
+    def filter(self, record):
+        if self.bucket is None:
+            return True
+        
+        message = record.getMessage() # may be unicode, which str() can't take
+        count = message.count('\n') + 1
+        with self.lock:
+            if not self.bucket.delay(count):
+                self.bucket.consume(count)
+            else:
+                self.skipped_records += 1
+                if not self.sample or self.skipped_records % self.sample:
+                    self.skipped_lines += count
+                    return False
+            skipped, self.skipped_lines = self.skipped_lines, 0
+        
+        if skipped:
+            record.msg = message + '\n({0} lines not logged)'.format(skipped)
+            record.args = None
+        return True
+
+
+def raw_logger(logger):
+    '''This function returns the child of `logger` that the raw lines sent 
+    and received are logged to, at INFO.
+    '''
+    
+    return logger.getChild(RAW)
+
+
 def create_logger():
     logger = logging.getLogger('irctk')
     logger.setLevel(logging.DEBUG)
@@ -26,7 +170,32 @@ def create_logger():
     ch.setFormatter(formatter)
     #fh.setFormatter(formatter)
     
-    logger.addHandler(ch)
+    logger.addHandler(QueueHandler(ch))
     #logger.addHandler(fh)
     
     return logger
+
+
+def configure_logger(logger, config):
+    '''This function applies the logging settings in `config` to `logger`: 
+    `LOG_LEVEL`, the level of `logger` itself, and `RAW_LOG_LEVEL`, that of 
+    its raw line logger, which is limited to `RAW_LOG_LINES` lines every 
+    `RAW_LOG_WINDOW` seconds, and one in `RAW_LOG_SAMPLE` records beyond 
+    that. Levels may be given by name, e.g. 'WARNING', or number.
+    '''
+    
+    logger.setLevel(_level(config.get('LOG_LEVEL', logging.DEBUG)))
+    
+    raw = raw_logger(logger)
+    raw.setLevel(_level(config.get('RAW_LOG_LEVEL', logging.INFO)))
+    for old in [f for f in raw.filters if isinstance(f, LineRateFilter)]:
+        raw.removeFilter(old)
+    raw.addFilter(LineRateFilter(config.get('RAW_LOG_LINES', 100),
+                                 config.get('RAW_LOG_WINDOW', 1.0),
+                                 config.get('RAW_LOG_SAMPLE', 100)))
+
+
+def _level(level):
+    if isinstance(level, basestring):
+        return logging.getLevelName(level.upper())
+    return level
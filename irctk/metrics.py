@@ -0,0 +1,187 @@
+'''
+    irctk.metrics
+    -------------
+    
+    Provides `metrics`, the counters, histograms and gauges kept on the 
+    message pipeline, and `MetricsServer`, which serves them over HTTP.
+'''
+
+import bisect
+import threading
+import BaseHTTPServer
+
+
+# upper bounds of the histogram buckets, in seconds: 50us up to about 7min
+BUCKETS = tuple(0.00005 * 2 ** i for i in range(24))
+
+
+class Histogram(object):
+    '''This class counts observed values, e.g. durations in seconds, in 
+    exponentially sized buckets, from which quantiles are estimated.
+    '''
+    
+    __slots__ = ('counts', 'count', 'total', 'max')
+    
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+    
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+    
+    def quantile(self, q):
+        '''This method returns the upper bound of the bucket holding the 
+        `q`th quantile, e.g. 0.99, of the observed values.
+        '''
+        
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return BUCKETS[i] if i < len(BUCKETS) else self.max
+        return self.max
+
+
+class Metrics(object):
+    '''This class keeps the metrics of the message pipeline. Counters are 
+    increased with `incr`, values such as durations recorded in histograms 
+    with `observe`, and gauges, e.g. queue depths, are functions registered 
+    with `gauge` that are called when the metrics are read.
+    
+    Every count and observation is also passed on to each sink added with 
+    `add_sink`, which makes it possible to forward them elsewhere, e.g. to 
+    statsd. A sink is any object with `incr(name, amount)` and 
+    `observe(name, value)` methods.
+    
+    An instance of this class might be used like this:
+    
+        metrics.incr('irc.lines_in')
+        metrics.observe('irc.parse_time', 0.00002)
+        metrics.gauge('pool.queue', thread_pool.tasks.qsize)
+        print metrics.render()
+    '''
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+        self.sinks = ()
+    
+    def incr(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+        for sink in self.sinks:
+            sink.incr(name, amount)
+    
+    def observe(self, name, value):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(value)
+        for sink in self.sinks:
+            sink.observe(name, value)
+    
+    def gauge(self, name, func):
+        '''This method registers `func`, which takes no arguments, to be 
+        called for the value of the gauge `name` when metrics are read.
+        '''
+        
+        with self.lock:
+            self.gauges[name] = func
+    
+    def add_sink(self, sink):
+        with self.lock:
+            self.sinks = self.sinks + (sink,)
+    
+    def remove_sink(self, sink):
+        with self.lock:
+            self.sinks = tuple(s for s in self.sinks if s is not sink)
+    
+    def reset(self):
+        with self.lock:
+            self.counters = {}
+            self.histograms = {}
+    
+    def snapshot(self):
+        '''This method returns a dict of each metric name to its value. A 
+        histogram `name` is given as `name.count`, `name.sum`, `name.max` 
+        and `name.p50`, `name.p90` and `name.p99`.
+        '''
+        
+        with self.lock:
+            values = dict(self.counters)
+            histograms = self.histograms.items()
+            gauges = self.gauges.items()
+            
+            for name, histogram in histograms:
+                values[name + '.count'] = histogram.count
+                values[name + '.sum'] = histogram.total
+                values[name + '.max'] = histogram.max
+                for q in (50, 90, 99):
+                    values['{0}.p{1}'.format(name, q)] = histogram.quantile(q / 100.0)
+        
+        for name, func in gauges:
+            try:
+                values[name] = func()
+            except Exception:
+                continue
+        return values
+    
+    def render(self):
+        '''This method returns the metrics as text, one `name value` pair 
+        per line, sorted by name.
+        '''
+        
+        lines = []
+        for name, value in sorted(self.snapshot().items()):
+            if isinstance(value, float):
+                value = '{0:.6f}'.format(value)
+            lines.append('{0} {1}'.format(name, value))
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+
+class MetricsServer(threading.Thread):
+    '''This class serves the text from `Metrics.render` of `registry` over 
+    HTTP, on `host` and `port`, from a thread of its own. The bot starts one 
+    when `METRICS_PORT` is set.
+    '''
+    
+    def __init__(self, host='127.0.0.1', port=8000, registry=None):
+        threading.Thread.__init__(self)
+        registry = registry or metrics
+        
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = registry.render()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            
+            def log_message(self, *args):
+                pass
+        
+        self.server = BaseHTTPServer.HTTPServer((host, port), Handler)
+        self.daemon = True
+    
+    def run(self):
+        self.server.serve_forever()
+    
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
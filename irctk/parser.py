@@ -0,0 +1,279 @@
+'''
+    irctk.parser
+    ------------
+    
+    Provides `parse`, which turns a line received from the IRC server into a 
+    `Message`.
+'''
+
+
+TAG_ESCAPES = {':': ';', 's': ' ', 'r': '\r', 'n': '\n', '\\': '\\'}
+
+
+def _unescape_tag(value):
+    '''This function reverses the escaping applied to IRCv3 tag values.'''
+    
+    if '\\' not in value:
+        return value
+    
+    chars = []
+    escaped = False
+    for char in value:
+        if escaped:
+            chars.append(TAG_ESCAPES.get(char, char))
+            escaped = False
+        elif char == '\\':
+            escaped = True
+        else:
+            chars.append(char)
+    return ''.join(chars)
+
+
+def parse_tags(tags):
+    '''This function takes the raw tag section of a line, `tags`, without 
+    the leading `@`, and returns a dict of tag names to values. Tags without 
+    a value are given an empty string.
+    '''
+    
+    parsed = {}
+    for tag in tags.split(';'):
+        if not tag:
+            continue
+        key, _, value = tag.partition('=')
+        parsed[key] = _unescape_tag(value)
+    return parsed
+
+
+class Message(object):
+    '''This class holds a single parsed line. It also serves as the context 
+    of that line, shared by every plugin it is dispatched to, and so is 
+    immutable once created.
+    
+    The `command` and `params` are split out when the line is parsed; the 
+    IRCv3 `tags`, the parts of the prefix, `nick`, `ident` and `host`, and 
+    the legacy `user` and `hostmask` fields are only worked out the first 
+    time they are asked for.
+    
+    `received` is the time the line was received, if known.
+    
+    For compatibility with the context dictionaries used previously, the 
+    fields in `CONTEXT_KEYS` may also be read as items, e.g. 
+    `message['sender']`.
+    '''
+    
+    __slots__ = ('raw', 'prefix', 'command', 'params', 'network', 'received', 
+                 '_raw_tags', '_tags', '_nick', '_ident', '_host', '_user', 
+                 '_hostmask')
+    
+    CONTEXT_KEYS = ('prefix', 'command', 'args', 'sender', 'user', 'hostmask', 
+                    'message', 'network', 'tags')
+    
+    def __new__(cls, raw, prefix, command, params, raw_tags=None, network=None, 
+                received=None):
+        return _message(raw, prefix, command, params, raw_tags, network, 
+                        received)
+    
+    def __setattr__(self, name, value):
+        raise AttributeError('Message objects are immutable')
+    
+    def __delattr__(self, name):
+        raise AttributeError('Message objects are immutable')
+    
+    def __repr__(self):
+        return '<Message {0!r}>'.format(self.raw)
+    
+    def __getitem__(self, key):
+        if key not in self.CONTEXT_KEYS:
+            raise KeyError(key)
+        return getattr(self, key)
+    
+    def __contains__(self, key):
+        return key in self.CONTEXT_KEYS
+    
+    def __iter__(self):
+        return iter(self.CONTEXT_KEYS)
+    
+    def keys(self):
+        return list(self.CONTEXT_KEYS)
+    
+    def get(self, key, default=None):
+        if key not in self.CONTEXT_KEYS:
+            return default
+        return getattr(self, key)
+    
+    @property
+    def args(self):
+        return self.params
+    
+    @property
+    def sender(self):
+        return self.params[0] if self.params else ''
+    
+    @property
+    def message(self):
+        return self.params[-1] if self.params else ''
+    
+    @property
+    def tags(self):
+        try:
+            return self._tags
+        except AttributeError:
+            tags = parse_tags(self._raw_tags) if self._raw_tags else {}
+            _set_tags(self, tags)
+            return tags
+    
+    def _split_prefix(self):
+        nick, _, host = self.prefix.partition('@')
+        nick, _, ident = nick.partition('!')
+        _set_nick(self, nick)
+        _set_ident(self, ident)
+        _set_host(self, host)
+    
+    @property
+    def nick(self):
+        try:
+            return self._nick
+        except AttributeError:
+            self._split_prefix()
+            return self._nick
+    
+    @property
+    def ident(self):
+        try:
+            return self._ident
+        except AttributeError:
+            self._split_prefix()
+            return self._ident
+    
+    @property
+    def host(self):
+        try:
+            return self._host
+        except AttributeError:
+            self._split_prefix()
+            return self._host
+    
+    def _split_hostmask(self):
+        user, found, hostmask = self.prefix.rpartition('!')
+        if not found:
+            user = hostmask = self.prefix
+        _set_user(self, user)
+        _set_hostmask(self, hostmask)
+    
+    @property
+    def user(self):
+        '''The prefix up to its last `!`, i.e. the nick of a user, or the 
+        whole prefix if there is none.'''
+        
+        try:
+            return self._user
+        except AttributeError:
+            self._split_hostmask()
+            return self._user
+    
+    @property
+    def hostmask(self):
+        '''The prefix after its last `!`, i.e. `user@host`, or the whole 
+        prefix if there is none.'''
+        
+        try:
+            return self._hostmask
+        except AttributeError:
+            self._split_hostmask()
+            return self._hostmask
+
+
+class _MutableMessage(Message):
+    '''This class is a `Message` whose slots may still be assigned. Each 
+    message is built as one and then made a `Message`, which is quicker than 
+    writing its slots through their descriptors one call at a time. Both 
+    `__setattr__` and `__delattr__` are restored, as Python only assigns 
+    attributes without calling back into Python code when neither is 
+    overridden.
+    '''
+    
+    __slots__ = ()
+    __setattr__ = object.__setattr__
+    __delattr__ = object.__delattr__
+
+
+_new_message = object.__new__
+
+
+def _message(raw, prefix, command, params, raw_tags, network, received):
+    message = _new_message(_MutableMessage)
+    message.raw = raw
+    message.prefix = prefix
+    message.command = command
+    message.params = params
+    message.network = network
+    message.received = received
+    message._raw_tags = raw_tags
+    message.__class__ = Message
+    return message
+
+
+# The fields worked out later are written through their descriptors, as 
+# `Message` forbids attribute assignment.
+_set_tags = Message._tags.__set__
+_set_nick = Message._nick.__set__
+_set_ident = Message._ident.__set__
+_set_host = Message._host.__set__
+_set_user = Message._user.__set__
+_set_hostmask = Message._hostmask.__set__
+
+
+def parse(line, network=None, raw=None, received=None):
+    '''This function takes a line as received from the IRC server, `line`, 
+    without its line ending, and returns a `Message`. The name of the 
+    network the line came from may be given as `network`. If `line` has 
+    been decoded, the bytes it was decoded from may be given as `raw`, to be 
+    kept as the message's `raw`, and the time it was received as 
+    `received`.
+    
+    A line is made up of optional IRCv3 tags, starting with `@`, an optional 
+    prefix, starting with `:`, the command and then its parameters, the last 
+    of which may contain spaces if it starts with `:`.
+    '''
+    
+    if not line:
+        raise Exception('Received an empty line from the server.')
+    
+    if raw is None:
+        raw = line
+    raw_tags = None
+    prefix = ''
+    
+    if line[0] == '@':
+        raw_tags, _, line = line.partition(' ')
+        raw_tags = raw_tags[1:]
+        line = line.lstrip(' ')
+    
+    if line[:1] == ':':
+        prefix, _, line = line.partition(' ')
+        prefix = prefix[1:]
+    
+    head, trailing_found, trailing = line.partition(' :')
+    command, _, head = head.partition(' ')
+    if not command:
+        command, _, head = head.lstrip(' ').partition(' ')
+    if not command:
+        raise Exception('Received a malformed line from the server.')
+    
+    params = head.split(' ') if head else []
+    if '' in params:
+        params = [param for param in params if param]
+    if trailing_found:
+        params.append(trailing)
+    
+    # as `_message`, written out as this runs for every line
+    message = _new_message(_MutableMessage)
+    message.raw = raw
+    message.prefix = prefix
+    message.command = command
+    message.params = tuple(params)
+    message.network = network
+    message.received = received
+    message._raw_tags = raw_tags
+    message.__class__ = Message
+    return message
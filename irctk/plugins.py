@@ -6,22 +6,146 @@
 '''
 
 import inspect
+import threading
+import time
 
-from .threadpool import ThreadPool
+from .threadpool import ThreadPool, Future
+from .admission import AdmissionControl
+from .cache import ResultCache
+from .metrics import metrics
+
+
+PLUGIN_LISTS = ('PLUGINS', 'EVENTS')
 
 
 class Context(object):
+    __slots__ = ('line', 'args')
+    
     def __init__(self, line, args):
         self.line = line
         self.args = args
 
 
+class Invocation(object):
+    '''This class is a plugin dictionary, `plugin`, compiled into the form 
+    it is called in. The calling convention of each of its functions and its 
+    reply options are worked out once, when the plugin is registered, rather 
+    than every time it is called.
+    
+    The original dictionary remains available through item access, e.g. 
+    `invocation['hook']`.
+    '''
+    
+    __slots__ = ('plugin', 'hook', 'funcs', 'action', 'notice', 'timeout', 
+                 'cache')
+    
+    def __init__(self, plugin, cache_size=128):
+        self.plugin = plugin
+        self.hook = plugin['hook']
+        self.funcs = tuple((func, _takes_args(func)) for func in plugin['funcs'])
+        self.action = plugin.get('action') == True
+        self.notice = plugin.get('notice') == True
+        self.timeout = plugin.get('timeout')
+        
+        self.cache = None
+        if plugin.get('cache'):
+            size = plugin.get('cache_size', cache_size)
+            self.cache = ResultCache(size, plugin['cache'])
+    
+    def __repr__(self):
+        return '<Invocation {0!r}>'.format(self.hook)
+    
+    def __getitem__(self, key):
+        return self.plugin[key]
+    
+    def get(self, key, default=None):
+        return self.plugin.get(key, default)
+
+
+def _takes_args(func):
+    '''This function returns whether `func` takes arguments, or None if that 
+    can not be told until it is called.
+    '''
+    
+    try:
+        return bool(inspect.getargspec(func).args)
+    except TypeError:
+        return None
+
+
 class PluginHandler(object):
-    def __init__(self, config, logger, reply_method):
+    def __init__(self, config, logger, reply_method, support=None):
         self.config = config
         self.logger = logger
-        self.thread_pool = ThreadPool(self.config['MIN_WORKERS'], logger=self.logger)
+        self.thread_pool = ThreadPool(self.config['MIN_WORKERS'],
+                                      self.config.get('MAX_WORKERS'),
+                                      logger=self.logger)
+        self.admission = AdmissionControl(self.config, self.logger, support)
+        
+        pool = self.thread_pool
+        metrics.gauge('pool.workers', lambda: pool.workers)
+        metrics.gauge('pool.idle', lambda: pool.idle)
+        metrics.gauge('pool.queue', pool.tasks.qsize)
         self._reply = reply_method
+        
+        self.lock = threading.RLock() # serialises changes to the plugins
+        self.staged = None
+        self.hooks = {'PLUGINS': {}, 'EVENTS': {}}
+        self.index_plugins()
+    
+    def index_plugins(self):
+        '''This method rebuilds the dispatch index, `self.hooks`, from the 
+        `PLUGINS` and `EVENTS` lists in the configuration dict. The index maps 
+        each hook to its plugin dictionary, compiled into an `Invocation`, so 
+        that dispatching a line is a single lookup rather than a scan of every 
+        registered plugin.
+        
+        A new index is built and then bound in one step, so a dispatching 
+        thread sees either the old or the new index, never a partial one. 
+        
+        Plugin dictionaries are replaced rather than changed in place, so one 
+        that is still the same object is unchanged and keeps its compiled 
+        `Invocation`, along with its cached results. Only new or changed 
+        plugins are compiled.
+        '''
+        
+        cache_size = self.config.get('CACHE_SIZE', 128)
+        hooks = {}
+        for plugin_list in PLUGIN_LISTS:
+            compiled = self.hooks.get(plugin_list, {})
+            index = {}
+            for plugin in self.config.get(plugin_list) or []:
+                invocation = compiled.get(plugin['hook'])
+                if invocation is None or invocation.plugin is not plugin:
+                    invocation = Invocation(plugin, cache_size)
+                index[plugin['hook']] = invocation
+            hooks[plugin_list] = index
+        self.hooks = hooks
+    
+    def _plugin_list(self, plugin_list):
+        '''This internal method returns the current list of plugins for 
+        `plugin_list`, i.e. the staged list during a reload.
+        '''
+        
+        if self.staged is not None:
+            return self.staged[plugin_list]
+        return self.config.get(plugin_list) or []
+    
+    def _swap_plugin_list(self, plugin_list, plugins):
+        '''This internal method replaces the list of plugins for 
+        `plugin_list` with `plugins` and rebuilds the index. During a reload 
+        the staged list is replaced instead, and nothing is published until 
+        the reload is complete.
+        
+        Published lists are never changed in place, so a thread reading one 
+        needs no lock. Must be called with `self.lock` held.
+        '''
+        
+        if self.staged is not None:
+            self.staged[plugin_list] = plugins
+        else:
+            self.config[plugin_list] = plugins
+            self.index_plugins()
     
     def add_plugin(self, hook, func, command=True, event=False):
         '''TODO'''
@@ -50,143 +174,210 @@ class PluginHandler(object):
         if command:
             plugin_list = 'PLUGINS'
         
-        plugin_list = self.config[plugin_list]
-        
-        hook_found = lambda : hook == existing_plugin['hook']
-        func_found = lambda : func in existing_plugin['funcs']
-        
-        for existing_plugin in plugin_list:
-            if hook_found() and func_found():
-                existing_plugin['funcs'].remove(func)
-                
-                if not existing_plugin['funcs']:
-                    plugin_list.remove(existing_plugin)
+        with self.lock:
+            plugins = []
+            for existing_plugin in self._plugin_list(plugin_list):
+                if hook == existing_plugin['hook'] and \
+                        func in existing_plugin['funcs']:
+                    funcs = list(existing_plugin['funcs'])
+                    funcs.remove(func)
+                    if not funcs:
+                        continue
+                    existing_plugin = dict(existing_plugin, funcs=funcs)
+                plugins.append(existing_plugin)
+            
+            self._swap_plugin_list(plugin_list, plugins)
     
     def update_plugins(self, plugin, plugin_list):
         '''This internal method updates a given list containing plugins, 
         `plugin_list`, with a plugin dictionary object, `plugin`.
         
         Usually used to update the `PLUGINS` or `EVENTS` list in the 
-        configuration dict.
+        configuration dict. The list is copied, updated and then swapped in, 
+        never changed in place.
         '''
         
-        if not self.config.get(plugin_list):
-            self.config[plugin_list] = []
+        with self.lock:
+            plugins = []
+            found = False
+            for existing_plugin in self._plugin_list(plugin_list):
+                if plugin['hook'] == existing_plugin['hook']:
+                    funcs = existing_plugin['funcs'] + plugin['funcs']
+                    existing_plugin = dict(existing_plugin, funcs=funcs)
+                    found = True
+                plugins.append(existing_plugin)
+            
+            if not found:
+                plugins.append(plugin)
+            
+            self._swap_plugin_list(plugin_list, plugins)
+    
+    def dispatch(self, context, prefix='.'):
+        '''This method takes a line's context, `context`, a `Message`, and 
+        looks up the plugins bound to it in `self.hooks`. The same context is 
+        shared by every plugin it is dispatched to.
+        
+        If the message begins with `prefix` its first word, less the prefix, 
+        is looked up as a command hook; the remainder of the message is passed 
+        along as the plugin's arguments. If the IRC command is upper case it 
+        is looked up as an event hook.
+        '''
         
-        plugin_list = self.config[plugin_list]
+        hooks = self.hooks
+        message = context.message
+        command = context.command
         
-        for i, existing_plugin in enumerate(plugin_list):
-            if plugin['hook'] == existing_plugin['hook']:
-                plugin_list[i]['funcs'] += plugin['funcs']
+        if message.startswith(prefix):
+            parts = message[len(prefix):].split(' ', 1)
+            plugin = hooks['PLUGINS'].get(parts[0])
+            if plugin is not None:
+                plugin_args = parts[-1].strip() if len(parts) > 1 else ''
+                self.enqueue_plugin(plugin, context, plugin_args, True)
         
-        def iter_list_hooks():
-            for existing_plugin in plugin_list:
-                yield existing_plugin['hook']
+        if command and command.isupper():
+            event = hooks['EVENTS'].get(command)
+            if event is not None:
+                plugin_args = message.split(command, 1)[-1].strip()
+                self.enqueue_plugin(event, context, plugin_args, False)
+    
+    def enqueue_plugin(self, plugin, context, plugin_args, command=True):
+        '''This method takes a plugin, context, and the arguments the plugin 
+        was called with, as `plugin`, `context`, and `plugin_args`. A 
+        `Context` object is created from these and the plugin is enqueued in 
+        the thread pool.
         
-        if not plugin['hook'] in iter_list_hooks():
-            plugin_list.append(plugin)
+        The call must first pass `self.admission`; `command` is False when 
+        the plugin is an event. If the call is refused None is returned.
         
-        #for i, existing_plugin in enumerate(self.config[plugin_list]):
-        #    if existing_plugin['func'].__name__ == plugin['func'].__name__:
-        #        self.config[plugin_list][i] = plugin
+        The plugin may be given a `timeout`, in seconds, with the decorator 
+        that registered it, otherwise `PLUGIN_TIMEOUT` applies. A `Future` 
+        for the plugin's run is returned.
         
-        #if not plugin in self.config[plugin_list]:
-        #self.config[plugin_list].append(plugin)
-    
-    def enqueue_plugin(self, plugin, hook, context):
-        '''This method takes a plugin, hook, and context, as 
-        `plugin`, `hook`, and `context`. Checking to see if the context is 
-        equivalent to the hook or begins with the hook plus a space, in the 
-        second case, indicating a plugin passed with arguments. If such 
-        conditions are met the plugin is enqueued in the thread pool.
+        If the plugin caches its results and has already been called with 
+        the same arguments, the cached replies are sent straight away 
+        instead.
         '''
         
-        if context == hook or context.startswith(hook + ' '):
-            plugin_args = plugin['context']['message'].split(hook, 1)[-1].strip()
-            plugin_context = Context(plugin['context'], plugin_args)
-            
-            task = (self.dequeue_plugin, plugin, plugin_context)
-            self.thread_pool.enqueue_task(*task)
-            #self._dequeue_plugin(plugin, plugin_context)
-    
-    def dequeue_plugin(self, plugin, plugin_context):
-        '''This method assumes that a plugin and plugin context are 
-        passed to it as `plugin` and `plugin_context`. It is intended to be 
-        called as a plugin is being dequeued, i.e. from a thread pool as 
-        called by a worker thread thereof. 
+        if not self.admission.admit(plugin, context, command):
+            return None
         
-        The plugin and plugin context are checked against several conditions 
-        that will ultimately affect the formatting of the final message.
+        cache = plugin.cache
+        if cache is not None:
+            hit, replies = cache.get(plugin_args)
+            if hit:
+                future = Future()
+                future.set_running()
+                for message in replies:
+                    self._reply(message, context, plugin.action, plugin.notice)
+                future.set_result(None)
+                self.admission.track(plugin, future)
+                return future
         
-        if the plugin function does return a message, that message is 
-        formatted and sent back to the server via `cls.reply`.
-        '''
+        plugin_context = Context(context, plugin_args)
         
-        for func in plugin['funcs']:
-            takes_args = inspect.getargspec(func).args
-            
-            action = False
-            if plugin.get('action') == True:
-                action = True
-            
-            notice = False
-            if plugin.get('notice') == True:
-                notice = True
-            
-            if takes_args:
-                message = func(plugin_context)
-            else:
-                message = func()
-            
-            if message:
-                self._reply(message, plugin_context.line, action, notice)
+        timeout = plugin.timeout
+        if timeout is None:
+            timeout = self.config.get('PLUGIN_TIMEOUT')
+        args = (plugin, plugin_context)
+        future = self.thread_pool.submit(self.dequeue_plugin, args,
+                                         timeout=timeout)
+        self.admission.track(plugin, future)
+        return future
     
-    def filter_plugin_lists(self, plugin_lists, filename):
-        '''TODO'''
+    def dequeue_plugin(self, plugin, plugin_context):
+        '''This method assumes that a plugin, an `Invocation`, and plugin 
+        context are passed to it as `plugin` and `plugin_context`. It is 
+        intended to be called as a plugin is being dequeued, i.e. from a 
+        thread pool as called by a worker thread thereof.
         
-        filtered_lists = []
-        for plugin_list in plugin_lists:
-            filtered_list = self._filter_plugin_list(plugin_list, filename)
-            filtered_lists.append(filtered_list)
-        return filtered_lists
-    
-    def _filter_plugin_list(self, plugin_list, filename):
-        '''TODO'''
+        Each of the plugin's functions is called with the plugin context if 
+        it takes arguments, or without any otherwise.
         
+        if the plugin function does return a message, that message is 
+        formatted and sent back to the server via `cls.reply`, as an action 
+        or notice if the plugin asked for one. The replies of a plugin that 
+        caches its results are stored once all of its functions have 
+        returned.
         
-        def func_is_in_file(func, filename): 
-            return inspect.getabsfile(func) == filename
+        The time taken is recorded in the `plugin.<hook>.time` metric, and 
+        exceptions raised are counted in `plugin.<hook>.errors`.
+        '''
         
-        filtered_plugins = {}
-        for i, plugin in enumerate(plugin_list):
-            
-            hook = plugin['hook']
-            funcs = plugin['funcs']
-            for x, func in enumerate(funcs):
+        line = plugin_context.line
+        action = plugin.action
+        notice = plugin.notice
+        
+        start = time.time()
+        replies = []
+        try:
+            for func, takes_args in plugin.funcs:
+                if takes_args is None: # not introspectable, fail as before
+                    takes_args = inspect.getargspec(func).args
                 
-                if func_is_in_file(func, filename):
-                    if not hook in filtered_plugins:
-                        filtered_plugins[hook] = []
-                    filtered_plugins[hook].append(funcs.pop(x))
-            
-            if not funcs: # no functions, so delete the hook
-                del plugin_list[i]
+                if takes_args:
+                    message = func(plugin_context)
+                else:
+                    message = func()
+                
+                if message:
+                    replies.append(message)
+                    self._reply(message, line, action, notice)
+        except Exception:
+            metrics.incr('plugin.{0}.errors'.format(plugin.hook))
+            raise
+        finally:
+            metrics.observe('plugin.{0}.time'.format(plugin.hook),
+                            time.time() - start)
         
-        return filtered_plugins
+        if plugin.cache is not None:
+            plugin.cache.set(plugin_context.args, replies)
     
-    def restore_plugin_lists(self, plugin_lists, filtered_lists):
-        '''TODO'''
+    def filter_plugin_lists(self, filename):
+        '''This method returns a dict of copies of the `PLUGINS` and 
+        `EVENTS` lists with the functions defined in `filename` left out. 
+        Plugins left without any functions are dropped.
+        '''
         
-        for plugin_list in plugin_lists:
-            plugin_list = [] # reset the list
-            for filtered_list in filtered_lists:
-                self._restore_plugin_list(plugin_list, filtered_list)
+        def func_is_in_file(func):
+            try:
+                return inspect.getabsfile(func) == filename
+            except TypeError:
+                return False
         
-    def _restore_plugin_list(self, plugin_list, filtered_list):
-        '''TODO'''
+        filtered_lists = {}
+        for plugin_list in PLUGIN_LISTS:
+            plugins = []
+            for plugin in self._plugin_list(plugin_list):
+                funcs = [func for func in plugin['funcs']
+                         if not func_is_in_file(func)]
+                if len(funcs) != len(plugin['funcs']):
+                    if not funcs:
+                        continue
+                    plugin = dict(plugin, funcs=funcs)
+                plugins.append(plugin)
+            filtered_lists[plugin_list] = plugins
+        return filtered_lists
+    
+    def reload_plugins(self, filename, load):
+        '''This method reloads the plugins defined in `filename` by calling 
+        `load`, which is expected to execute the file again and so register 
+        its plugins anew.
+        
+        The plugin lists are staged without the file's functions while `load` 
+        runs, the plugins it registers are added to the staged lists, and the 
+        result is swapped in once `load` returns. Should `load` raise, the 
+        staged lists are thrown away and the plugins in use are left as they 
+        were. Either way dispatching threads only ever see complete lists.
+        '''
         
-        for plugin in plugin_list:
-            for hook, funcs in filtered_list.items():
-                if hook not in plugin_list:
-                    plugin[hook] = []
-                plugin[hook].extend(funcs)
+        with self.lock:
+            self.staged = self.filter_plugin_lists(filename)
+            try:
+                load()
+                staged = self.staged
+            finally:
+                self.staged = None
+            
+            for plugin_list, plugins in staged.items():
+                self.config[plugin_list] = plugins
+            self.index_plugins()
@@ -0,0 +1,246 @@
+'''
+    irctk.ratelimit
+    ---------------
+    
+    Provides two classes, `TokenBucket` and `SendScheduler`, used to keep 
+    outgoing traffic within the server's flood limits.
+'''
+
+
+import collections
+import threading
+import time
+
+from .metrics import metrics
+
+
+PRIORITY_COMMANDS = frozenset(['PONG', 'QUIT'])
+
+
+class TokenBucket(object):
+    '''This class implements a token bucket. It holds at most `burst` tokens, 
+    which defaults to `rate`, and is refilled at `rate` tokens every `per` 
+    seconds.
+    
+    Tokens are taken with `consume`. The bucket may be taken into debt, in 
+    which case later callers wait for it to refill; `delay` reports how long 
+    that wait is.
+    '''
+    
+    def __init__(self, rate, per, burst=None):
+        self.capacity = float(burst if burst is not None else rate)
+        self.tokens = self.capacity
+        self.fill_rate = rate / float(per)
+        self.timestamp = time.time()
+    
+    def _refill(self, now):
+        if now <= self.timestamp:
+            return
+        elapsed = now - self.timestamp
+        self.timestamp = now
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.fill_rate)
+    
+    def delay(self, amount=1, now=None):
+        '''This method returns the number of seconds until `amount` tokens 
+        are available. Amounts larger than the bucket are treated as a full 
+        bucket, so they are delayed rather than refused.
+        '''
+        
+        self._refill(now or time.time())
+        needed = min(amount, self.capacity) - self.tokens
+        if needed <= 0:
+            return 0.0
+        return needed / self.fill_rate
+    
+    def consume(self, amount=1, now=None):
+        '''This method takes `amount` tokens from the bucket, regardless of 
+        whether enough are available.
+        '''
+        
+        self._refill(now or time.time())
+        self.tokens -= amount
+
+
+class SendScheduler(object):
+    '''This class schedules lines to be sent to the server. At most `lines` 
+    lines and `bytes` bytes are released every `per` seconds; either limit 
+    may be disabled by setting it to 0.
+    
+    Lines are queued by their target, i.e. the recipient of a PRIVMSG or 
+    NOTICE, and targets are served round-robin so one busy channel can not 
+    starve replies to others. Targets are folded with `fold`, if set, which 
+    should follow the server's case mapping. Lines for the commands in 
+    `PRIORITY_COMMANDS` skip the queue altogether and are released 
+    immediately, though they are still counted against the limits. The time 
+    each line spends queued is recorded in the `send.wait` metric.
+    
+    While the connection is down the queue may be held with `hold`, after 
+    which only priority lines are released, until `release` is called.
+    
+    An instance of this class might look like this:
+    
+        scheduler = SendScheduler(lines=5, bytes=1024, per=10.0)
+        scheduler.put('PRIVMSG #voxinfinitus :hello')
+        
+        # blocks until the line may be sent
+        line = scheduler.get()
+    '''
+    
+    def __init__(self, lines=10, bytes=2560, per=10.0):
+        self.line_bucket = TokenBucket(lines, per) if lines else None
+        self.byte_bucket = TokenBucket(bytes, per) if bytes else None
+        self.priority = collections.deque()
+        self.queues = {}
+        self.targets = collections.deque()
+        self.condition = threading.Condition()
+        self.held = False
+        self.fold = None
+    
+    def __len__(self):
+        with self.condition:
+            return len(self.priority) + sum(map(len, self.queues.values()))
+    
+    def _classify(self, line):
+        '''This internal method returns the command of `line` and its target, 
+        if it is a PRIVMSG or NOTICE.
+        '''
+        
+        parts = line.split(' ', 3)
+        if parts[0].startswith(':'):
+            parts.pop(0)
+        
+        command = parts[0].upper()
+        target = None
+        if command in ('PRIVMSG', 'NOTICE') and len(parts) > 1:
+            target = parts[1]
+        return command, target
+    
+    def _fold(self, target):
+        if target is None or self.fold is None:
+            return target
+        return self.fold(target)
+    
+    def _size(self, line):
+        if isinstance(line, unicode):
+            line = line.encode('utf-8', 'replace')
+        return len(line) + 2 # \r\n
+    
+    def _wait_time(self, line, now):
+        wait = 0.0
+        if self.line_bucket:
+            wait = self.line_bucket.delay(1, now)
+        if self.byte_bucket:
+            wait = max(wait, self.byte_bucket.delay(self._size(line), now))
+        return wait
+    
+    def _consume(self, line):
+        now = time.time()
+        if self.line_bucket:
+            self.line_bucket.consume(1, now)
+        if self.byte_bucket:
+            self.byte_bucket.consume(self._size(line), now)
+    
+    def _pop(self):
+        '''This internal method removes the next line from the target at the 
+        head of the rotation, moving that target to the back.
+        '''
+        
+        target = self.targets.popleft()
+        queue = self.queues[target]
+        line, queued = queue.popleft()
+        if queue:
+            self.targets.append(target)
+        else:
+            del self.queues[target]
+        return line, queued
+    
+    def put(self, line, target=None, priority=None):
+        '''This method queues `line` to be sent. Unless given, `target` and 
+        `priority` are worked out from the line itself.
+        '''
+        
+        command, line_target = self._classify(line)
+        if target is None:
+            target = line_target
+        target = self._fold(target)
+        if priority is None:
+            priority = command in PRIORITY_COMMANDS
+        
+        entry = (line, time.time())
+        with self.condition:
+            if priority:
+                self.priority.append(entry)
+            else:
+                queue = self.queues.get(target)
+                if queue is None:
+                    queue = self.queues[target] = collections.deque()
+                    self.targets.append(target)
+                queue.append(entry)
+            self.condition.notify()
+    
+    def requeue(self, lines):
+        '''This method puts `lines`, taken from the queue but never sent, 
+        back at the front of their targets' queues, in order.
+        '''
+        
+        now = time.time()
+        with self.condition:
+            for line in reversed(lines):
+                target = self._fold(self._classify(line)[1])
+                queue = self.queues.get(target)
+                if queue is None:
+                    queue = self.queues[target] = collections.deque()
+                    self.targets.appendleft(target)
+                queue.appendleft((line, now))
+            self.condition.notify()
+    
+    def hold(self):
+        with self.condition:
+            self.held = True
+    
+    def release(self):
+        with self.condition:
+            self.held = False
+            self.condition.notify_all()
+    
+    def delay(self):
+        '''This method returns the number of seconds until the next line may 
+        be sent, or None if there are no lines queued or the queue is held.
+        '''
+        
+        with self.condition:
+            if self.priority:
+                return 0.0
+            if not self.targets or self.held:
+                return None
+            line = self.queues[self.targets[0]][0][0]
+            return self._wait_time(line, time.time())
+    
+    def get(self, block=True):
+        '''This method returns the next line that may be sent. If `block` is 
+        True it waits until one is available, otherwise None is returned when 
+        there is no line ready.
+        '''
+        
+        with self.condition:
+            while True:
+                if self.priority:
+                    line, queued = self.priority.popleft()
+                    self._consume(line)
+                    metrics.observe('send.wait', time.time() - queued)
+                    return line
+                
+                wait = None
+                if self.targets and not self.held:
+                    line = self.queues[self.targets[0]][0][0]
+                    now = time.time()
+                    wait = self._wait_time(line, now)
+                    if wait <= 0:
+                        line, queued = self._pop()
+                        self._consume(line)
+                        metrics.observe('send.wait', now - queued)
+                        return line
+                
+                if not block:
+                    return None
+                self.condition.wait(wait)
@@ -0,0 +1,156 @@
+'''
+    irctk.reconnect
+    ---------------
+    
+    Provides `ReconnectManager`, the state machine both clients use to get 
+    back online after losing their connection, along with `Backoff`, which 
+    spaces out its attempts, and `call_later`, a timer for threaded clients.
+'''
+
+import random
+import socket
+import threading
+
+from .metrics import metrics
+
+
+def call_later(delay, func, *args):
+    '''This function calls `func` with `args` from a thread of its own in 
+    `delay`-number of seconds. It is the threaded counterpart to 
+    `EventLoop.call_later`.
+    '''
+    
+    timer = threading.Timer(delay, func, args)
+    timer.daemon = True
+    timer.start()
+    return timer
+
+
+class Backoff(object):
+    '''This class works out how long to wait before each attempt in a series 
+    of retries. The wait doubles with each attempt from `minimum` seconds up 
+    to `maximum`, and is then spread randomly over its upper half, so that 
+    many clients dropped at once do not all come back at once.
+    
+    An instance of this class might look like this:
+    
+        backoff = Backoff(2.0, 300.0)
+        backoff.next()   # between 1 and 2 seconds
+        backoff.next()   # between 2 and 4 seconds
+        backoff.reset()  # once an attempt has succeeded
+    '''
+    
+    def __init__(self, minimum=2.0, maximum=300.0, factor=2.0, random=random.random):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.factor = factor
+        self.random = random
+        self.attempts = 0
+    
+    def next(self):
+        delay = min(self.maximum, self.minimum * self.factor ** self.attempts)
+        if delay < self.maximum:
+            self.attempts += 1
+        return delay / 2.0 + delay / 2.0 * self.random()
+    
+    def reset(self):
+        self.attempts = 0
+
+
+class ReconnectManager(object):
+    '''This class decides when and where a client reconnects to. The client 
+    calls `lost` whenever its connection drops, or an attempt fails, and 
+    `connected` once an attempt succeeds; the IRC wrapper calls `registered` 
+    once the server has welcomed us again, and `close` stops any further 
+    attempts.
+    
+    Attempts are made with `attempt(host, port, ssl)`, scheduled with 
+    `call_later(delay, func)`, and spaced out by `backoff`. The first attempt 
+    after a session is lost goes back to the same server; after each failed 
+    attempt the next of `servers`, a list of `(host, port, ssl)` tuples, is 
+    tried. The backoff only starts over once we have registered, so a server 
+    that accepts connections only to drop them is not hammered.
+    '''
+    
+    CONNECTED, WAITING, CONNECTING, CLOSED = range(4)
+    
+    def __init__(self, attempt, servers, call_later=call_later, backoff=None,
+                 logger=None):
+        self.attempt = attempt
+        self.servers = list(servers)
+        self.call_later = call_later
+        self.backoff = backoff or Backoff()
+        self.logger = logger
+        self.index = 0
+        self.state = self.CONNECTED
+        self.lock = threading.Lock()
+    
+    @property
+    def server(self):
+        return self.servers[self.index]
+    
+    def lost(self, delay=None):
+        '''This method schedules the next attempt, in `delay` seconds if 
+        given or as the backoff says otherwise, unless one is already 
+        waiting or the manager is closed.
+        '''
+        
+        with self.lock:
+            if self.state in (self.WAITING, self.CLOSED):
+                return
+            if self.state == self.CONNECTING:
+                self.index = (self.index + 1) % len(self.servers)
+            self.state = self.WAITING
+            if delay is None:
+                delay = self.backoff.next()
+        
+        if self.logger:
+            self.logger.error('Connection lost, reconnecting to {0}:{1} in '
+                              '{2:.1f}s.'.format(self.server[0], self.server[1],
+                                                 delay))
+        self.call_later(delay, self._attempt)
+    
+    def _attempt(self):
+        with self.lock:
+            if self.state != self.WAITING:
+                return
+            self.state = self.CONNECTING
+            host, port, ssl = self.server
+        
+        metrics.incr('irc.reconnects')
+        try:
+            self.attempt(host, port, ssl)
+        except (socket.error, IOError), e:
+            self.failed(e)
+    
+    def failed(self, error):
+        '''This method is called when an attempt, or the client's first 
+        connection, fails with `error`. The next attempt is scheduled for the 
+        next of `servers`.
+        '''
+        
+        with self.lock:
+            if self.state != self.CLOSED:
+                self.state = self.CONNECTING
+        
+        if self.logger:
+            self.logger.error('Connect failed: {0}'.format(error))
+        self.lost()
+    
+    def connected(self):
+        with self.lock:
+            if self.state != self.CLOSED:
+                self.state = self.CONNECTED
+    
+    def registered(self):
+        self.backoff.reset()
+    
+    def open(self):
+        '''This method allows attempts again after `close`.'''
+        
+        with self.lock:
+            self.state = self.CONNECTED
+    
+    def close(self):
+        with self.lock:
+            self.state = self.CLOSED
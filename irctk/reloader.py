@@ -7,101 +7,251 @@
 
 
 import os
-import sys
 import time
 import threading
 import imp
+import inspect
+import select
+import struct
+import ctypes
+import ctypes.util
 
+from .plugins import PLUGIN_LISTS
 
-class ReloadHandler(threading.Thread):
-    def __init__(self, plugin_lists, plugin_handler, logger):
-        threading.Thread.__init__(self)
-        self.plugin_lists = plugin_lists
-        self.plugin = plugin_handler
-        self.logger = logger
-        self.daemon = True
-        self.start()
+
+class StatWatcher(object):
+    '''This class watches the Python files in a set of directories for 
+    changes by calling `os.stat` on each of them every `wait` seconds. It is 
+    used where inotify is not available.
+    
+    Only the directories given to `watch` are scanned, and files added to 
+    them later are noticed too.
+    '''
     
-    def _reloader_loop(self, wait=1.0):
-        '''This reloader is based off of the Flask reloader which in turn is 
-        based off of the CherryPy reloader.
+    def __init__(self, wait=1.0, debounce=0.2):
+        self.wait = wait
+        self.debounce = debounce
+        self.directories = set()
+        self.mtimes = {}
+    
+    def watch(self, directory):
+        if directory in self.directories:
+            return
+        self._scan([directory]) # the files already there are not changes
+        self.directories.add(directory)
+    
+    def _scan(self, directories):
+        '''This internal method stats the Python files in `directories` and 
+        returns the set of those that are new or changed since the last scan.
+        '''
         
-        This internal method takes on parameter, `wait`, the wait time given 
-        in seconds. The default value is set to one second.
+        changed = set()
+        for directory in directories:
+            try:
+                names = os.listdir(directory)
+            except OSError:
+                continue
+            
+            for name in names:
+                if not _is_source(name):
+                    continue
+                filename = os.path.join(directory, name)
+                try:
+                    mtime = os.stat(filename).st_mtime
+                except OSError:
+                    continue
+                
+                old_time = self.mtimes.get(filename)
+                self.mtimes[filename] = mtime
+                if old_time is None and directory not in self.directories:
+                    continue
+                if old_time is None or mtime > old_time:
+                    changed.add(filename)
+        return changed
+    
+    def poll(self, timeout=None):
+        '''This method returns the set of files changed within `timeout` 
+        seconds, waiting for one if `timeout` is None.
         '''
         
-        def iter_module_files():
-            for module in sys.modules.values():
-                filename = getattr(module, '__file__', None)
-                if filename:
-                    old = None
-                    while not os.path.isfile(filename):
-                        old = filename
-                        filename = os.path.dirname(filename)
-                        if filename == old:
-                            break
-                    else:
-                        if filename[-4:] in ('.pyc', '.pyo'):
-                            filename = filename[:-1]
-                        yield filename
+        start = time.time()
+        while True:
+            changed = self._scan(list(self.directories))
+            if changed:
+                return changed
+            if timeout is not None and time.time() - start >= timeout:
+                return changed
+            time.sleep(self.wait if timeout is None else min(self.wait, timeout))
+    
+    def changes(self):
+        '''This method waits for files to change and returns the set of 
+        them. Changes that follow each other within `debounce` seconds, such 
+        as an editor writing a file in several steps, are returned together.
+        '''
         
-        fnames = []
-        fnames.extend(iter_module_files())
-        self._reloader(fnames, wait=wait)
+        changed = self.poll()
+        while True:
+            more = self.poll(self.debounce)
+            if not more:
+                return changed
+            changed |= more
+
+
+class InotifyWatcher(StatWatcher):
+    '''This class watches the Python files in a set of directories for 
+    changes using Linux's inotify, through `ctypes`. One watch is added per 
+    directory, so files added to it later are noticed too, and nothing is 
+    done until the kernel reports a change.
     
-    def _reloader(self, fnames, wait):
-        '''This reloader is based off of the Flask reloader which in turn is 
-        based off of the CherryPy reloader.
+    Raises OSError if inotify is not available.
+    '''
+    
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CLOEXEC = 0x00080000
+    EVENT = struct.Struct('iIII')
+    
+    def __init__(self, wait=1.0, debounce=0.2):
+        StatWatcher.__init__(self, wait, debounce)
         
-        This internal method takes two paramters, `fnames` and `wait.` Here 
-        we loop over a list of file names, `fnames`, using `os.stat` to 
-        determine if the mtime of the file has been changed. If so we use 
-        `imp.load_source` to reload the module.
+        libc = _load_libc()
+        if libc is None or not hasattr(libc, 'inotify_init1'):
+            raise OSError('inotify is not available')
+        self.libc = libc
         
-        The `fnames` parameter should be a list of files names to be parsed by 
-        the reloader.
+        self.fd = libc.inotify_init1(self.IN_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        self.wds = {}
+    
+    def watch(self, directory):
+        if directory in self.directories:
+            return
         
-        A callback function, `callback` may be provided as a function to be 
-        called when the file is reloaded.
+        mask = self.IN_CLOSE_WRITE | self.IN_MOVED_TO
+        wd = self.libc.inotify_add_watch(self.fd, directory, mask)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), directory)
+        self.wds[wd] = directory
+        self.directories.add(directory)
+    
+    def poll(self, timeout=None):
+        readable = select.select([self.fd], [], [], timeout)[0]
+        if not readable:
+            return set()
         
-        The `wait` parameter specifies the time in seconds to run 
-        `time.sleep()`.
-        ''' 
+        data = os.read(self.fd, 65536)
+        changed = set()
+        offset = 0
+        while offset + self.EVENT.size <= len(data):
+            wd, mask, cookie, length = self.EVENT.unpack_from(data, offset)
+            offset += self.EVENT.size
+            name = data[offset:offset + length].rstrip('\0')
+            offset += length
+            
+            directory = self.wds.get(wd)
+            if directory and _is_source(name):
+                changed.add(os.path.join(directory, name))
+        return changed
+    
+    def close(self):
+        os.close(self.fd)
+
+
+def _load_libc():
+    name = ctypes.util.find_library('c')
+    if not name:
+        return None
+    try:
+        return ctypes.CDLL(name, use_errno=True)
+    except OSError:
+        return None
+
+
+def _is_source(name):
+    return name.endswith('.py') and not name.startswith('.')
+
+
+def create_watcher(wait=1.0, debounce=0.2):
+    '''This function returns an `InotifyWatcher` where inotify is available 
+    and a `StatWatcher` otherwise.
+    '''
+    
+    try:
+        return InotifyWatcher(wait, debounce)
+    except OSError:
+        return StatWatcher(wait, debounce)
+
+
+class ReloadHandler(threading.Thread):
+    '''This class reloads plugin files as they change.
+    
+    Only the directories plugins were loaded from, along with any given in 
+    `paths`, are watched, using the best watcher available. They are looked 
+    up again after each reload, so directories of newly registered plugins 
+    are watched too. Python files added to a watched directory are loaded 
+    as well, so new plugins are picked up without a restart.
+    '''
+    
+    def __init__(self, plugin_handler, logger, paths=None):
+        threading.Thread.__init__(self)
+        self.plugin = plugin_handler
+        self.logger = logger
+        self.paths = paths or []
+        self.watcher = create_watcher()
+        self.daemon = True
+        self.start()
+    
+    def plugin_directories(self):
+        '''This method returns the set of directories to watch, i.e. those 
+        of the files that define the registered plugins and `self.paths`.
+        '''
         
-        mtimes = {}
+        directories = set(os.path.abspath(path) for path in self.paths)
+        for plugin_list in PLUGIN_LISTS:
+            for plugin in self.plugin.config.get(plugin_list) or []:
+                for func in plugin['funcs']:
+                    try:
+                        filename = inspect.getabsfile(func)
+                    except TypeError:
+                        continue
+                    directories.add(os.path.dirname(filename))
+        return directories
+    
+    def _reloader(self):
+        '''This internal method waits for the watcher to report changed 
+        files and reloads each of them, watching any new plugin directories 
+        before waiting again.
+        '''
         
         while True:
-            for filename in fnames:
+            for directory in self.plugin_directories():
                 try:
-                    mtime = os.stat(filename).st_mtime
+                    self.watcher.watch(directory)
                 except OSError, e:
                     self.logger.error('Reloader error: {0}'.format(e))
-                    continue
-                
-                old_time = mtimes.get(filename)
-                if old_time is None:
-                    mtimes[filename] = mtime
-                elif mtime > old_time:
-                    mtimes[filename] = mtime
-                    
-                    self.logger.info('Changes detected; reloading {0}'.format(filename))
-                    
-                    filtered_lists = self.plugin.filter_plugin_lists(self.plugin_lists, filename)
-                    
-                    f = os.path.split(filename)[-1]
-                    f = os.path.splitext(f)[0]
-                    try:
-                        imp.load_source(f, filename)
-                    except Exception, e:
-                        self.logger.error('Failed loading plugin: ' + str(e))
-                        continue
-                    finally:
-                        mtimes[filename] = mtime
-                    
-                    if filtered_lists:
-                        self.plugin.restore_plugin_lists(self.plugin_lists, filtered_lists)
-                        
-            time.sleep(wait)
+            
+            for filename in sorted(self.watcher.changes()):
+                self._reload(filename)
+    
+    def _reload(self, filename):
+        '''This internal method reloads the module in `filename` using 
+        `imp.load_source`. The plugin handler swaps the module's new plugins 
+        in for its old ones in one step, or keeps the old ones should the 
+        module fail to load.
+        '''
+        
+        self.logger.info('Changes detected; reloading {0}'.format(filename))
+        
+        f = os.path.split(filename)[-1]
+        f = os.path.splitext(f)[0]
+        try:
+            self.plugin.reload_plugins(filename,
+                                       lambda: imp.load_source(f, filename))
+        except Exception, e:
+            self.logger.error('Failed loading plugin: ' + str(e))
     
     def run(self):
-        self._reloader_loop()
+        self._reloader()
@@ -0,0 +1,390 @@
+'''
+    irctk.state
+    -----------
+    
+    Provides `StateTracker`, which follows the channels we are in, their 
+    members and modes, as lines are received from the server.
+'''
+
+import threading
+
+
+def _lower(name):
+    return name.lower()
+
+
+class Channel(object):
+    '''This class holds what is known about a channel we are in: its `name`, 
+    `topic` and `modes`, a dict of mode characters to their parameter or 
+    None, and its `members`.
+    
+    `members` maps the folded nick of each member to the string of prefix 
+    modes, e.g. 'o' or 'ov', they hold in the channel. The mode strings are 
+    shared, so most members cost no more than their dict entry.
+    '''
+    
+    __slots__ = ('name', 'topic', 'modes', 'members')
+    
+    def __init__(self, name):
+        self.name = name
+        self.topic = None
+        self.modes = {}
+        self.members = {}
+    
+    def __repr__(self):
+        return '<Channel {0!r} ({1} members)>'.format(self.name, len(self.members))
+
+
+class User(object):
+    '''This class holds what is known about a user we share a channel with: 
+    their `nick`, `ident` and `host`, when known, and `channels`, the folded 
+    names of the channels we share. Most users share only a channel or two 
+    with us, so these are kept in a tuple, which is far smaller than a set.
+    '''
+    
+    __slots__ = ('nick', 'ident', 'host', 'channels')
+    
+    def __init__(self, nick, ident=None, host=None):
+        self.nick = nick
+        self.ident = ident
+        self.host = host
+        self.channels = ()
+    
+    def __repr__(self):
+        return '<User {0!r}>'.format(self.nick)
+
+
+class StateTracker(object):
+    '''This class tracks the channels we are in, the members of each and the 
+    channels of each member, from the lines received from the server. It is 
+    fed every parsed line with `feed`.
+    
+    Nicks and channel names are compared after folding them with `fold`, 
+    which should follow the server's case mapping. Strings are interned, so 
+    a nick seen in many channels is stored once.
+    
+    Membership queries are single dict lookups:
+    
+        state.is_member('#ops', 'kaa')    # True or False
+        state.modes('#ops', 'kaa')        # e.g. 'o'
+        state.channels('kaa')             # ['#ops', '#voxinfinitus']
+    
+    The mode characters that give members a prefix, `prefix_modes`, along 
+    with their symbols, `prefix_symbols`, and the channel modes that take a 
+    parameter, `chanmodes`, default to common values.
+    '''
+    
+    def __init__(self, nick, fold=None):
+        self.nick = nick
+        self.fold = fold or _lower
+        self.lock = threading.Lock()
+        
+        self.prefix_modes = 'ov'
+        self.prefix_symbols = '@+'
+        self.chanmodes = ('beI', 'k', 'l', 'imnpst')
+        
+        self.reset()
+    
+    def reset(self):
+        '''This method forgets everything, e.g. once we have reconnected.'''
+        
+        with self.lock:
+            self._clear()
+    
+    def _clear(self):
+        self.channels_by_name = {}
+        self.users = {}
+        self.strings = {}
+    
+    def _intern(self, string):
+        return self.strings.setdefault(string, string)
+    
+    def _prune_strings(self):
+        '''This internal method rebuilds the table of interned strings from 
+        the strings still in use, once enough nicks have come and gone.
+        '''
+        
+        strings = {}
+        for key, user in self.users.iteritems():
+            for string in (key, user.nick, user.ident, user.host):
+                if string:
+                    strings[string] = string
+        for key, channel in self.channels_by_name.iteritems():
+            strings[key] = key
+            strings[channel.name] = channel.name
+            for modes in channel.members.itervalues():
+                strings[modes] = modes
+        self.strings = strings
+    
+    def _key(self, name):
+        return self._intern(self.fold(name))
+    
+    def _is_me(self, nick):
+        return self.fold(nick) == self.fold(self.nick)
+    
+    def feed(self, message):
+        '''This method updates the state from `message`, a parsed line.'''
+        
+        handler = self.handlers.get(message.command)
+        if handler is not None:
+            with self.lock:
+                handler(self, message)
+                in_use = len(self.users) + len(self.channels_by_name)
+                if len(self.strings) > 4 * in_use + 1024:
+                    self._prune_strings()
+    
+    # The handlers below are called with `self.lock` held.
+    
+    def _add_member(self, channel, nick, modes='', ident=None, host=None):
+        key = self._key(nick)
+        user = self.users.get(key)
+        if user is None:
+            user = self.users[key] = User(self._intern(nick))
+        if ident:
+            user.ident = self._intern(ident)
+        if host:
+            user.host = self._intern(host)
+        
+        channel_key = self._key(channel.name)
+        if channel_key not in user.channels:
+            user.channels += (channel_key,)
+        channel.members[key] = self._intern(modes)
+    
+    def _remove_member(self, channel_key, nick_key):
+        channel = self.channels_by_name.get(channel_key)
+        if channel is not None:
+            channel.members.pop(nick_key, None)
+        
+        self._discard_channel(nick_key, channel_key)
+    
+    def _discard_channel(self, nick_key, channel_key):
+        user = self.users.get(nick_key)
+        if user is not None:
+            user.channels = tuple(key for key in user.channels 
+                                  if key != channel_key)
+            if not user.channels:
+                del self.users[nick_key]
+    
+    def _leave(self, channel_key):
+        channel = self.channels_by_name.pop(channel_key, None)
+        if channel is None:
+            return
+        for nick_key in channel.members:
+            self._discard_channel(nick_key, channel_key)
+    
+    def _on_welcome(self, message):
+        self._clear()
+        if message.params:
+            self.nick = message.params[0]
+    
+    def _on_join(self, message):
+        if not message.params:
+            return
+        name = message.params[0]
+        key = self._key(name)
+        
+        channel = self.channels_by_name.get(key)
+        if channel is None:
+            if not self._is_me(message.nick):
+                return # not a channel we are in
+            channel = self.channels_by_name[key] = Channel(self._intern(name))
+        self._add_member(channel, message.nick, '', message.ident, message.host)
+    
+    def _on_part(self, message):
+        if not message.params:
+            return
+        for name in message.params[0].split(','):
+            if self._is_me(message.nick):
+                self._leave(self.fold(name))
+            else:
+                self._remove_member(self.fold(name), self.fold(message.nick))
+    
+    def _on_kick(self, message):
+        if len(message.params) < 2:
+            return
+        name, nick = message.params[:2]
+        if self._is_me(nick):
+            self._leave(self.fold(name))
+        else:
+            self._remove_member(self.fold(name), self.fold(nick))
+    
+    def _on_quit(self, message):
+        key = self.fold(message.nick)
+        user = self.users.pop(key, None)
+        if user is None:
+            return
+        for channel_key in user.channels:
+            channel = self.channels_by_name.get(channel_key)
+            if channel is not None:
+                channel.members.pop(key, None)
+    
+    def _on_nick(self, message):
+        if not message.params:
+            return
+        new_nick = message.params[-1]
+        if self._is_me(message.nick):
+            self.nick = new_nick
+        
+        old_key = self.fold(message.nick)
+        user = self.users.pop(old_key, None)
+        if user is None:
+            return
+        
+        new_key = self._key(new_nick)
+        user.nick = self._intern(new_nick)
+        self.users[new_key] = user
+        for channel_key in user.channels:
+            channel = self.channels_by_name.get(channel_key)
+            if channel is not None and old_key in channel.members:
+                channel.members[new_key] = channel.members.pop(old_key)
+    
+    def _on_names(self, message):
+        # :server 353 ournick = #channel :@op +voice nick!user@host
+        if len(message.params) < 4:
+            return
+        channel = self.channels_by_name.get(self.fold(message.params[2]))
+        if channel is None:
+            return
+        
+        symbols = self.prefix_symbols
+        for name in message.params[3].split():
+            modes = ''
+            while name and name[0] in symbols:
+                modes += self.prefix_modes[symbols.index(name[0])]
+                name = name[1:]
+            if not name:
+                continue
+            
+            nick, _, host = name.partition('@')
+            nick, _, ident = nick.partition('!')
+            self._add_member(channel, nick, modes, ident, host)
+    
+    def _on_topic(self, message):
+        # :nick TOPIC #channel :topic or :server 332 ournick #channel :topic
+        params = message.params
+        if message.command == '332':
+            params = params[1:]
+        if len(params) < 2:
+            return
+        channel = self.channels_by_name.get(self.fold(params[0]))
+        if channel is not None:
+            channel.topic = params[-1]
+    
+    def _on_mode(self, message):
+        # :nick MODE #channel +ov-k nick1 nick2 key
+        if len(message.params) < 2:
+            return
+        channel = self.channels_by_name.get(self.fold(message.params[0]))
+        if channel is None:
+            return # a user mode, or a channel we are not in
+        self._apply_modes(channel, message.params[1], list(message.params[2:]))
+    
+    def _on_mode_reply(self, message):
+        # :server 324 ournick #channel +nt
+        if len(message.params) < 3:
+            return
+        channel = self.channels_by_name.get(self.fold(message.params[1]))
+        if channel is not None:
+            channel.modes = {}
+            self._apply_modes(channel, message.params[2],
+                              list(message.params[3:]))
+    
+    def _apply_modes(self, channel, changes, args):
+        lists, always, when_set, never = self.chanmodes
+        adding = True
+        for mode in changes:
+            if mode in '+-':
+                adding = mode == '+'
+            elif mode in self.prefix_modes:
+                if not args:
+                    continue
+                key = self.fold(args.pop(0))
+                modes = channel.members.get(key)
+                if modes is None:
+                    continue
+                if adding and mode not in modes:
+                    # keep the modes in order of rank, highest first
+                    modes = ''.join(m for m in self.prefix_modes
+                                    if m in modes or m == mode)
+                elif not adding:
+                    modes = modes.replace(mode, '')
+                channel.members[key] = self._intern(modes)
+            elif mode in lists:
+                if args:
+                    args.pop(0) # lists such as bans are not tracked
+            elif mode in always or (mode in when_set and adding):
+                param = args.pop(0) if args else None
+                if adding:
+                    channel.modes[mode] = param
+                else:
+                    channel.modes.pop(mode, None)
+            elif adding:
+                channel.modes[mode] = None
+            else:
+                channel.modes.pop(mode, None)
+    
+    handlers = {
+        '001': _on_welcome,
+        'JOIN': _on_join,
+        'PART': _on_part,
+        'KICK': _on_kick,
+        'QUIT': _on_quit,
+        'NICK': _on_nick,
+        '353': _on_names,
+        'TOPIC': _on_topic,
+        '332': _on_topic,
+        'MODE': _on_mode,
+        '324': _on_mode_reply,
+        }
+    
+    def channel(self, name):
+        '''This method returns the `Channel` called `name`, or None if we 
+        are not in it. It should be treated as read only.
+        '''
+        
+        return self.channels_by_name.get(self.fold(name))
+    
+    def user(self, nick):
+        '''This method returns the `User` called `nick`, or None if we share 
+        no channel with them. It should be treated as read only.
+        '''
+        
+        return self.users.get(self.fold(nick))
+    
+    def is_member(self, channel, nick):
+        channel = self.channels_by_name.get(self.fold(channel))
+        return channel is not None and self.fold(nick) in channel.members
+    
+    def modes(self, channel, nick):
+        '''This method returns the prefix modes `nick` holds in `channel`, 
+        e.g. 'o', or None if they are not a member.
+        '''
+        
+        channel = self.channels_by_name.get(self.fold(channel))
+        if channel is None:
+            return None
+        return channel.members.get(self.fold(nick))
+    
+    def channels(self, nick=None):
+        '''This method returns the names of the channels we share with 
+        `nick`, or of all the channels we are in if no nick is given.
+        '''
+        
+        with self.lock:
+            if nick is None:
+                return [c.name for c in self.channels_by_name.values()]
+            user = self.users.get(self.fold(nick))
+            if user is None:
+                return []
+            return [self.channels_by_name[key].name for key in user.channels
+                    if key in self.channels_by_name]
+    
+    def members(self, channel):
+        '''This method returns the nicks of the members of `channel`.'''
+        
+        with self.lock:
+            channel = self.channels_by_name.get(self.fold(channel))
+            if channel is None:
+                return []
+            return [self.users[key].nick for key in channel.members
+                    if key in self.users]
@@ -5,85 +5,393 @@
     A thread pool to be used with plugin dispatching.
 '''
 
+import heapq
+import itertools
 import threading
 import Queue
 import time
 
+from .metrics import metrics
+
+
+class TaskTimeout(Exception):
+    '''Raised by `Future.result` when a task ran longer than its timeout.'''
+
+
+class TaskCancelled(Exception):
+    '''Raised by `Future.result` when a task was cancelled before it ran.'''
+
+
+class Future(object):
+    '''This class holds the outcome of a task enqueued in a `ThreadPool`. 
+    The task's return value, or the exception it raised, is available from 
+    `result` once it has finished.
+    
+    A task that has not yet been picked up by a worker may be cancelled with 
+    `cancel`, in which case it is never run.
+    '''
+    
+    PENDING, RUNNING, FINISHED, CANCELLED = range(4)
+    
+    def __init__(self):
+        self.state = self.PENDING
+        self._result = None
+        self._exception = None
+        self._callbacks = []
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+    
+    def __repr__(self):
+        states = ('pending', 'running', 'finished', 'cancelled')
+        return '<Future {0}>'.format(states[self.state])
+    
+    def cancel(self):
+        '''This method cancels the task if it has not started yet and 
+        returns whether it was cancelled.
+        '''
+        
+        with self._lock:
+            if self.state == self.CANCELLED:
+                return True
+            if self.state != self.PENDING:
+                return False
+            self.state = self.CANCELLED
+            self._exception = TaskCancelled()
+        self._finish()
+        return True
+    
+    def cancelled(self):
+        return self.state == self.CANCELLED
+    
+    def running(self):
+        return self.state == self.RUNNING
+    
+    def done(self):
+        return self.state in (self.FINISHED, self.CANCELLED)
+    
+    def result(self, timeout=None):
+        '''This method waits up to `timeout` seconds for the task to finish 
+        and returns its result, raising the task's exception if it failed.
+        '''
+        
+        if not self._done.wait(timeout):
+            raise TaskTimeout('Timed out waiting for the task to finish.')
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+    
+    def exception(self, timeout=None):
+        '''This method waits up to `timeout` seconds for the task to finish 
+        and returns the exception it raised, or None.
+        '''
+        
+        if not self._done.wait(timeout):
+            raise TaskTimeout('Timed out waiting for the task to finish.')
+        return self._exception
+    
+    def add_done_callback(self, func):
+        '''This method arranges for `func` to be called with the future once 
+        it is done, or straight away if it already is.
+        '''
+        
+        with self._lock:
+            if not self.done():
+                self._callbacks.append(func)
+                return
+        func(self)
+    
+    def set_running(self):
+        '''This internal method marks the task as started. It returns False 
+        if the task was cancelled and should not be run.
+        '''
+        
+        with self._lock:
+            if self.state != self.PENDING:
+                return False
+            self.state = self.RUNNING
+            return True
+    
+    def set_result(self, result):
+        with self._lock:
+            if self.done():
+                return
+            self.state = self.FINISHED
+            self._result = result
+        self._finish()
+    
+    def set_exception(self, exception):
+        with self._lock:
+            if self.done():
+                return
+            self.state = self.FINISHED
+            self._exception = exception
+        self._finish()
+    
+    def _finish(self):
+        self._done.set()
+        callbacks, self._callbacks = self._callbacks, []
+        for func in callbacks:
+            func(self)
+
 
 class Worker(threading.Thread):
     '''This class may be used to create new worker threads and is used by the 
     thread pool class to do as such. It will take a given queue, `tasks`, and 
     extract from it the next task. This operation assumes the task is a 
-    function packed in the form, func, args, kwargs. Upon extracting the task 
-    the function is executed and the queue notified the task was completed.
+    function packed in the form, func, args, kwargs, enqueued, future, 
+    timeout, where `enqueued` is the time the task was queued and `future` 
+    the `Future` to report its outcome to. Upon extracting the task the 
+    function is executed and the queue notified the task was completed.
+    
+    If the worker belongs to a thread pool, `pool`, it reports to the pool 
+    when it is idle and how long each task waited. While the pool has more 
+    than its minimum of workers, a worker that has waited `idle_timeout` 
+    seconds for a task retires. A task with a `timeout` is handed to the 
+    pool's watchdog; should the worker be quarantined by it, the worker 
+    exits as soon as the runaway task returns.
     
     Inherits from `threading.Thread`.
     '''
     
-    def __init__(self, tasks, logger):
+    def __init__(self, tasks, logger, pool=None):
         threading.Thread.__init__(self)
         self.tasks = tasks
         self.logger = logger
+        self.pool = pool
+        self.current = None
+        self.quarantined = False
         self.daemon = True
         self.start()
     
     def run(self):
+        pool = self.pool
         while True:
-            func, args, kwargs = self.tasks.get()
+            if pool and pool.workers > pool.min_workers:
+                # a timed get polls under Python 2, so only spare workers, 
+                # which are soon gone, wait this way
+                try:
+                    task = self.tasks.get(timeout=pool.idle_timeout)
+                except Queue.Empty:
+                    if pool._retire():
+                        return
+                    continue
+            else:
+                task = self.tasks.get()
+            
+            if pool:
+                pool._worker_busy(time.time() - task[3])
+            
+            func, args, kwargs, enqueued, future, timeout = task
             try:
-                func(*args, **kwargs)
-            except Exception, e:
-                error = 'Worker error: {0}'.format(e)
-                self.logger.error(error)
+                if future.set_running():
+                    self.current = future
+                    if pool and timeout:
+                        pool._watch(self, future, timeout)
+                    self._run_task(future, func, args, kwargs)
             finally:
+                self.current = None
+                # idle again before the task counts as done, so the pool's 
+                # counts are settled by the time `tasks.join()` returns
+                if pool and not self.quarantined:
+                    pool._worker_idle()
                 self.tasks.task_done()
+            
+            if self.quarantined:
+                return
+    
+    def _run_task(self, future, func, args, kwargs):
+        try:
+            result = func(*args, **kwargs)
+        except Exception, e:
+            future.set_exception(e)
+            error = 'Worker error: {0}'.format(e)
+            if self.logger:
+                self.logger.error(error)
+        else:
+            future.set_result(result)
 
-class ThreadPool(threading.Thread):
+class ThreadPool(object):
     '''This class provides an interface to a thread pool mechanism. Tasks may 
     be enqueued via `cls.enqueue_task`. Worker threads are added via 
-    `cls.spawn_worker`.
+    `cls._spawn_worker`.
     
     A given number, i.e. `min_workers`, of workers will be spawned upon 
-    instantiation.
+    instantiation. When a task is enqueued and there are more tasks waiting 
+    than idle workers, or a task has waited longer than `max_wait` seconds 
+    before being picked up, another worker is spawned, up to `max_workers`. 
+    Workers beyond `min_workers` retire once they have gone `idle_timeout` 
+    seconds without a task, so the pool shrinks back even when no more 
+    tasks come.
     
-    Inherits from `threading.Thread`.
+    No thread is needed to manage the pool; all of the above happens as 
+    tasks are enqueued and picked up, or as workers wait for them.
     
     Example usage might go something like this:
-        
+    
         def square(x):
             return x * x
         
         thread_pool = ThreadPool(3, 7, logger=logger)
         thread_pool.enqueue_task(square, 2) # enqueue a func with args
-        
+    
     This will enqueue the above function and call it. In practical usage the 
     function should serve as some kind of callback.
     '''
     
-    def __init__(self, min_workers, logger=None, wait=0.01):
-        threading.Thread.__init__(self)
+    def __init__(self, min_workers, max_workers=None, logger=None,
+                 idle_timeout=60.0, max_wait=0.5):
         self.tasks = Queue.Queue()
         self.min_workers = min_workers
-        self.workers = 0
+        self.max_workers = max(min_workers, max_workers or min_workers)
+        self.idle_timeout = idle_timeout
+        self.max_wait = max_wait
         self.logger = logger
-        self.wait = wait
-        self.daemon = True
-        self.start()
         
+        self.lock = threading.Lock()
+        self.workers = 0
+        self.idle = 0
+        
+        self.deadlines = []
+        self.deadline_seq = itertools.count()
+        self.alarm = None # the deadline the watchdog is next woken at
+        self.watchdog_lock = threading.Lock()
+        
+        with self.lock:
+            while self.workers < self.min_workers:
+                self._spawn_worker()
+    
     def enqueue_task(self, func, *args, **kwargs):
-        task = (func, args, kwargs)
-        self.tasks.put(task)
+        '''This method enqueues `func` to be called with `args` and `kwargs` 
+        and returns a `Future` for its result.
+        '''
+        
+        return self.submit(func, args, kwargs)
+    
+    def submit(self, func, args=(), kwargs=None, timeout=None):
+        '''This method enqueues `func` to be called with `args` and `kwargs` 
+        and returns a `Future` for its result. If `timeout` is given and the 
+        call runs for longer than that many seconds, the future fails with 
+        `TaskTimeout` and the worker running it is replaced.
+        '''
+        
+        future = Future()
+        task = (func, args, kwargs or {}, time.time(), future, timeout)
+        with self.lock:
+            self.tasks.put(task)
+            
+            backlog = self.tasks.qsize()
+            if backlog > self.idle and self.workers < self.max_workers:
+                self._spawn_worker()
+        return future
     
     def _spawn_worker(self):
-        Worker(self.tasks, self.logger)
+        '''This internal method starts a new worker. Must be called with 
+        `self.lock` held.
+        '''
+        
+        self.workers += 1
+        self.idle += 1 # until it takes a task
+        Worker(self.tasks, self.logger, self)
     
-    def run(self):
-        while True:
-            time.sleep(self.wait)
-            
-            too_few_workers = lambda : self.workers < self.min_workers
-            
-            if too_few_workers():
-                self.workers += 1
+    def _worker_idle(self):
+        with self.lock:
+            self.idle += 1
+    
+    def _worker_busy(self, waited):
+        metrics.observe('pool.wait', waited)
+        with self.lock:
+            self.idle -= 1
+            if waited > self.max_wait and self.workers < self.max_workers:
                 self._spawn_worker()
-
+    
+    def _retire(self):
+        '''This internal method is called by an idle worker that has waited 
+        `idle_timeout` seconds for a task. It returns True, and the worker 
+        exits, if the pool still has workers to spare.
+        '''
+        
+        with self.lock:
+            if self.workers <= self.min_workers:
+                return False
+            self.workers -= 1
+            self.idle -= 1
+            return True
+    
+    def _watch(self, worker, future, timeout):
+        '''This internal method registers the task `future`, just started by 
+        `worker`, with the watchdog, which quarantines the worker if the task 
+        has not finished within `timeout` seconds.
+        '''
+        
+        deadline = time.time() + timeout
+        entry = (deadline, next(self.deadline_seq), worker, future)
+        with self.watchdog_lock:
+            heapq.heappush(self.deadlines, entry)
+            if self.alarm is None or deadline < self.alarm[0]:
+                self._set_alarm(deadline)
+    
+    def _set_alarm(self, deadline):
+        '''This internal method starts a thread that sleeps until `deadline` 
+        and then runs the watchdog, replacing any alarm set for later. Must 
+        be called with `self.watchdog_lock` held.
+        
+        A timed wait on a condition polls under Python 2, so the thread 
+        sleeps instead; an alarm that has been replaced simply does nothing 
+        when it wakes.
+        '''
+        
+        alarm = self.alarm = (deadline, next(self.deadline_seq))
+        thread = threading.Thread(target=self._run_watchdog, args=(alarm,))
+        thread.daemon = True
+        thread.start()
+    
+    def _run_watchdog(self, alarm):
+        '''This internal method is run by the thread of `alarm` once its 
+        deadline has passed. It quarantines the workers whose tasks overran 
+        their deadlines, forgets the tasks that have finished, and sets the 
+        alarm for the earliest deadline left.
+        
+        Python threads can not be stopped from outside, so the runaway task 
+        is left to finish in its own time. Its future fails straight away, 
+        its worker is no longer counted as part of the pool and exits once 
+        the task returns, and a new worker is spawned to take its place.
+        '''
+        
+        time.sleep(max(0.0, alarm[0] - time.time()))
+        
+        expired = []
+        with self.watchdog_lock:
+            if self.alarm is not alarm:
+                return # replaced by an earlier alarm
+            self.alarm = None
+            
+            now = time.time()
+            deadlines = []
+            for entry in self.deadlines:
+                deadline, _, worker, future = entry
+                if future.done():
+                    continue
+                elif deadline > now:
+                    deadlines.append(entry)
+                elif worker.current is future:
+                    expired.append((worker, future))
+            heapq.heapify(deadlines)
+            self.deadlines = deadlines
+            if deadlines:
+                self._set_alarm(deadlines[0][0])
+        
+        for worker, future in expired:
+            self._quarantine(worker, future)
+    
+    def _quarantine(self, worker, future):
+        if future.done():
+            return
+        worker.quarantined = True
+        with self.lock:
+            self.workers -= 1
+            self._spawn_worker()
+        
+        future.set_exception(TaskTimeout('Task timed out.'))
+        if self.logger:
+            self.logger.warning('Quarantined worker {0} running a task that '
+                                'timed out.'.format(worker.name))
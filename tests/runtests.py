@@ -1,7 +1,7 @@
 import unittest
 
 def suite():
-    modules_to_test = ('test_ircclient', 'test_bot', 'test_threadpool', 'test_plugins')
+    modules_to_test = ('test_ircclient', 'test_framing', 'test_parser', 'test_asyncclient', 'test_ratelimit', 'test_bot', 'test_threadpool', 'test_plugins', 'test_admission', 'test_cache', 'test_reloader', 'test_state', 'test_metrics', 'test_logging', 'test_decoding', 'test_reconnect', 'test_isupport')
     alltests = unittest.TestSuite()
     for module in map(__import__, modules_to_test):
         alltests.addTest(unittest.findTestCases(module))
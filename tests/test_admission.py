@@ -0,0 +1,96 @@
+import unittest
+
+from irctk.admission import AdmissionControl
+from irctk.isupport import ServerSupport
+from irctk.parser import parse
+from irctk.threadpool import Future
+
+
+class AdmissionControlTestCase(unittest.TestCase):
+    '''This test case is used to test the AdmissionControl class methods.'''
+    
+    def setUp(self):
+        self.config = {}
+        self.admission = AdmissionControl(self.config)
+        self.plugin = {'hook': 'foo', 'funcs': []}
+        self.line = parse(':nick!ident@host PRIVMSG #test :.foo', 'test')
+    
+    def admit(self, plugin=None, line=None):
+        plugin = plugin or self.plugin
+        if not self.admission.admit(plugin, line or self.line):
+            return None
+        future = Future()
+        self.admission.track(plugin, future)
+        return future
+    
+    def test_unlimited(self):
+        for x in range(20):
+            self.assertTrue(self.admit())
+    
+    def test_user_limit(self):
+        self.config['USER_COMMANDS'] = 2
+        self.assertTrue(self.admit())
+        self.assertTrue(self.admit())
+        self.assertFalse(self.admit())
+        
+        other = parse(':other!ident@elsewhere PRIVMSG #test :.foo', 'test')
+        self.assertTrue(self.admit(line=other))
+        
+        # events are sent by the server and are not limited per user
+        self.assertTrue(self.admission.admit(self.plugin, self.line, False))
+    
+    def test_channel_limit(self):
+        self.config['CHANNEL_COMMANDS'] = 1
+        self.assertTrue(self.admit())
+        self.assertFalse(self.admit())
+        
+        private = parse(':nick!ident@host PRIVMSG Kaa :.foo', 'test')
+        self.assertTrue(self.admit(line=private))
+    
+    def test_channel_support(self):
+        support = ServerSupport()
+        support.feed_isupport(['CHANTYPES=#'])
+        self.admission.support = {'test': support}.get
+        self.config['CHANNEL_COMMANDS'] = 1
+        
+        # #Test[1] and #test{1} are the same channel under rfc1459
+        first = parse(':nick!ident@host PRIVMSG #Test[1] :.foo', 'test')
+        second = parse(':other!ident@host PRIVMSG #test{1} :.foo', 'test')
+        self.assertTrue(self.admit(line=first))
+        self.assertFalse(self.admit(line=second))
+        
+        # & is not a channel prefix on this server
+        local = parse(':nick!ident@host PRIVMSG &local :.foo', 'test')
+        self.assertTrue(self.admit(line=local))
+        self.assertTrue(self.admit(line=local))
+    
+    def test_concurrency(self):
+        self.config['HOOK_CONCURRENCY'] = 1
+        future = self.admit()
+        self.assertFalse(self.admit())
+        self.assertTrue(self.admit({'hook': 'bar', 'concurrency': 2}))
+        
+        future.set_result(None)
+        self.assertTrue(self.admit())
+    
+    def test_drop(self):
+        self.config['MAX_QUEUE'] = 2
+        first = self.admit()
+        self.admit()
+        self.assertFalse(self.admit())
+        
+        first.set_running()
+        self.assertTrue(self.admit())
+    
+    def test_shed(self):
+        self.config['MAX_QUEUE'] = 2
+        self.config['QUEUE_OVERFLOW'] = 'shed'
+        first = self.admit()
+        second = self.admit()
+        self.assertTrue(self.admit())
+        self.assertTrue(first.cancelled())
+        self.assertFalse(second.cancelled())
+
+
+if __name__ == '__main__':
+    unittest.main()
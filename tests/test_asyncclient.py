@@ -0,0 +1,116 @@
+import unittest
+import socket
+import threading
+import logging
+
+from irctk.asyncclient import EventLoop, AsyncTcpClient, AsyncIrcWrapper
+
+
+class EventLoopTestCase(unittest.TestCase):
+    '''This test case is used to test the EventLoop class methods.'''
+    
+    def setUp(self):
+        self.loop = EventLoop()
+        self.thread = threading.Thread(target=self.loop.run)
+        self.thread.daemon = True
+        self.thread.start()
+    
+    def tearDown(self):
+        self.loop.stop()
+        self.thread.join(1.0)
+    
+    def test_call_later(self):
+        called = threading.Event()
+        self.loop.call_later(0.05, called.set)
+        self.assertTrue(called.wait(2.0))
+    
+    def test_stop(self):
+        self.loop.stop()
+        self.thread.join(2.0)
+        self.assertFalse(self.thread.is_alive())
+
+
+class AsyncTcpClientTestCase(unittest.TestCase):
+    '''This test case is used to test the AsyncTcpClient class methods.'''
+    
+    def setUp(self):
+        self.loop = EventLoop()
+        self.conn = AsyncTcpClient('127.0.0.1', 6667, timeout=0.2, loop=self.loop)
+    
+    def test_check_timeout(self):
+        self.conn.handle_connect()
+        self.assertTrue(self.conn._watching)
+        self.assertEqual(len(self.loop.timers), 1)
+        
+        del self.loop.timers[:]
+        self.conn.connected = True
+        self.conn._check_timeout()
+        self.assertEqual(len(self.loop.timers), 1)
+        
+        # once disconnected the watchdog stops, rather than spinning
+        del self.loop.timers[:]
+        self.conn.connected = False
+        self.conn._check_timeout()
+        self.assertFalse(self.conn._watching)
+        self.assertEqual(self.loop.timers, [])
+
+
+class AsyncIrcWrapperTestCase(unittest.TestCase):
+    '''This test case runs an `AsyncIrcWrapper` against a loopback socket.'''
+    
+    def setUp(self):
+        self.server = socket.socket()
+        self.server.bind(('127.0.0.1', 0))
+        self.server.listen(1)
+        port = self.server.getsockname()[1]
+        
+        logger = logging.getLogger('irctk.test')
+        self.loop = EventLoop(logger)
+        self.conn = AsyncTcpClient('127.0.0.1', port, logger=logger, loop=self.loop)
+        self.wrapper = AsyncIrcWrapper(self.conn, 'test', 'tester', ['#test'], logger)
+        
+        self.conn.connect()
+        self.wrapper.run()
+        self.thread = threading.Thread(target=self.loop.run)
+        self.thread.daemon = True
+        self.thread.start()
+        
+        self.client, _ = self.server.accept()
+        self.client.settimeout(2.0)
+        self.inp_buffer = ''
+    
+    def tearDown(self):
+        self.conn.close()
+        self.loop.stop()
+        self.thread.join(1.0)
+        self.client.close()
+        self.server.close()
+    
+    def read_line(self):
+        while '\r\n' not in self.inp_buffer:
+            self.inp_buffer += self.client.recv(4096)
+        line, self.inp_buffer = self.inp_buffer.split('\r\n', 1)
+        return line
+    
+    def test_register(self):
+        self.assertEqual(self.read_line(), 'CAP LS 302')
+        self.assertEqual(self.read_line(), 'NICK test')
+        self.assertEqual(self.read_line(), 'USER test 3 * tester')
+    
+    def test_handle_line(self):
+        self.read_line()
+        self.read_line()
+        self.read_line()
+        
+        self.client.sendall(':server 001 test :Welcome\r\n'
+                            ':server 376 test :End of MOTD\r\nPING :12345\r\n')
+        lines = [self.read_line(), self.read_line()]
+        self.assertEqual(sorted(lines), ['JOIN #test', 'PONG 12345'])
+        
+        context = self.wrapper.messages.get(timeout=2.0)
+        self.assertEqual(context['command'], '001')
+        self.assertEqual(context['message'], 'Welcome')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,8 @@
 import unittest
+import threading
 
 from irctk.bot import Bot
+from irctk.metrics import metrics
 
 
 class BotTestCase(unittest.TestCase):
@@ -20,6 +22,28 @@ class BotTestCase(unittest.TestCase):
         self.bot._create_connection()
         self.assertTrue(self.bot.connection)
         self.assertTrue(self.bot.irc)
+        
+        gauges = metrics.snapshot()
+        for name in self.bot.networks:
+            self.assertTrue('irc.{0}.inp'.format(name) in gauges)
+            self.assertTrue('irc.{0}.out'.format(name) in gauges)
+    
+    def test_create_networks(self):
+        self.bot.config['NETWORKS'] = {
+                'alpha': {'SERVER': 'irc.alpha.net', 'NICK': 'alpha'},
+                'beta': {'SERVER': 'irc.beta.net'},
+                }
+        try:
+            self.bot._create_connection()
+        finally:
+            self.bot.config['NETWORKS'] = {}
+        
+        self.assertEqual(sorted(self.bot.networks), ['alpha', 'beta'])
+        self.assertEqual(self.bot.networks['alpha'].connection.host, 'irc.alpha.net')
+        self.assertEqual(self.bot.networks['alpha'].nick, 'alpha')
+        self.assertEqual(self.bot.networks['beta'].nick, self.bot.config['NICK'])
+        self.assertTrue(self.bot.irc is self.bot.networks['alpha'])
+        self.assertTrue(self.bot.networks['beta'].messages is self.bot.messages)
     
     def test_parse_input(self):
         pass
@@ -51,6 +75,13 @@ class BotTestCase(unittest.TestCase):
     
     def test_run(self):
         pass
+    
+    def test_block(self):
+        # returns once the dispatcher is gone
+        self.bot.dispatcher = threading.Thread(target=lambda: None)
+        self.bot.dispatcher.start()
+        self.bot.dispatcher.join()
+        self.bot._block()
 
 
 if __name__ == '__main__':
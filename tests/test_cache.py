@@ -0,0 +1,34 @@
+import unittest
+
+from irctk.cache import ResultCache
+
+
+class ResultCacheTestCase(unittest.TestCase):
+    '''This test case is used to test the ResultCache class methods.'''
+    
+    def setUp(self):
+        self.cache = ResultCache(size=2, ttl=60)
+    
+    def test_get(self):
+        self.assertEquals(self.cache.get('foo'), (False, None))
+        self.cache.set('foo', ['bar'])
+        self.assertEquals(self.cache.get('foo'), (True, ['bar']))
+    
+    def test_size(self):
+        self.cache.set('a', 1)
+        self.cache.set('b', 2)
+        self.cache.get('a')
+        self.cache.set('c', 3)
+        self.assertEquals(len(self.cache), 2)
+        self.assertEquals(self.cache.get('b'), (False, None))
+        self.assertEquals(self.cache.get('a'), (True, 1))
+    
+    def test_ttl(self):
+        self.cache.ttl = 0
+        self.cache.set('foo', 'bar')
+        self.assertEquals(self.cache.get('foo'), (False, None))
+        self.assertEquals(len(self.cache), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
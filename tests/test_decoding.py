@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from irctk.decoding import Decoder, to_text
+
+
+class DecoderTestCase(unittest.TestCase):
+    '''This test case is used to test the Decoder class methods.'''
+    
+    def setUp(self):
+        self.decoder = Decoder('cp1252')
+    
+    def test_utf8(self):
+        text = self.decoder.decode(':kaa!k@h PRIVMSG #ops :caf\xc3\xa9')
+        self.assertEqual(text, u':kaa!k@h PRIVMSG #ops :caf\xe9')
+        self.assertEqual(len(self.decoder.senders), 0)
+        
+        text = self.decoder.decode('PING :server')
+        self.assertTrue(isinstance(text, unicode))
+    
+    def test_fallback(self):
+        text = self.decoder.decode(':kaa!k@h PRIVMSG #ops :caf\xe9 \x80')
+        self.assertEqual(text, u':kaa!k@h PRIVMSG #ops :caf\xe9 €')
+        
+        # bytes cp1252 has no character for
+        text = self.decoder.decode(':kaa!k@h PRIVMSG #ops :\x81')
+        self.assertEqual(text, u':kaa!k@h PRIVMSG #ops :\x81')
+    
+    def test_sender_cache(self):
+        self.decoder.decode('@id=1 :kaa!k@h PRIVMSG #ops :caf\xe9')
+        self.assertEqual(len(self.decoder.senders), 1)
+        
+        # valid UTF-8, but kaa is known to send cp1252
+        text = self.decoder.decode(':kaa!k@h PRIVMSG #ops :\xc3\xa9')
+        self.assertEqual(text, u':kaa!k@h PRIVMSG #ops :\xc3\xa9')
+        
+        text = self.decoder.decode(':bob!b@h PRIVMSG #ops :\xc3\xa9')
+        self.assertEqual(text, u':bob!b@h PRIVMSG #ops :\xe9')
+    
+    def test_no_fallback(self):
+        decoder = Decoder(None)
+        text = decoder.decode(':kaa!k@h PRIVMSG #ops :caf\xe9')
+        self.assertEqual(text, u':kaa!k@h PRIVMSG #ops :caf�')
+        self.assertEqual(len(decoder.senders), 0)
+    
+    def test_to_text(self):
+        self.assertEqual(to_text('caf\xc3\xa9'), u'caf\xe9')
+        self.assertEqual(to_text(u'caf\xe9'), u'caf\xe9')
+
+
+if __name__ == '__main__':
+    unittest.main()
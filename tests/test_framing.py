@@ -0,0 +1,112 @@
+import unittest
+
+from irctk.framing import LineBuffer, join_lines, split_message, pack_targets
+
+
+class LineBufferTestCase(unittest.TestCase):
+    '''This test case is used to test the LineBuffer class methods.'''
+    
+    def setUp(self):
+        self.buf = LineBuffer()
+        self.assertEquals(len(self.buf), 0)
+    
+    def test_feed(self):
+        lines = self.buf.feed('PING :server\r\nPRIVMSG #test :foo\r\n')
+        self.assertEquals(lines, ['PING :server', 'PRIVMSG #test :foo'])
+        self.assertEquals(len(self.buf), 0)
+    
+    def test_partial_lines(self):
+        self.assertEquals(self.buf.feed('PRIVMSG #test :hel'), [])
+        self.assertEquals(self.buf.feed('lo'), [])
+        self.assertEquals(self.buf.offset, len('PRIVMSG #test :hello'))
+        self.assertEquals(self.buf.feed('\r'), [])
+        self.assertEquals(self.buf.feed('\nPING'), ['PRIVMSG #test :hello'])
+        self.assertEquals(len(self.buf), 4)
+    
+    def test_bare_newline(self):
+        lines = self.buf.feed('foo\nbar\r\n\r\n\nbaz\n')
+        self.assertEquals(lines, ['foo', 'bar', 'baz'])
+    
+    def test_clear(self):
+        self.buf.feed('foo')
+        self.buf.clear()
+        self.assertEquals(self.buf.feed('bar\r\n'), ['bar'])
+
+
+class JoinLinesTestCase(unittest.TestCase):
+    '''This test case is used to test the join_lines function.'''
+    
+    def test_join_lines(self):
+        data, lines = join_lines(['PRIVMSG #foo :bar', 'QUIT :bye\r\nJOIN #evil', ''])
+        self.assertEquals(data, 'PRIVMSG #foo :bar\r\nQUIT :bye\r\n')
+        self.assertEquals(lines, ['PRIVMSG #foo :bar', 'QUIT :bye'])
+        
+        self.assertEquals(join_lines(['']), ('', []))
+    
+    def test_join_lines_text(self):
+        data, lines = join_lines([u'PRIVMSG #foo :caf\xe9\u2028!', 
+                                  'PRIVMSG #foo :caf\xc3\xa9'])
+        self.assertEquals(data, 'PRIVMSG #foo :caf\xc3\xa9\xe2\x80\xa8!\r\n'
+                                'PRIVMSG #foo :caf\xc3\xa9\r\n')
+
+
+class PackTargetsTestCase(unittest.TestCase):
+    '''This test case is used to test the pack_targets function.'''
+    
+    def test_budget(self):
+        channels = ['#channel{0}'.format(x) for x in range(300)]
+        lines = pack_targets('JOIN', channels)
+        self.assertEquals(len(lines), 7)
+        for line in lines:
+            self.assertTrue(len(line) <= 510)
+        joined = ','.join(line.split(' ')[1] for line in lines)
+        self.assertEquals(joined.split(','), channels)
+    
+    def test_limit(self):
+        self.assertEquals(pack_targets('PART', ['#a', '#b', '#c'], limit=2, 
+                                       suffix=' :bye'),
+                          ['PART #a,#b :bye', 'PART #c :bye'])
+        self.assertEquals(pack_targets('MODE', ['#a', '#b'], limit=1),
+                          ['MODE #a', 'MODE #b'])
+    
+    def test_keys(self):
+        self.assertEquals(pack_targets('JOIN', ['#a', '#b secret', '#c']),
+                          ['JOIN #b,#a,#c secret'])
+        self.assertEquals(pack_targets('JOIN', ['#a', '#b secret', '#c key'], 
+                                       budget=14),
+                          ['JOIN #b secret', 'JOIN #c,#a key'])
+
+
+class SplitMessageTestCase(unittest.TestCase):
+    '''This test case is used to test the split_message function.'''
+    
+    def test_words(self):
+        self.assertEquals(split_message('hello world foo bar', 11),
+                          ['hello world', 'foo bar'])
+        self.assertEquals(split_message('a' * 25, 10),
+                          ['a' * 10, 'a' * 10, 'a' * 5])
+        self.assertEquals(split_message('one\ntwo', 100), ['one', 'two'])
+    
+    def test_multibyte(self):
+        lines = split_message('\xc3\xa9' * 10, 5)
+        self.assertEquals(lines, ['\xc3\xa9' * 2] * 5)
+        
+        lines = split_message(u'h\xe9llo w\xf6rld', 6)
+        self.assertEquals(lines, [u'h\xe9llo', u'w\xf6rld'])
+    
+    def test_max_lines(self):
+        lines = split_message('one two three four five six', 9, max_lines=2,
+                              continuation=' ...')
+        self.assertEquals(lines, ['one two', 'three ...'])
+        
+        lines = split_message('one two', 9, max_lines=1, continuation=' ...')
+        self.assertEquals(lines, ['one two'])
+    
+    def test_long_message(self):
+        lines = split_message('word ' * 100000, 400)
+        self.assertTrue(all(len(line) <= 400 for line in lines))
+        self.assertEquals(''.join(lines).count('word'), 100000)
+
+
+if __name__ == '__main__':
+    unittest.main()
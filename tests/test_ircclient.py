@@ -1,5 +1,9 @@
 import unittest
 import Queue
+import threading
+import logging
+import socket
+import time
 
 from irctk.ircclient import TcpClient, IrcWrapper
 
@@ -13,6 +17,78 @@ class TcpClientTestCase(unittest.TestCase):
         self.assertTrue(self.conn.port == '6697')
         self.assertTrue(self.conn.ssl)
         self.assertFalse(self.conn.shutdown)
+    
+    def test_send(self):
+        sent = Queue.Queue()
+        
+        class FakeSocket(object):
+            def sendall(self, data):
+                sent.put(data)
+        
+        self.conn.socket = FakeSocket()
+        self.conn.ready.set()
+        self.conn.logger = logging.getLogger('irctk.test')
+        for line in ['PRIVMSG #foo :bar', 'NOTICE #foo :baz\r\nQUIT', 'PING :x']:
+            self.conn.out.put(line)
+        
+        sender = threading.Thread(target=self.conn._send)
+        sender.daemon = True
+        sender.start()
+        
+        data = sent.get(timeout=2.0)
+        self.assertEqual(data, 'PRIVMSG #foo :bar\r\nNOTICE #foo :baz\r\nPING :x\r\n')
+        self.assertEqual(self.conn.unsent, '')
+    
+    def test_send_failed(self):
+        errors = []
+        
+        class FakeSocket(object):
+            def sendall(self, data):
+                raise socket.error('broken pipe')
+        
+        class FakeLogger(object):
+            def error(self, message):
+                errors.append(message)
+            
+            def getChild(self, suffix):
+                return logging.getLogger('irctk.test')
+        
+        self.conn.socket = FakeSocket()
+        self.conn.ready.set()
+        self.conn.logger = FakeLogger()
+        
+        sender = threading.Thread(target=self.conn._send)
+        sender.daemon = True
+        sender.start()
+        
+        # each batch is kept to send again, but the failure is logged once
+        for line in ['PRIVMSG #foo :bar', 'PRIVMSG #foo :baz']:
+            self.conn.out.put(line)
+            deadline = time.time() + 2.0
+            while line not in self.conn.unsent and time.time() < deadline:
+                time.sleep(0.01)
+        self.assertEqual(self.conn.take_unsent(), 
+                         ['PRIVMSG #foo :bar', 'PRIVMSG #foo :baz'])
+        self.assertEqual(errors, ['Send failed: broken pipe'])
+
+    
+    def test_connect_failed(self):
+        server = socket.socket()
+        server.bind(('127.0.0.1', 0))
+        port = server.getsockname()[1]
+        server.close() # nothing is listening on the port now
+        
+        scheduled = []
+        conn = TcpClient('127.0.0.1', port, servers=[('127.0.0.1', 1, False)])
+        conn.reconnector.call_later = lambda delay, func: scheduled.append(func)
+        conn.connect()
+        
+        self.assertEqual(conn.inp.get(timeout=2.0), 
+                         'ERROR :Closing Link: connection lost')
+        self.assertFalse(conn.ready.is_set())
+        self.assertEqual(len(scheduled), 1)
+        self.assertEqual(conn.reconnector.server, ('127.0.0.1', 1, False))
+        conn.close()
 
 
 class IrcWrapperTestCase(unittest.TestCase):
@@ -26,13 +102,26 @@ class IrcWrapperTestCase(unittest.TestCase):
         self.assertTrue(self.wrapper.realname == 'tester')
         self.assertTrue(self.wrapper.channels == ['#test'])
     
+    def sent(self):
+        '''Drains the wrapper's scheduler, returning the lines as they would 
+        be sent.'''
+        
+        lines = []
+        while True:
+            line = self.wrapper.scheduler.get(block=False)
+            if line is None:
+                return ''.join(line + '\r\n' for line in lines)
+            lines.append(line)
+    
     def test_register(self):
         self.wrapper._register()
         nick = 'NICK test\r\n'
         user = 'USER test 3 * tester\r\n'
-        self.assertTrue((nick and user) in self.wrapper.out_buffer)
-        self.assertEqual(nick, self.wrapper.out_buffer.split('\r\n')[0] + '\r\n')
-        self.assertEqual(user, self.wrapper.out_buffer.split('\r\n')[1] + '\r\n')
+        out_buffer = self.sent()
+        self.assertTrue((nick and user) in out_buffer)
+        self.assertEqual('CAP LS 302', out_buffer.split('\r\n')[0])
+        self.assertEqual(nick, out_buffer.split('\r\n')[1] + '\r\n')
+        self.assertEqual(user, out_buffer.split('\r\n')[2] + '\r\n')
     
     def test_send(self):
         pass
@@ -56,13 +145,13 @@ class IrcWrapperTestCase(unittest.TestCase):
     def test_send_line(self):
         line = 'test'
         self.wrapper._send_line(line)
-        self.assertEqual('test\r\n', self.wrapper.out_buffer)
+        self.assertEqual('test\r\n', self.sent())
     
     def test_send_lines(self):
         lines = ['foo', 'bar', 'baz']
         expected_result = 'foo\r\nbar\r\nbaz\r\n'
         self.wrapper._send_lines(lines)
-        self.assertEqual(expected_result, self.wrapper.out_buffer)
+        self.assertEqual(expected_result, self.sent())
     
     def test_run(self):
         pass
@@ -72,29 +161,134 @@ class IrcWrapperTestCase(unittest.TestCase):
         args = ['#test' + ' :' + 'test']
         expected_result = 'PRIVMSG #test :test\r\n'
         self.wrapper.send_command(command, args)
-        self.assertEqual(expected_result, self.wrapper.out_buffer)
+        self.assertEqual(expected_result, self.sent())
     
     def test_send_message(self):
         recipient = '#test'
         message = 'test'
         expected_result = 'PRIVMSG #test :test\r\n'
         self.wrapper.send_message(recipient, message)
-        self.assertEqual(expected_result, self.wrapper.out_buffer)
-        self.wrapper.out_buffer = ''
+        self.assertEqual(expected_result, self.sent())
         
         recipient = '#test'
         message = 'dances'
         expected_result = 'PRIVMSG #test :\x01ACTION dances\x01\r\n'
         self.wrapper.send_message(recipient, message, action=True)
-        self.assertEqual(expected_result, self.wrapper.out_buffer)
-        self.wrapper.out_buffer = ''
+        self.assertEqual(expected_result, self.sent())
         
         recipient = '#test'
         message = 'attention!'
         expected_result = 'NOTICE #test :attention!\r\n'
         self.wrapper.send_message(recipient, message, notice=True)
-        self.assertEqual(expected_result, self.wrapper.out_buffer)
+        self.assertEqual(expected_result, self.sent())
         
+        # text received from the server mixed with UTF-8 bytes
+        self.wrapper.send_message(u'#caf\xe9', 'na\xc3\xafve')
+        self.assertEqual(u'PRIVMSG #caf\xe9 :na\xefve\r\n', self.sent())
+    
+    def test_handle_line(self):
+        self.wrapper._handle_line(':kaa!k@h PRIVMSG #test :caf\xe9')
+        context = self.wrapper.messages.get_nowait()
+        self.assertEqual(context.message, u'caf\xe9')
+        self.assertTrue(context.received <= time.time())
+        self.assertEqual(context.raw, ':kaa!k@h PRIVMSG #test :caf\xe9')
+    
+    def test_receive_error(self):
+        def broken(line):
+            raise ValueError('malformed')
+        self.wrapper._handle_line = broken
+        self.wrapper._receive(':server 324 test')
+        
+        del self.wrapper._handle_line
+        self.wrapper._receive(':server 324 test')
+        self.assertEqual(self.wrapper.messages.get_nowait().command, '324')
+    
+    def test_reconnect(self):
+        self.wrapper._handle_line(':test!~tester@example.org JOIN #test')
+        self.wrapper._handle_line(':test!~tester@example.org JOIN #other')
+        self.sent()
+        
+        self.wrapper._handle_line('ERROR :Closing Link: connection lost')
+        self.wrapper.send_message('#test', 'queued')
+        self.wrapper._handle_line('RECONNECT :server')
+        self.assertEqual(self.sent(), 
+                         'CAP LS 302\r\nNICK test\r\nUSER test 3 * tester\r\n')
+        
+        self.wrapper._handle_line(':server 001 test :Welcome')
+        self.wrapper._handle_line(':server 422 test :MOTD File is missing')
+        self.assertEqual(self.sent(), 
+                         'JOIN #test,#other\r\nPRIVMSG #test :queued\r\n')
+    
+    def test_restore_targmax(self):
+        self.wrapper.channels = ['#a', '#b', '#c', '#d']
+        self.wrapper._handle_line(':server 001 test :Welcome')
+        self.assertEqual(self.sent(), '')
+        
+        self.wrapper._handle_line(':server 005 test TARGMAX=JOIN:2 '
+                                  ':are supported by this server')
+        self.wrapper._handle_line(':server 376 test :End of /MOTD command.')
+        self.assertEqual(self.sent(), 'JOIN #a,#b\r\nJOIN #c,#d\r\n')
+        
+        # a later MOTD, e.g. one asked for, does not join again
+        self.wrapper._handle_line(':server 376 test :End of /MOTD command.')
+        self.assertEqual(self.sent(), '')
+    
+    def test_send_targets(self):
+        self.wrapper.send_part(['#a', '#b'], 'bye')
+        self.wrapper.send_mode(['#a', '#b'])
+        self.assertEqual(self.sent(), 
+                         'PART #a,#b :bye\r\nMODE #a\r\nMODE #b\r\n')
+        
+        self.wrapper.targmax['WHO'] = 2
+        self.wrapper.line_length = 13
+        self.wrapper.send_who(['#a', '#b', '#c', '#long'])
+        self.assertEqual(self.sent(), 
+                         'WHO #a,#b\r\nWHO #c\r\nWHO #long\r\n')
+    
+    def test_isupport(self):
+        self.wrapper._handle_line(':server 005 test CHANTYPES=#! '
+                                  'PREFIX=(qov)~@+ TARGMAX=WHO:3,JOIN: '
+                                  'LINELEN=1024 :are supported by this server')
+        self.assertTrue(self.wrapper.support.is_channel('!ops'))
+        self.assertEqual(self.wrapper.state.prefix_symbols, '~@+')
+        self.assertEqual(self.wrapper.targmax['WHO'], 3)
+        self.assertEqual(self.wrapper.targmax['MODE'], 1)
+        self.assertEqual(self.wrapper.message_budget('#test'), 926)
+        
+        self.wrapper._handle_line(':test!~tester@example.org JOIN #Ops[1]')
+        self.assertTrue(self.wrapper.state.is_member('#ops{1}', 'TEST'))
+    
+    def test_cap(self):
+        self.wrapper._handle_line(':server CAP * LS * :sasl multi-prefix')
+        self.assertEqual(self.sent(), '')
+        self.wrapper._handle_line(':server CAP * LS :userhost-in-names')
+        self.assertEqual(self.sent(), 
+                         'CAP REQ :multi-prefix userhost-in-names\r\n')
+        self.wrapper._handle_line(':server CAP test ACK :multi-prefix')
+        self.assertEqual(self.sent(), 'CAP END\r\n')
+        self.assertEqual(self.wrapper.support.caps, set(['multi-prefix']))
+    
+    def test_split_message(self):
+        # until the server tells us our hostmask the longest is assumed
+        self.assertEquals(self.wrapper.message_budget('#test'), 414)
+        
+        self.wrapper._handle_line(':test!~tester@example.org JOIN #test')
+        self.assertEquals(self.wrapper.hostmask, 'test!~tester@example.org')
+        self.assertEquals(self.wrapper.message_budget('#test'), 469)
+        
+        self.wrapper._handle_line(':test!~tester@example.org NICK :kaa')
+        self.assertEquals(self.wrapper.nick, 'kaa')
+        self.assertEquals(self.wrapper.hostmask, 'kaa!~tester@example.org')
+        
+        lines = self.wrapper.split_message('#test', 'word ' * 300, max_lines=3,
+                                           continuation=' ...')
+        self.assertEquals(len(lines), 3)
+        self.assertTrue(lines[-1].endswith(' ...'))
+        for line in lines:
+            self.wrapper.send_message('#test', line)
+            sent = self.sent()
+            self.assertTrue(len(':kaa!~tester@example.org ' + sent) <= 512)
+    
     def test_send_notice(self):
         pass
     
@@ -0,0 +1,70 @@
+import unittest
+
+from irctk.isupport import ServerSupport, casemapping
+
+
+class CasemappingTestCase(unittest.TestCase):
+    '''This test case is used to test the casemapping function.'''
+    
+    def test_rfc1459(self):
+        fold = casemapping('rfc1459')
+        self.assertEquals(fold('Kaa[A]\\~'), 'kaa{a}|^')
+        self.assertEquals(fold(u'Kaa[A]'), u'kaa{a}')
+        self.assertEquals(fold(u'Caf\xc9[x]'), u'caf\xc9{x}')
+        self.assertEquals(fold('Kaa[A]'), fold('kaa{a}'))
+    
+    def test_ascii(self):
+        fold = casemapping('ascii')
+        self.assertEquals(fold('Kaa[A]'), 'kaa[a]')
+        self.assertEquals(casemapping('strict-rfc1459')('A~'), 'a~')
+        self.assertEquals(casemapping('unknown'), casemapping('rfc1459'))
+
+
+class ServerSupportTestCase(unittest.TestCase):
+    '''This test case is used to test the ServerSupport class methods.'''
+    
+    def setUp(self):
+        self.support = ServerSupport()
+        self.assertEquals(self.support.chantypes, '#&')
+        self.assertEquals(self.support.line_length, 512)
+    
+    def test_feed_isupport(self):
+        self.support.feed_isupport(['CASEMAPPING=ascii', 'PREFIX=(ohv)@%+', 
+                                    'CHANMODES=b,k,l,mnt', 'NETWORK=Test\\x20Net', 
+                                    'TARGMAX=PRIVMSG:4,JOIN:', 'SAFELIST'])
+        self.assertEquals(self.support.fold('A[B]'), 'a[b]')
+        self.assertEquals(self.support.prefix_modes, 'ohv')
+        self.assertEquals(self.support.prefix_symbols, '@%+')
+        self.assertEquals(self.support.chanmodes, ('b', 'k', 'l', 'mnt'))
+        self.assertEquals(self.support.tokens['NETWORK'], 'Test Net')
+        self.assertEquals(self.support.tokens['SAFELIST'], '')
+        self.assertEquals(self.support.targmax, {'PRIVMSG': 4, 'JOIN': None})
+        
+        self.support.feed_isupport(['-CASEMAPPING', '-SAFELIST'])
+        self.assertEquals(self.support.casemapping, 'rfc1459')
+        self.assertFalse('SAFELIST' in self.support.tokens)
+        
+        self.support.reset()
+        self.assertEquals(self.support.targmax, {})
+    
+    def test_malformed(self):
+        self.support.feed_isupport(['TARGMAX=WHO:x,JOIN:,PART:2', 'LINELEN=y'])
+        self.assertEquals(self.support.targmax, {'JOIN': None, 'PART': 2})
+        self.assertEquals(self.support.line_length, 512)
+    
+    def test_is_channel(self):
+        self.assertTrue(self.support.is_channel('#ops'))
+        self.assertTrue(self.support.is_channel('&local'))
+        self.assertFalse(self.support.is_channel('kaa'))
+        self.assertFalse(self.support.is_channel(''))
+    
+    def test_feed_cap(self):
+        self.assertEquals(self.support.feed_cap(['LS', 'sasl=PLAIN']), 'CAP END')
+        self.assertEquals(self.support.available, {'sasl': 'PLAIN'})
+        self.assertEquals(self.support.feed_cap(['NAK', 'multi-prefix']), 
+                          'CAP END')
+        self.assertEquals(self.support.feed_cap(['NEW', 'multi-prefix']), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+import unittest
+import logging
+import threading
+
+from irctk.logging import QueueHandler, LineRateFilter, raw_logger, \
+        configure_logger
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+    
+    def emit(self, record):
+        self.messages.append(self.format(record))
+
+
+class QueueHandlerTestCase(unittest.TestCase):
+    '''This test case is used to test the QueueHandler class methods.'''
+    
+    def setUp(self):
+        self.target = ListHandler()
+        self.handler = QueueHandler(self.target, capacity=2)
+        self.logger = logging.getLogger('irctk.test.queue')
+        self.logger.propagate = False
+        self.logger.addHandler(self.handler)
+    
+    def tearDown(self):
+        self.logger.removeHandler(self.handler)
+        self.handler.close()
+    
+    def test_emit(self):
+        args = ['bar']
+        self.logger.warning('foo %s', args)
+        args.append('baz') # changes after the call are not logged
+        self.handler.flush()
+        self.assertEqual(self.target.messages, ["foo ['bar']"])
+    
+    def test_drop(self):
+        release = threading.Event()
+        blocked = threading.Event()
+        
+        def emit(record):
+            blocked.set()
+            release.wait(2.0)
+            self.target.messages.append(record.getMessage())
+        self.target.emit = emit
+        
+        self.logger.warning('first')
+        blocked.wait(2.0) # the writer now holds the first record
+        for i in range(5):
+            self.logger.warning(str(i))
+        self.assertEqual(self.handler.dropped, 3)
+        
+        release.set()
+        self.handler.flush()
+        self.logger.warning('last')
+        self.handler.flush()
+        self.assertEqual(self.target.messages, 
+                         ['first', '0', '1', '3 log records dropped', 'last'])
+
+
+class LineRateFilterTestCase(unittest.TestCase):
+    '''This test case is used to test the LineRateFilter class methods.'''
+    
+    def record(self, msg):
+        return logging.makeLogRecord({'msg': msg})
+    
+    def test_limit(self):
+        rate_filter = LineRateFilter(lines=3, per=60.0, sample=2)
+        self.assertTrue(rate_filter.filter(self.record('a\nb')))
+        self.assertTrue(rate_filter.filter(self.record('c')))
+        self.assertFalse(rate_filter.filter(self.record('d\ne')))
+        
+        record = self.record('f')
+        self.assertTrue(rate_filter.filter(record))
+        self.assertEqual(record.msg, 'f\n(2 lines not logged)')
+        self.assertFalse(rate_filter.filter(self.record('g')))
+    
+    def test_unicode(self):
+        rate_filter = LineRateFilter(lines=1, per=60.0, sample=2)
+        self.assertTrue(rate_filter.filter(self.record(u'caf\xe9\nna\xefve')))
+        self.assertFalse(rate_filter.filter(self.record(u'caf\xe9')))
+        
+        record = self.record(u'\xe9t\xe9')
+        self.assertTrue(rate_filter.filter(record))
+        self.assertEqual(record.msg, u'\xe9t\xe9\n(1 lines not logged)')
+    
+    def test_unlimited(self):
+        rate_filter = LineRateFilter(lines=0)
+        for i in range(1000):
+            self.assertTrue(rate_filter.filter(self.record('line')))
+
+
+class ConfigureLoggerTestCase(unittest.TestCase):
+    '''This test case is used to test configure_logger.'''
+    
+    def test_levels(self):
+        logger = logging.getLogger('irctk.test.configure')
+        config = {'LOG_LEVEL': 'warning', 'RAW_LOG_LEVEL': logging.ERROR}
+        configure_logger(logger, config)
+        configure_logger(logger, config)
+        
+        raw = raw_logger(logger)
+        self.assertEqual(raw.name, 'irctk.test.configure.raw')
+        self.assertEqual(logger.level, logging.WARNING)
+        self.assertEqual(raw.level, logging.ERROR)
+        self.assertEqual(len(raw.filters), 1)
+    
+    def test_raw_unicode(self):
+        logger = logging.getLogger('irctk.test.unicode')
+        configure_logger(logger, {'RAW_LOG_LINES': 2})
+        
+        raw = raw_logger(logger)
+        target = ListHandler()
+        raw.addHandler(target)
+        raw.propagate = False
+        try:
+            for line in [u'PRIVMSG #x :caf\xe9'] * 3 + ['PRIVMSG #x :plain']:
+                raw.info(line)
+        finally:
+            raw.removeHandler(target)
+        self.assertEqual(target.messages, 
+                         [u'PRIVMSG #x :caf\xe9', u'PRIVMSG #x :caf\xe9'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import unittest
+import urllib2
+
+from irctk.metrics import Histogram, Metrics, MetricsServer, BUCKETS
+
+
+class HistogramTestCase(unittest.TestCase):
+    '''This test case is used to test the Histogram class methods.'''
+    
+    def test_quantile(self):
+        histogram = Histogram()
+        self.assertEquals(histogram.quantile(0.5), 0.0)
+        
+        for i in range(99):
+            histogram.observe(0.00001)
+        histogram.observe(1.0)
+        self.assertEquals(histogram.count, 100)
+        self.assertEquals(histogram.max, 1.0)
+        self.assertEquals(histogram.quantile(0.5), BUCKETS[0])
+        self.assertEquals(histogram.quantile(0.99), BUCKETS[0])
+        self.assertTrue(1.0 <= histogram.quantile(1.0) < 2.0)
+    
+    def test_overflow(self):
+        histogram = Histogram()
+        histogram.observe(BUCKETS[-1] * 2)
+        self.assertEquals(histogram.quantile(0.5), BUCKETS[-1] * 2)
+
+
+class MetricsTestCase(unittest.TestCase):
+    '''This test case is used to test the Metrics class methods.'''
+    
+    def setUp(self):
+        self.metrics = Metrics()
+    
+    def test_incr(self):
+        self.metrics.incr('lines')
+        self.metrics.incr('lines', 2)
+        self.assertEquals(self.metrics.snapshot()['lines'], 3)
+    
+    def test_observe(self):
+        self.metrics.observe('wait', 0.5)
+        self.metrics.observe('wait', 1.5)
+        snapshot = self.metrics.snapshot()
+        self.assertEquals(snapshot['wait.count'], 2)
+        self.assertEquals(snapshot['wait.sum'], 2.0)
+        self.assertEquals(snapshot['wait.max'], 1.5)
+        self.assertTrue('wait.p99' in snapshot)
+    
+    def test_gauge(self):
+        queue = [1, 2, 3]
+        self.metrics.gauge('queue', lambda: len(queue))
+        self.metrics.gauge('broken', lambda: 1 / 0)
+        snapshot = self.metrics.snapshot()
+        self.assertEquals(snapshot['queue'], 3)
+        self.assertFalse('broken' in snapshot)
+    
+    def test_sinks(self):
+        class Sink(object):
+            def __init__(self):
+                self.seen = []
+            
+            def incr(self, name, amount):
+                self.seen.append((name, amount))
+            
+            def observe(self, name, value):
+                self.seen.append((name, value))
+        
+        sink = Sink()
+        self.metrics.add_sink(sink)
+        self.metrics.incr('lines')
+        self.metrics.observe('wait', 0.25)
+        self.metrics.remove_sink(sink)
+        self.metrics.incr('lines')
+        self.assertEquals(sink.seen, [('lines', 1), ('wait', 0.25)])
+    
+    def test_render(self):
+        self.metrics.incr('b')
+        self.metrics.incr('a', 2)
+        self.assertEquals(self.metrics.render(), 'a 2\nb 1\n')
+        self.metrics.reset()
+        self.assertEquals(self.metrics.render(), '\n')
+    
+    def test_server(self):
+        self.metrics.incr('irc.lines_in', 5)
+        server = MetricsServer(port=0, registry=self.metrics)
+        server.start()
+        try:
+            port = server.server.server_address[1]
+            body = urllib2.urlopen('http://127.0.0.1:{0}/'.format(port)).read()
+            self.assertEquals(body, 'irc.lines_in 5\n')
+        finally:
+            server.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+import unittest
+
+from irctk.parser import Message, parse, parse_tags
+
+
+class ParserTestCase(unittest.TestCase):
+    '''This test case is used to test the parse function.'''
+    
+    def test_parse(self):
+        message = parse(':nick!user@host PRIVMSG #testing :test message')
+        self.assertTrue(isinstance(message, Message))
+        self.assertEqual(message.prefix, 'nick!user@host')
+        self.assertEqual(message.command, 'PRIVMSG')
+        self.assertEqual(message.params, ('#testing', 'test message'))
+        self.assertEqual(message.tags, {})
+    
+    def test_parse_no_prefix(self):
+        message = parse('PING :irc.example.net')
+        self.assertEqual(message.prefix, '')
+        self.assertEqual(message.command, 'PING')
+        self.assertEqual(message.params, ('irc.example.net',))
+        
+        message = parse('MODE #foo +o  bar')
+        self.assertEqual(message.params, ('#foo', '+o', 'bar'))
+        
+        message = parse('PRIVMSG #foo :')
+        self.assertEqual(message.params, ('#foo', ''))
+    
+    def test_parse_decoded(self):
+        message = parse(u'PRIVMSG #caf\xe9\xa0bar :hi', raw='PRIVMSG #caf\xe9\xa0bar :hi')
+        self.assertEqual(message.params, (u'#caf\xe9\xa0bar', u'hi'))
+        self.assertEqual(message.raw, 'PRIVMSG #caf\xe9\xa0bar :hi')
+        self.assertEqual(message.received, None)
+        self.assertEqual(parse('PING :x', received=12.5).received, 12.5)
+    
+    def test_parse_tags(self):
+        line = '@time=2012-06-30T23:59:60.419Z;msgid=a\\sb\\:c;+draft/flag :nick!u@h PRIVMSG #c :hi'
+        message = parse(line)
+        self.assertEqual(message.prefix, 'nick!u@h')
+        self.assertEqual(message.command, 'PRIVMSG')
+        self.assertEqual(message.params, ('#c', 'hi'))
+        self.assertEqual(message.tags, {
+                'time': '2012-06-30T23:59:60.419Z',
+                'msgid': 'a b;c',
+                '+draft/flag': '',
+                })
+    
+    def test_parse_tags_escapes(self):
+        self.assertEqual(parse_tags('a=\\\\\\r\\n;b=x\\'), {'a': '\\\r\n', 'b': 'x'})
+    
+    def test_prefix(self):
+        message = parse(':nick!user@host.example.net QUIT :bye')
+        self.assertEqual(message.nick, 'nick')
+        self.assertEqual(message.ident, 'user')
+        self.assertEqual(message.host, 'host.example.net')
+        self.assertEqual(message.user, 'nick')
+        self.assertEqual(message.hostmask, 'user@host.example.net')
+        
+        message = parse(':irc.example.net 001 test :Welcome')
+        self.assertEqual(message.nick, 'irc.example.net')
+        self.assertEqual(message.ident, '')
+        self.assertEqual(message.host, '')
+        self.assertEqual(message.user, 'irc.example.net')
+        self.assertEqual(message.hostmask, 'irc.example.net')
+    
+    def test_context(self):
+        message = parse(':nick!user@host PRIVMSG #test :.foo bar', network='vox')
+        self.assertEqual(message['prefix'], 'nick!user@host')
+        self.assertEqual(message['command'], 'PRIVMSG')
+        self.assertEqual(message['args'], ('#test', '.foo bar'))
+        self.assertEqual(message['sender'], '#test')
+        self.assertEqual(message['user'], 'nick')
+        self.assertEqual(message['hostmask'], 'user@host')
+        self.assertEqual(message['message'], '.foo bar')
+        self.assertEqual(message['network'], 'vox')
+        self.assertEqual(message.get('stale', False), False)
+        self.assertRaises(KeyError, lambda: message['raw'])
+        self.assertEqual(dict(message)['sender'], '#test')
+        
+        message = parse('PING')
+        self.assertEqual(message['sender'], '')
+        self.assertEqual(message['message'], '')
+    
+    def test_immutable(self):
+        for message in (parse('PING :server'), 
+                        Message('PING :server', '', 'PING', ('server',))):
+            self.assertTrue(type(message) is Message)
+            self.assertEqual(message.params, ('server',))
+            self.assertRaises(AttributeError, setattr, message, 'command', 'PONG')
+            self.assertRaises(AttributeError, setattr, message, 'foo', 'bar')
+            self.assertRaises(AttributeError, delattr, message, 'command')
+    
+    def test_malformed(self):
+        self.assertRaises(Exception, parse, '')
+        self.assertRaises(Exception, parse, '@tags')
+        self.assertRaises(Exception, parse, ':prefix')
+        self.assertRaises(Exception, parse, ':prefix ')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,7 @@
 import unittest
 
-from irctk.plugins import Context, PluginHandler
+from irctk.plugins import Context, Invocation, PluginHandler
+from irctk.parser import parse
 
 
 class ContextTestCase(unittest.TestCase):
@@ -59,11 +60,133 @@ class PluginHandlerTestCase(unittest.TestCase):
         self.plugins.update_plugins(plugin, 'PLUGINS')
         self.assertEquals(self.config['PLUGINS'][0], plugin)
     
+    def test_index_plugins(self):
+        self.plugins.add_plugin('hook', 'func1')
+        self.plugins.add_plugin('JOIN', 'func2', event=True)
+        self.assertEquals(self.plugins.hooks['PLUGINS']['hook']['funcs'], ['func1'])
+        self.assertEquals(self.plugins.hooks['EVENTS']['JOIN']['funcs'], ['func2'])
+        
+        self.plugins.remove_plugin('hook', 'func1')
+        self.assertEquals(self.plugins.hooks['PLUGINS'], {})
+    
+    def test_index_reuse(self):
+        self.plugins.update_plugins({'hook': 'foo', 'funcs': ['func'], 
+                                     'cache': 60}, 'PLUGINS')
+        invocation = self.plugins.hooks['PLUGINS']['foo']
+        invocation.cache.set('args', ['reply'])
+        
+        # unrelated plugins leave it, and its cache, as it was
+        self.plugins.add_plugin('bar', 'func')
+        self.plugins.add_plugin('JOIN', 'func', event=True)
+        self.plugins.remove_plugin('bar', 'func')
+        self.assertTrue(self.plugins.hooks['PLUGINS']['foo'] is invocation)
+        self.assertEquals(invocation.cache.get('args'), (True, ['reply']))
+        
+        self.plugins.add_plugin('foo', 'func2')
+        self.assertFalse(self.plugins.hooks['PLUGINS']['foo'] is invocation)
+        self.assertEquals(self.plugins.hooks['PLUGINS']['foo']['funcs'], 
+                          ['func', 'func2'])
+    
+    def test_reload_plugins(self):
+        self.plugins.add_plugin('foo', _reload_test_funct)
+        self.plugins.add_plugin('bar', 'func')
+        published = self.config['PLUGINS']
+        
+        def load():
+            # the old function is gone from the staged lists only
+            self.assertEquals(self.plugins.hooks['PLUGINS']['foo']['funcs'],
+                              [_reload_test_funct])
+            self.plugins.add_plugin('foo', 'new_func')
+            self.plugins.add_plugin('baz', 'func')
+        
+        self.plugins.reload_plugins(__file__.replace('.pyc', '.py'), load)
+        self.assertEquals(published, [{'hook': 'foo',
+                                       'funcs': [_reload_test_funct]},
+                                      {'hook': 'bar', 'funcs': ['func']}])
+        self.assertEquals(self.plugins.hooks['PLUGINS']['foo']['funcs'],
+                          ['new_func'])
+        self.assertEquals(sorted(self.plugins.hooks['PLUGINS']),
+                          ['bar', 'baz', 'foo'])
+        
+        def fail():
+            self.plugins.add_plugin('qux', 'func')
+            raise SyntaxError('invalid syntax')
+        
+        tables = self.config['PLUGINS']
+        self.assertRaises(SyntaxError, self.plugins.reload_plugins, 'x', fail)
+        self.assertTrue(self.config['PLUGINS'] is tables)
+        self.assertFalse('qux' in self.plugins.hooks['PLUGINS'])
+    
+    def test_dispatch(self):
+        tasks = []
+        self.plugins.enqueue_plugin = lambda *task: tasks.append(task)
+        self.plugins.add_plugin('foo', 'func1')
+        self.plugins.add_plugin('PRIVMSG', 'func2', event=True)
+        
+        context = parse(':nick!user@host PRIVMSG #test :.foo bar baz')
+        self.plugins.dispatch(context)
+        self.assertEquals(len(tasks), 2)
+        self.assertEquals(tasks[0][0]['hook'], 'foo')
+        self.assertTrue(tasks[0][1] is context)
+        self.assertEquals(tasks[0][2], 'bar baz')
+        self.assertEquals(tasks[1][0]['hook'], 'PRIVMSG')
+        
+        tasks[:] = []
+        context = parse(':nick!user@host PRIVMSG #test :.foobar')
+        self.plugins.dispatch(context, prefix='.')
+        self.assertEquals(len(tasks), 1)
+        self.assertEquals(tasks[0][0]['hook'], 'PRIVMSG')
+    
     def test_enqueue_plugin(self):
         pass
     
+    def test_cache(self):
+        replies = []
+        reply = lambda message, line, action, notice: replies.append(message)
+        plugins = PluginHandler(self.config, self.logger, reply)
+        
+        calls = []
+        def lookup(context):
+            calls.append(context.args)
+            return 'result for ' + context.args
+        
+        plugins.update_plugins({'hook': 'lookup', 'funcs': [lookup],
+                                'cache': 60}, 'PLUGINS')
+        
+        plugin = plugins.hooks['PLUGINS']['lookup']
+        context = parse(':nick!user@host PRIVMSG #test :.lookup foo')
+        
+        for args in ('foo', 'foo', 'bar'):
+            future = plugins.enqueue_plugin(plugin, context, args)
+            self.assertEquals(future.result(1.0), None)
+        self.assertEquals(calls, ['foo', 'bar'])
+        self.assertEquals(replies, ['result for foo'] * 2 + ['result for bar'])
+    
     def test_dequeue_plugin(self):
-        pass
+        replies = []
+        reply = lambda *args: replies.append(args)
+        plugins = PluginHandler(self.config, self.logger, reply)
+        
+        def with_args(context):
+            return context.args
+        
+        def without_args():
+            return 'no args'
+        
+        plugin = Invocation({'hook': 'foo', 'funcs': [with_args, without_args],
+                             'notice': True})
+        self.assertEquals(plugin.funcs, ((with_args, True),
+                                         (without_args, False)))
+        self.assertEquals(plugin['hook'], 'foo')
+        
+        context = parse(':nick!user@host PRIVMSG #test :.foo bar')
+        plugins.dequeue_plugin(plugin, Context(context, 'bar'))
+        self.assertEquals(replies, [('bar', context, False, True),
+                                    ('no args', context, False, True)])
+
+
+def _reload_test_funct():
+    pass
 
 
 if __name__ == '__main__':
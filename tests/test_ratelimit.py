@@ -0,0 +1,104 @@
+import unittest
+
+from irctk.ratelimit import TokenBucket, SendScheduler
+
+
+class TokenBucketTestCase(unittest.TestCase):
+    '''This test case is used to test the TokenBucket class methods.'''
+    
+    def setUp(self):
+        self.bucket = TokenBucket(5, 10.0)
+        self.assertEquals(self.bucket.capacity, 5.0)
+        self.assertEquals(self.bucket.fill_rate, 0.5)
+    
+    def test_consume(self):
+        now = self.bucket.timestamp
+        for x in range(5):
+            self.assertEquals(self.bucket.delay(1, now), 0.0)
+            self.bucket.consume(1, now)
+        self.assertEquals(self.bucket.delay(1, now), 2.0)
+        self.assertEquals(self.bucket.delay(1, now + 2.0), 0.0)
+    
+    def test_delay(self):
+        now = self.bucket.timestamp
+        self.assertEquals(self.bucket.delay(50, now), 0.0)
+        self.bucket.consume(50, now)
+        self.assertEquals(self.bucket.delay(1, now), 92.0)
+
+
+class SendSchedulerTestCase(unittest.TestCase):
+    '''This test case is used to test the SendScheduler class methods.'''
+    
+    def setUp(self):
+        self.scheduler = SendScheduler(lines=3, bytes=0, per=10.0)
+    
+    def drain(self):
+        lines = []
+        while True:
+            line = self.scheduler.get(block=False)
+            if line is None:
+                return lines
+            lines.append(line)
+    
+    def test_put(self):
+        self.scheduler.put('PRIVMSG #foo :bar')
+        self.assertEquals(len(self.scheduler), 1)
+        self.assertEquals(self.scheduler.delay(), 0.0)
+        self.assertEquals(self.drain(), ['PRIVMSG #foo :bar'])
+        self.assertEquals(self.scheduler.delay(), None)
+    
+    def test_round_robin(self):
+        for x in range(3):
+            self.scheduler.put('PRIVMSG #busy :{0}'.format(x))
+        self.scheduler.put('PRIVMSG #quiet :hi')
+        
+        self.assertEquals(self.drain(), [
+                'PRIVMSG #busy :0',
+                'PRIVMSG #quiet :hi',
+                'PRIVMSG #busy :1',
+                ])
+        self.assertEquals(len(self.scheduler), 1)
+        self.assertTrue(self.scheduler.delay() > 0)
+    
+    def test_priority(self):
+        for x in range(4):
+            self.scheduler.put('PRIVMSG #busy :{0}'.format(x))
+        self.drain()
+        
+        self.scheduler.put('PONG :server')
+        self.scheduler.put('QUIT :bye')
+        self.assertEquals(self.drain(), ['PONG :server', 'QUIT :bye'])
+    
+    def test_bytes(self):
+        self.scheduler = SendScheduler(lines=0, bytes=40, per=10.0)
+        self.scheduler.put('PRIVMSG #foo :' + 'a' * 20)
+        self.scheduler.put('PRIVMSG #foo :' + 'b' * 20)
+        self.assertEquals(len(self.drain()), 1)
+    
+    def test_hold(self):
+        self.scheduler.put('PRIVMSG #foo :bar')
+        self.scheduler.hold()
+        self.assertEquals(self.scheduler.delay(), None)
+        
+        self.scheduler.put('NICK kaa', priority=True)
+        self.assertEquals(self.drain(), ['NICK kaa'])
+        
+        self.scheduler.requeue(['PRIVMSG #foo :unsent'])
+        self.scheduler.release()
+        self.assertEquals(self.drain(), 
+                          ['PRIVMSG #foo :unsent', 'PRIVMSG #foo :bar'])
+    
+    def test_fold(self):
+        self.scheduler = SendScheduler(lines=0, bytes=0)
+        self.scheduler.fold = lambda target: target.lower()
+        self.scheduler.put('PRIVMSG #ops :live')
+        self.scheduler.put('PRIVMSG #other :hi')
+        self.scheduler.requeue(['PRIVMSG #Ops :unsent'])
+        self.assertEquals(len(self.scheduler.queues), 2)
+        self.assertEquals(self.drain(), ['PRIVMSG #Ops :unsent', 
+                                         'PRIVMSG #other :hi', 
+                                         'PRIVMSG #ops :live'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+import unittest
+import socket
+
+from irctk.reconnect import Backoff, ReconnectManager
+
+
+class BackoffTestCase(unittest.TestCase):
+    '''This test case is used to test the Backoff class methods.'''
+    
+    def setUp(self):
+        self.backoff = Backoff(2.0, 10.0, random=lambda: 1.0)
+    
+    def test_next(self):
+        delays = [self.backoff.next() for x in range(5)]
+        self.assertEquals(delays, [2.0, 4.0, 8.0, 10.0, 10.0])
+        
+        self.backoff.reset()
+        self.assertEquals(self.backoff.next(), 2.0)
+    
+    def test_jitter(self):
+        self.backoff.random = lambda: 0.0
+        self.assertEquals(self.backoff.next(), 1.0)
+        self.assertEquals(self.backoff.next(), 2.0)
+
+
+class ReconnectManagerTestCase(unittest.TestCase):
+    '''This test case is used to test the ReconnectManager class methods.'''
+    
+    def setUp(self):
+        self.scheduled = []
+        self.attempts = []
+        self.fail = False
+        self.manager = ReconnectManager(
+                self.attempt,
+                [('a', 6667, False), ('b', 6697, True)],
+                call_later=lambda delay, func: self.scheduled.append((delay, func)),
+                backoff=Backoff(2.0, 10.0, random=lambda: 1.0))
+    
+    def attempt(self, host, port, ssl):
+        self.attempts.append((host, port, ssl))
+        if self.fail:
+            raise socket.error('refused')
+    
+    def run_scheduled(self):
+        delay, func = self.scheduled.pop(0)
+        func()
+        return delay
+    
+    def test_lost(self):
+        self.manager.lost()
+        self.manager.lost() # already waiting
+        self.assertEquals(len(self.scheduled), 1)
+        
+        self.assertEquals(self.run_scheduled(), 2.0)
+        self.assertEquals(self.attempts, [('a', 6667, False)])
+        self.assertEquals(self.manager.state, ReconnectManager.CONNECTING)
+        
+        self.manager.connected()
+        self.assertEquals(self.manager.state, ReconnectManager.CONNECTED)
+        self.assertEquals(self.scheduled, [])
+    
+    def test_rotate(self):
+        self.fail = True
+        self.manager.lost()
+        delays = [self.run_scheduled() for x in range(3)]
+        self.assertEquals(delays, [2.0, 4.0, 8.0])
+        self.assertEquals([host for host, _, _ in self.attempts], 
+                          ['a', 'b', 'a'])
+        
+        self.fail = False
+        self.run_scheduled()
+        self.manager.connected()
+        self.assertEquals(self.manager.server, ('b', 6697, True))
+        
+        # the backoff only starts over once registered
+        self.manager.lost()
+        self.assertEquals(self.scheduled[-1][0], 10.0)
+        self.run_scheduled()
+        self.manager.connected()
+        self.manager.registered()
+        self.manager.lost()
+        self.assertEquals(self.scheduled[-1][0], 2.0)
+    
+    def test_failed(self):
+        # a first connection that fails moves on to the next server
+        self.manager.failed(socket.error('refused'))
+        self.assertEquals(self.manager.state, ReconnectManager.WAITING)
+        self.assertEquals(self.run_scheduled(), 2.0)
+        self.assertEquals(self.attempts, [('b', 6697, True)])
+        
+        self.manager.close()
+        self.manager.failed(socket.error('refused'))
+        self.assertEquals(self.scheduled, [])
+    
+    def test_close(self):
+        self.manager.lost()
+        self.manager.close()
+        self.run_scheduled()
+        self.assertEquals(self.attempts, [])
+        
+        self.manager.lost()
+        self.assertEquals(self.scheduled, [])
+        
+        self.manager.open()
+        self.manager.lost(0)
+        self.assertEquals(self.run_scheduled(), 0)
+        self.assertEquals(len(self.attempts), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
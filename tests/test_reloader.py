@@ -0,0 +1,70 @@
+import unittest
+
+from irctk.reloader import StatWatcher, InotifyWatcher
+
+import os
+import shutil
+import tempfile
+import threading
+
+
+class StatWatcherTestCase(unittest.TestCase):
+    '''This test case is used to test the StatWatcher class methods.'''
+    
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.write('existing.py')
+        self.watcher = self.create_watcher()
+        self.watcher.watch(self.directory)
+    
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+    
+    def create_watcher(self):
+        return StatWatcher(wait=0.01, debounce=0.05)
+    
+    def write(self, name, mtime=None):
+        filename = os.path.join(self.directory, name)
+        with open(filename, 'w') as f:
+            f.write('# plugin\n')
+        if mtime is not None:
+            os.utime(filename, (mtime, mtime))
+        return filename
+    
+    def test_new_file(self):
+        self.assertEquals(self.watcher.poll(0.05), set())
+        filename = self.write('new.py')
+        self.write('.new.py.swp')
+        self.assertEquals(self.watcher.poll(1.0), set([filename]))
+    
+    def test_changes(self):
+        filename = os.path.join(self.directory, 'existing.py')
+        
+        def save():
+            # an editor saving the same file several times in a burst
+            for x in range(3):
+                self.write('existing.py', os.stat(filename).st_mtime + 1)
+        
+        timer = threading.Timer(0.05, save)
+        timer.start()
+        self.assertEquals(self.watcher.changes(), set([filename]))
+        timer.join()
+
+
+class InotifyWatcherTestCase(StatWatcherTestCase):
+    '''This test case is used to test the InotifyWatcher class methods.'''
+    
+    def create_watcher(self):
+        try:
+            return InotifyWatcher(wait=0.01, debounce=0.05)
+        except OSError:
+            return StatWatcher(wait=0.01, debounce=0.05)
+    
+    def tearDown(self):
+        StatWatcherTestCase.tearDown(self)
+        if isinstance(self.watcher, InotifyWatcher):
+            self.watcher.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+import unittest
+
+from irctk.state import StateTracker
+from irctk.parser import parse
+
+
+class StateTrackerTestCase(unittest.TestCase):
+    '''This test case is used to test the StateTracker class methods.'''
+    
+    def setUp(self):
+        self.state = StateTracker('kaa')
+        self.feed(':server 001 kaa :Welcome',
+                  ':kaa!~kaa@bot.host JOIN #ops',
+                  ':server 353 kaa = #ops :@kaa +voiced plain!~p@host',
+                  ':server 366 kaa #ops :End of /NAMES list.')
+    
+    def feed(self, *lines):
+        for line in lines:
+            self.state.feed(parse(line))
+    
+    def test_names(self):
+        self.assertEquals(sorted(self.state.members('#ops')),
+                          ['kaa', 'plain', 'voiced'])
+        self.assertEquals(self.state.modes('#ops', 'kaa'), 'o')
+        self.assertEquals(self.state.modes('#ops', 'voiced'), 'v')
+        self.assertEquals(self.state.modes('#ops', 'plain'), '')
+        self.assertEquals(self.state.user('plain').host, 'host')
+        self.assertTrue(self.state.is_member('#OPS', 'Plain'))
+    
+    def test_join_part(self):
+        self.feed(':kaa!~kaa@bot.host JOIN #two',
+                  ':plain!~p@host JOIN #two',
+                  ':stranger!~s@host JOIN #elsewhere')
+        self.assertEquals(sorted(self.state.channels('plain')), ['#ops', '#two'])
+        self.assertEquals(self.state.channel('#elsewhere'), None)
+        
+        self.feed(':plain!~p@host PART #ops :bye')
+        self.assertFalse(self.state.is_member('#ops', 'plain'))
+        self.assertEquals(self.state.channels('plain'), ['#two'])
+        
+        self.feed(':kaa!~kaa@bot.host PART #two')
+        self.assertEquals(self.state.channels(), ['#ops'])
+        self.assertEquals(self.state.user('plain'), None)
+    
+    def test_kick_quit(self):
+        self.feed(':kaa!~kaa@bot.host KICK #ops voiced :out')
+        self.assertFalse(self.state.is_member('#ops', 'voiced'))
+        self.assertEquals(self.state.user('voiced'), None)
+        
+        self.feed(':plain!~p@host QUIT :gone')
+        self.assertEquals(self.state.members('#ops'), ['kaa'])
+        
+        self.feed(':op!~o@host KICK #ops kaa :bye')
+        self.assertEquals(self.state.channels(), [])
+        self.assertEquals(self.state.users, {})
+    
+    def test_nick(self):
+        self.feed(':voiced!~v@host NICK :renamed')
+        self.assertEquals(self.state.modes('#ops', 'renamed'), 'v')
+        self.assertEquals(self.state.user('voiced'), None)
+        
+        self.feed(':kaa!~kaa@bot.host NICK :kaa_')
+        self.assertEquals(self.state.nick, 'kaa_')
+        self.assertTrue(self.state.is_member('#ops', 'kaa_'))
+    
+    def test_mode(self):
+        self.feed(':kaa!~kaa@bot.host MODE #ops +ov-v+kl plain plain voiced '
+                  'secret 10',
+                  ':kaa!~kaa@bot.host MODE #ops +b *!*@spam')
+        self.assertEquals(self.state.modes('#ops', 'plain'), 'ov')
+        self.assertEquals(self.state.modes('#ops', 'voiced'), '')
+        self.assertEquals(self.state.channel('#ops').modes,
+                          {'k': 'secret', 'l': '10'})
+        
+        self.feed(':kaa!~kaa@bot.host MODE #ops -l-o plain')
+        self.assertEquals(self.state.modes('#ops', 'plain'), 'v')
+        self.assertEquals(self.state.channel('#ops').modes, {'k': 'secret'})
+    
+    def test_mode_reply(self):
+        self.feed(':server 324 kaa #ops +nk secret')
+        modes = {'n': None, 'k': 'secret'}
+        self.assertEquals(self.state.channel('#ops').modes, modes)
+        
+        self.feed(':server 324 kaa', ':server 324 kaa #ops')
+        self.assertEquals(self.state.channel('#ops').modes, modes)
+    
+    def test_topic(self):
+        self.feed(':server 332 kaa #ops :old topic',
+                  ':plain!~p@host TOPIC #ops :new topic')
+        self.assertEquals(self.state.channel('#ops').topic, 'new topic')
+    
+    def test_interned(self):
+        self.feed(':kaa!~kaa@bot.host JOIN #two',
+                  ':server 353 kaa = #two :plain')
+        channel_key = [key for key in self.state.channels_by_name
+                       if key == '#two'][0]
+        user_key = [key for key in self.state.channel('#two').members
+                    if key == 'plain'][0]
+        self.assertTrue(user_key in self.state.users)
+        self.assertTrue(channel_key is [key for key in
+                        self.state.user('plain').channels if key == '#two'][0])
+        self.assertTrue(user_key is [key for key in
+                        self.state.channel('#ops').members if key == 'plain'][0])
+
+if __name__ == '__main__':
+    unittest.main()
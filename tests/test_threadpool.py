@@ -1,8 +1,9 @@
 import unittest
 
-from irctk.threadpool import ThreadPool, Worker
+from irctk.threadpool import ThreadPool, Worker, Future, TaskTimeout
 
 import Queue
+import threading
 import time
 
 
@@ -13,7 +14,8 @@ class WorkerTestCase(unittest.TestCase):
         self.tasks = Queue.Queue()
         for x in range(3):
             self.tasks.put((_worker_test_funct,
-                    (self, 'testString'), {'c': False}))
+                    (self, 'testString'), {'c': False}, time.time(),
+                    Future(), None))
         self.logger = None
         self.worker = Worker(self.tasks, self.logger)
         
@@ -35,23 +37,87 @@ class ThreadPoolTestCase(unittest.TestCase):
     def setUp(self):
         self.workers = 3
         self.logger = None
-        self.tp = ThreadPool(self.workers, self.logger)
-        # Give the htread pool time to get up to speed.
-        time.sleep(0.3)
+        self.tp = ThreadPool(self.workers, 5, self.logger, max_wait=60.0)
         
         self.assertEquals(self.tp.workers, 3)
+        self.assertEquals(self.tp.max_workers, 5)
         self.assertEquals(self.tp.logger, None)
-        self.assertEquals(self.tp.wait, 0.01)
-        self.assertTrue(self.tp.daemon)
     
     def test_enqueue_task(self):
-        self.tp.enqueue_task('foo', 'bar')
-        task = self.tp.tasks.get()
-        self.assertEquals(('foo', ('bar',), {}), task)
+        done = threading.Event()
+        results = []
         
-        self.tp.enqueue_task('foo', 'bar', test=True)
-        task = self.tp.tasks.get()
-        self.assertEquals(('foo', ('bar',), {'test': True}), task)
+        def task(*args, **kwargs):
+            results.append((args, kwargs))
+            done.set()
+        
+        self.tp.enqueue_task(task, 'bar', test=True)
+        done.wait(1.0)
+        self.assertEquals([(('bar',), {'test': True})], results)
+    
+    def test_future(self):
+        future = self.tp.enqueue_task(lambda x: x * 2, 21)
+        self.assertEquals(future.result(1.0), 42)
+        self.assertTrue(future.done())
+        
+        future = self.tp.enqueue_task(lambda: 1 / 0)
+        self.assertTrue(isinstance(future.exception(1.0), ZeroDivisionError))
+    
+    def test_cancel(self):
+        future = Future()
+        self.assertTrue(future.cancel())
+        self.assertFalse(future.set_running())
+        self.assertTrue(future.cancelled())
+    
+    def test_timeout(self):
+        release = threading.Event()
+        future = self.tp.submit(release.wait, timeout=0.05)
+        workers = self.tp.workers
+        self.assertRaises(TaskTimeout, future.result, 1.0)
+        self.assertEquals(self.tp.workers, workers)
+        
+        # the pool keeps its capacity while the runaway task is stuck
+        self.assertEquals(self.tp.enqueue_task(lambda: 'ok').result(1.0), 'ok')
+        release.set()
+    
+    def test_earlier_timeout(self):
+        release = threading.Event()
+        slow = self.tp.submit(release.wait, timeout=30.0)
+        fast = self.tp.submit(release.wait, timeout=0.05)
+        
+        # the later alarm is replaced, rather than overrunning the earlier
+        self.assertRaises(TaskTimeout, fast.result, 1.0)
+        self.assertFalse(slow.done())
+        self.assertEquals(self.tp.alarm[0], self.tp.deadlines[0][0])
+        release.set()
+    
+    def test_grow(self):
+        release = threading.Event()
+        for x in range(8):
+            self.tp.enqueue_task(release.wait)
+        self.assertEquals(self.tp.workers, 5)
+        release.set()
+        self.tp.tasks.join()
+    
+    def wait_for(self, predicate, timeout=2.0):
+        deadline = time.time() + timeout
+        while not predicate() and time.time() < deadline:
+            time.sleep(0.01)
+        return predicate()
+    
+    def test_shrink(self):
+        self.tp.idle_timeout = 0.0
+        self.test_grow()
+        
+        # spare workers retire on their own, with no further tasks
+        self.assertTrue(self.wait_for(lambda: self.tp.workers == 3))
+        self.assertTrue(self.wait_for(lambda: self.tp.idle == 3))
+        self.assertEquals(self.tp.enqueue_task(lambda: 'ok').result(1.0), 'ok')
+    
+    def test_idle(self):
+        self.tp.enqueue_task(time.sleep, 0)
+        self.tp.tasks.join()
+        self.assertEquals(self.tp.idle, self.tp.workers)
     
     def test_worker(self):
         pass